@@ -0,0 +1,410 @@
+import asyncio
+import logging
+import os
+import shutil
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from importlib.util import find_spec
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from lazy_imports import lazy_import
+
+# Optional, exports are unavailable without it; only imported when exporting
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+# Columnar exports of orders, products and reviews for offline analytics.
+# Each run streams the collections in created_at order into typed Arrow
+# tables, partitioned by month of creation:
+#   <export_dir>/<dataset>/created_month=YYYY-MM/part-<run_id>.parquet
+# Incremental runs only read documents created after the dataset's
+# watermark and add new part files; full runs rebuild the dataset directory.
+# Files are written to a staging directory first and only moved into place
+# once every dataset of the run has been written, so readers never see half
+# a run. On replica sets all datasets are read from one snapshot session;
+# otherwise the shared created_at upper bound keeps the run consistent for
+# append-only data (line items, reviews). Mutable fields (order status,
+# stock, price) are exported as they were when the row was first exported;
+# a full run refreshes them.
+
+logger = logging.getLogger(__name__)
+
+DATASETS = ("order_items", "products", "reviews")
+FORMATS = ("parquet", "arrow")
+
+READ_BATCH_SIZE = 5000
+ROW_GROUP_SIZE = 50000
+
+# Documents created this recently may still be in flight; leave them for the next run
+SETTLE_SECONDS = 60
+
+
+@lru_cache(maxsize=None)
+def schema(dataset: str):
+    timestamp = pa.timestamp("us", tz="UTC")
+    return {
+        "order_items": pa.schema([
+            ("order_id", pa.string()),
+            ("line_no", pa.int16()),
+            ("user_id", pa.string()),
+            ("created_at", timestamp),
+            ("status", pa.string()),
+            ("payment_status", pa.string()),
+            ("product_id", pa.string()),
+            ("product_name", pa.string()),
+            ("quantity", pa.int32()),
+            ("unit_price", pa.float64()),
+            ("line_total", pa.float64()),
+            ("order_total", pa.float64()),
+            ("order_item_count", pa.int16()),
+        ]),
+        "products": pa.schema([
+            ("id", pa.string()),
+            ("name", pa.string()),
+            ("category", pa.string()),
+            ("brand", pa.string()),
+            ("price", pa.float64()),
+            ("stock", pa.int32()),
+            ("rating", pa.float64()),
+            ("reviews_count", pa.int32()),
+            ("features", pa.list_(pa.string())),
+            ("created_at", timestamp),
+        ]),
+        "reviews": pa.schema([
+            ("id", pa.string()),
+            ("product_id", pa.string()),
+            ("user_id", pa.string()),
+            ("rating", pa.int8()),
+            ("comment", pa.string()),
+            ("created_at", timestamp),
+        ]),
+    }[dataset]
+
+
+def _parse_ts(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _order_rows(order: dict) -> List[dict]:
+    created_at = _parse_ts(order["created_at"])
+    items = order.get("items", [])
+    return [{
+        "order_id": order["id"],
+        "line_no": i,
+        "user_id": order["user_id"],
+        "created_at": created_at,
+        "status": order.get("status"),
+        "payment_status": order.get("payment_status"),
+        "product_id": item["product_id"],
+        "product_name": item.get("product_name"),
+        "quantity": item["quantity"],
+        "unit_price": item["price"],
+        "line_total": item["price"] * item["quantity"],
+        "order_total": order["total_amount"],
+        "order_item_count": len(items),
+    } for i, item in enumerate(items)]
+
+
+def _product_rows(product: dict) -> List[dict]:
+    row = {name: product.get(name) for name in schema("products").names}
+    row["features"] = product.get("features") or []
+    row["created_at"] = _parse_ts(product["created_at"])
+    return [row]
+
+
+def _review_rows(review: dict) -> List[dict]:
+    row = {name: review.get(name) for name in schema("reviews").names}
+    row["created_at"] = _parse_ts(review["created_at"])
+    return [row]
+
+
+class _DatasetWriter:
+    """Buffers rows per month partition and writes them as row groups."""
+
+    def __init__(self, root: Path, schema, fmt: str, run_id: str):
+        self.root = root
+        self.schema = schema
+        self.fmt = fmt
+        self.run_id = run_id
+        self._buffers: Dict[str, List[dict]] = {}
+        self._writers: Dict[str, object] = {}
+        self.rows: Dict[str, int] = {}
+
+    def _path(self, month: str) -> Path:
+        return self.root / f"created_month={month}" / f"part-{self.run_id}.{self.fmt}"
+
+    def _flush(self, month: str):
+        rows = self._buffers.pop(month, None)
+        if not rows:
+            return
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        writer = self._writers.get(month)
+        if writer is None:
+            path = self._path(month)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if self.fmt == "parquet":
+                writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+            else:
+                writer = pa.ipc.new_file(path, self.schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+            self._writers[month] = writer
+        writer.write_table(table)
+        self.rows[month] = self.rows.get(month, 0) + len(rows)
+
+    def write(self, rows: List[dict]):
+        for row in rows:
+            month = row["created_at"].strftime("%Y-%m")
+            buffer = self._buffers.setdefault(month, [])
+            buffer.append(row)
+            if len(buffer) >= ROW_GROUP_SIZE:
+                self._flush(month)
+
+    def close(self) -> List[dict]:
+        for month in list(self._buffers):
+            self._flush(month)
+        for writer in self._writers.values():
+            writer.close()
+        return [
+            {"path": str(self._path(month).relative_to(self.root)), "rows": rows}
+            for month, rows in sorted(self.rows.items())
+        ]
+
+
+class AnalyticsExporter:
+    def __init__(self, db, export_dir: Path, archive=None, settle_seconds: int = SETTLE_SECONDS):
+        self.db = db
+        self.export_dir = Path(export_dir)
+        self.archive = archive
+        self.settle_seconds = settle_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def available() -> bool:
+        return find_spec("pyarrow") is not None
+
+    async def ensure_indexes(self):
+        await self.db.orders.create_index("created_at")
+        await self.db.products.create_index("created_at")
+        await self.db.reviews.create_index("created_at")
+        await self.db.export_runs.create_index("started_at")
+
+    # ---- run bookkeeping ----
+
+    async def _acquire_run_lock(self, hold: timedelta) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.export_state.update_one(
+                {"_id": "_lock", "until": {"$lt": now}}, {"$set": {"until": now + hold}}, upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def _release_run_lock(self):
+        await self.db.export_state.update_one({"_id": "_lock"}, {"$set": {"until": datetime.now(timezone.utc)}})
+
+    async def watermarks(self) -> Dict[str, Optional[str]]:
+        marks = {dataset: None for dataset in DATASETS}
+        async for state in self.db.export_state.find({"_id": {"$in": list(DATASETS)}}):
+            marks[state["_id"]] = state.get("watermark")
+        return marks
+
+    async def get_run(self, run_id: str) -> Optional[dict]:
+        return await self.db.export_runs.find_one({"_id": run_id})
+
+    async def list_runs(self, limit: int = 20) -> List[dict]:
+        return await self.db.export_runs.find({}).sort("started_at", -1).limit(limit).to_list(limit)
+
+    async def start_run(self, datasets: List[str], full: bool = False, fmt: str = "parquet") -> dict:
+        """Start an export in the background and return its run record."""
+        run, _ = await self._start(datasets, full, fmt)
+        return run
+
+    async def run(self, datasets: List[str] = DATASETS, full: bool = False, fmt: str = "parquet") -> dict:
+        """Run an export to completion (used by the scheduler and scripts)."""
+        run, task = await self._start(list(datasets), full, fmt)
+        await task
+        return await self.get_run(run["_id"])
+
+    async def _start(self, datasets: List[str], full: bool, fmt: str):
+        if not self.available():
+            raise RuntimeError("pyarrow is not installed")
+        unknown = set(datasets) - set(DATASETS)
+        if unknown or not datasets:
+            raise ValueError(f"Unknown datasets: {', '.join(sorted(unknown)) or 'none given'}")
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        if not await self._acquire_run_lock(timedelta(hours=1)):
+            raise RuntimeError("Another export is already running")
+
+        run = {
+            "_id": uuid.uuid4().hex,
+            "datasets": list(datasets),
+            "mode": "full" if full else "incremental",
+            "format": fmt,
+            "state": "running",
+            "started_at": datetime.now(timezone.utc),
+        }
+        await self.db.export_runs.insert_one(run)
+        self._task = asyncio.create_task(self._execute(run))
+        return run, self._task
+
+    async def _execute(self, run: dict):
+        try:
+            await self._recover(run["_id"])
+            await self._export(run)
+        except Exception as e:
+            logger.exception(f"Analytics export {run['_id']} failed")
+            await self.db.export_runs.update_one(
+                {"_id": run["_id"]},
+                {"$set": {"state": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc)}}
+            )
+            shutil.rmtree(self._staging_dir(run["_id"]), ignore_errors=True)
+        finally:
+            await self._release_run_lock()
+
+    # ---- reading ----
+
+    @asynccontextmanager
+    async def _snapshot_session(self):
+        # Snapshot reads need a replica set (MongoDB 5.0+)
+        session = None
+        try:
+            hello = await self.db.command("hello")
+            if "setName" in hello:
+                session = await self.db.client.start_session(snapshot=True)
+        except Exception:
+            session = None
+        try:
+            yield session
+        finally:
+            if session is not None:
+                await session.end_session()
+
+    async def _documents(self, collection: str, window: dict, session) -> AsyncIterator[List[dict]]:
+        cursor = self.db[collection].find(
+            {"created_at": window}, {"_id": 0}, session=session
+        ).sort("created_at", 1).batch_size(READ_BATCH_SIZE)
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= READ_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def _order_batches(self, window: dict, session) -> AsyncIterator[List[dict]]:
+        if self.archive is not None:
+            async for batch in self.archive.iter_orders(window, READ_BATCH_SIZE):
+                yield batch
+        async for batch in self._documents("orders", window, session):
+            yield batch
+
+    # ---- writing ----
+
+    def _staging_dir(self, run_id: str) -> Path:
+        return self.export_dir / ".staging" / run_id
+
+    async def _export(self, run: dict):
+        until = (datetime.now(timezone.utc) - timedelta(seconds=self.settle_seconds)).isoformat()
+        marks = await self.watermarks()
+        results = {}
+        async with self._snapshot_session() as session:
+            for dataset in run["datasets"]:
+                window = {"$lte": until}
+                if run["mode"] == "incremental" and marks[dataset]:
+                    window["$gt"] = marks[dataset]
+                writer = _DatasetWriter(
+                    self._staging_dir(run["_id"]) / dataset, schema(dataset), run["format"], run["_id"]
+                )
+                if dataset == "order_items":
+                    batches, to_rows = self._order_batches(window, session), _order_rows
+                else:
+                    batches, to_rows = self._documents(dataset, window, session), \
+                        _product_rows if dataset == "products" else _review_rows
+                async for batch in batches:
+                    rows = [row for doc in batch for row in to_rows(doc)]
+                    await asyncio.to_thread(writer.write, rows)
+                files = await asyncio.to_thread(writer.close)
+                results[dataset] = {
+                    "after": window.get("$gt"),
+                    "until": until,
+                    "rows": sum(f["rows"] for f in files),
+                    "files": files,
+                }
+
+        # Record what is about to be published, then publish; a crash in
+        # between is rolled forward by _recover on the next run
+        await self.db.export_runs.update_one(
+            {"_id": run["_id"]}, {"$set": {"state": "committing", "results": results}}
+        )
+        await self._publish({**run, "results": results})
+
+    async def _publish(self, run: dict):
+        staging = self._staging_dir(run["_id"])
+        for dataset, result in run["results"].items():
+            target = self.export_dir / dataset
+            staged = staging / dataset
+            if run["mode"] == "full":
+                if staged.exists():
+                    await asyncio.to_thread(self._swap_dir, staged, target, run["_id"])
+            else:
+                for f in result["files"]:
+                    src = staged / f["path"]
+                    if src.exists():
+                        (target / f["path"]).parent.mkdir(parents=True, exist_ok=True)
+                        os.replace(src, target / f["path"])
+            await self.db.export_state.update_one(
+                {"_id": dataset},
+                {"$set": {"watermark": result["until"], "last_run": run["_id"]}},
+                upsert=True,
+            )
+        shutil.rmtree(staging, ignore_errors=True)
+        await self.db.export_runs.update_one(
+            {"_id": run["_id"]}, {"$set": {"state": "completed", "finished_at": datetime.now(timezone.utc)}}
+        )
+        logger.info(
+            f"Analytics export {run['_id']} ({run['mode']}) wrote "
+            + ", ".join(f"{d}: {r['rows']} rows" for d, r in run["results"].items())
+        )
+
+    @staticmethod
+    def _swap_dir(staged: Path, target: Path, run_id: str):
+        staged.mkdir(parents=True, exist_ok=True)
+        old = target.with_name(f".{target.name}-{run_id}.old")
+        if target.exists():
+            os.replace(target, old)
+        os.replace(staged, target)
+        shutil.rmtree(old, ignore_errors=True)
+
+    async def _recover(self, current_run_id: str):
+        async for run in self.db.export_runs.find({"state": "committing"}):
+            logger.warning(f"Finishing interrupted analytics export {run['_id']}")
+            await self._publish(run)
+        # We hold the run lock, so any other running export died before committing
+        async for run in self.db.export_runs.find({"state": "running", "_id": {"$ne": current_run_id}}):
+            shutil.rmtree(self._staging_dir(run["_id"]), ignore_errors=True)
+            await self.db.export_runs.update_one(
+                {"_id": run["_id"]}, {"$set": {"state": "failed", "error": "interrupted"}}
+            )
+
+    # ---- background ----
+
+    async def run_forever(self, interval_hours: float, fmt: str = "parquet"):
+        while True:
+            try:
+                await self.run(DATASETS, full=False, fmt=fmt)
+            except asyncio.CancelledError:
+                raise
+            except RuntimeError as e:
+                logger.info(f"Skipping scheduled analytics export: {e}")
+            except Exception:
+                logger.exception("Scheduled analytics export failed")
+            await asyncio.sleep(interval_hours * 3600)
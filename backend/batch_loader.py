@@ -0,0 +1,73 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, TypeVar
+
+# DataLoader-style request coalescing.
+# load(key) doesn't query right away: it queues the key and schedules one
+# dispatch for the end of the current event-loop tick. Every load() made
+# before that (from any handler) rides the same batch, so N concurrent
+# lookups cost one `$in` query instead of N `find_one`s. Keys are
+# de-duplicated within a batch. Nothing is cached across batches, so a
+# load never returns data older than the tick it was made in.
+#
+# Values are shallow-copied per caller since several requests can share
+# one result and handlers are free to modify what they get.
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+BatchFn = Callable[[List[K]], Awaitable[Dict[K, V]]]
+
+
+class BatchLoader(Generic[K, V]):
+    def __init__(self, batch_fn: BatchFn, max_batch_size: int = 500):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[K, List[asyncio.Future]] = {}
+        self._scheduled = False
+        self._tasks = set()  # running batches, referenced so they aren't garbage-collected
+        self.stats = {"loads": 0, "batches": 0, "keys": 0}
+
+    def _enqueue(self, key: K) -> asyncio.Future:
+        self.stats["loads"] += 1
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        if not self._scheduled:
+            self._scheduled = True
+            loop.call_soon(self._dispatch)
+        return future
+
+    async def load(self, key: K) -> Optional[V]:
+        """The value for `key`, or None if the batch function didn't return one."""
+        return await self._enqueue(key)
+
+    async def load_many(self, keys: Iterable[K]) -> List[Optional[V]]:
+        """Values in the order of `keys`, all queued in the same batch."""
+        return list(await asyncio.gather(*[self._enqueue(key) for key in keys]))
+
+    def _dispatch(self):
+        self._scheduled = False
+        pending, self._pending = self._pending, {}
+        keys = list(pending)
+        for start in range(0, len(keys), self.max_batch_size):
+            batch = {key: pending[key] for key in keys[start:start + self.max_batch_size]}
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: Dict[K, List[asyncio.Future]]):
+        self.stats["batches"] += 1
+        self.stats["keys"] += len(batch)
+        try:
+            values = await self.batch_fn(list(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for key, futures in batch.items():
+            value = values.get(key)
+            for future in futures:
+                if not future.done():  # the caller may have been cancelled
+                    future.set_result(dict(value) if isinstance(value, dict) else value)
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# Shopping carts, one document per user in `carts`.
+# Reads never write: a user without a cart gets a virtual empty cart, and the
+# document is only created (by upsert) on the first item added. Every write
+# sets `expires_at`, which a TTL index uses to drop carts abandoned for
+# `ttl_days` and emptied carts after `empty_ttl_hours`. Carts written before
+# `expires_at` existed (including the empty ones the old GET /cart inserted)
+# are cleaned up by `compact()`.
+
+logger = logging.getLogger(__name__)
+
+COMPACT_BATCH_SIZE = 1000
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class CartStore:
+    def __init__(self, collection, ttl_days: float = 30, empty_ttl_hours: float = 1):
+        self.collection = collection
+        self.ttl = timedelta(days=ttl_days)
+        self.empty_ttl = timedelta(hours=empty_ttl_hours)
+        self._user_index = False
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        try:
+            await self.collection.create_index("user_id", unique=True)
+            self._user_index = True
+        except (DuplicateKeyError, OperationFailure):
+            # Legacy duplicates; compact() removes them and retries
+            logger.warning("Carts have duplicate user_id values, unique index deferred to compaction")
+
+    def _stamp(self, empty: bool = False) -> dict:
+        now = datetime.now(timezone.utc)
+        return {"updated_at": now.isoformat(), "expires_at": now + (self.empty_ttl if empty else self.ttl)}
+
+    # ---- reads ----
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"user_id": user_id}, {"_id": 0, "expires_at": 0})
+
+    # ---- writes ----
+
+    async def add_item(self, user_id: str, item: dict):
+        """Add `item` or set its quantity if the product is already in the cart."""
+        set_quantity = {"$set": {"items.$.quantity": item["quantity"], **self._stamp()}}
+        for _ in range(3):
+            result = await self.collection.update_one(
+                {"user_id": user_id, "items.product_id": item["product_id"]}, set_quantity
+            )
+            if result.matched_count:
+                return
+            try:
+                await self.collection.update_one(
+                    {"user_id": user_id, "items.product_id": {"$ne": item["product_id"]}},
+                    {"$push": {"items": item}, "$set": self._stamp(),
+                     "$setOnInsert": {"id": str(uuid.uuid4())}},
+                    upsert=True,
+                )
+                return
+            except DuplicateKeyError:
+                # A concurrent request created the cart or added this product first
+                continue
+        raise RuntimeError(f"Could not update cart of user {user_id}")
+
+    async def remove_item(self, user_id: str, product_id: str):
+        await self.collection.update_one(
+            {"user_id": user_id}, {"$pull": {"items": {"product_id": product_id}}, "$set": self._stamp()}
+        )
+        await self.collection.update_one(
+            {"user_id": user_id, "items": {"$size": 0}}, {"$set": self._stamp(empty=True)}
+        )
+
+    async def clear(self, user_id: str):
+        await self.collection.update_one({"user_id": user_id}, {"$set": {"items": [], **self._stamp(empty=True)}})
+
+    async def remove_ordered(self, user_id: str, items: List[dict]):
+        """Take an order's line items out of the cart, leaving anything added or changed since.
+
+        An item goes only while its quantity still matches the order, so
+        removing the same order twice is harmless. Compare-and-set like
+        merge_items.
+        """
+        ordered = {(item["product_id"], item["quantity"]) for item in items}
+        for _ in range(5):
+            cart = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "items": 1})
+            current = (cart or {}).get("items")
+            if not current:
+                return
+            remaining = [i for i in current if (i["product_id"], i["quantity"]) not in ordered]
+            if len(remaining) == len(current):
+                return
+            result = await self.collection.update_one(
+                {"user_id": user_id, "items": current},
+                {"$set": {"items": remaining, **self._stamp(empty=not remaining)}},
+            )
+            if result.matched_count:
+                return
+        raise RuntimeError(f"Could not update cart of user {user_id}")
+
+    async def merge_items(self, user_id: str, items: Dict[str, int]):
+        """Merge a guest cart into the user's cart, keeping the larger quantity per product.
+
+        Taking the maximum makes merging the same guest cart twice harmless.
+        The write is a compare-and-set on the items read, retried on conflict.
+        """
+        if not items:
+            return
+        for _ in range(5):
+            cart = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "items": 1})
+            if cart is None:
+                try:
+                    await self.collection.insert_one({
+                        "id": str(uuid.uuid4()), "user_id": user_id,
+                        "items": [{"product_id": p, "quantity": q} for p, q in items.items()], **self._stamp(),
+                    })
+                    return
+                except DuplicateKeyError:
+                    continue
+            current = cart.get("items")
+            merged = {i["product_id"]: i["quantity"] for i in current or []}
+            for product_id, quantity in items.items():
+                merged[product_id] = max(merged.get(product_id, 0), quantity)
+            result = await self.collection.update_one(
+                {"user_id": user_id, "items": current},
+                {"$set": {"items": [{"product_id": p, "quantity": q} for p, q in merged.items()], **self._stamp()}},
+            )
+            if result.matched_count:
+                return
+        raise RuntimeError(f"Could not merge guest cart of user {user_id}")
+
+    # ---- compaction ----
+
+    async def compact(self) -> dict:
+        """Give legacy carts an expiry, drop empty ones and per-user duplicates."""
+        stats = {"deleted_empty": 0, "expiry_set": 0, "deleted_duplicates": 0}
+        while True:
+            legacy = await self.collection.find(
+                {"expires_at": {"$exists": False}}, {"_id": 1, "items": 1, "updated_at": 1}
+            ).limit(COMPACT_BATCH_SIZE).to_list(COMPACT_BATCH_SIZE)
+            if not legacy:
+                break
+            ops = []
+            for cart in legacy:
+                if not cart.get("items"):
+                    ops.append(DeleteOne({"_id": cart["_id"]}))
+                    stats["deleted_empty"] += 1
+                    continue
+                updated = _parse_timestamp(cart.get("updated_at")) or datetime.now(timezone.utc)
+                ops.append(UpdateOne({"_id": cart["_id"]}, {"$set": {"expires_at": updated + self.ttl}}))
+                stats["expiry_set"] += 1
+            await self.collection.bulk_write(ops, ordered=False)
+
+        # With the unique index in place there can't be any duplicates
+        if not self._user_index:
+            duplicated = await self.collection.aggregate([
+                {"$group": {"_id": "$user_id", "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+            ]).to_list(None)
+            for group in duplicated:
+                stats["deleted_duplicates"] += await self._drop_duplicates(group["_id"])
+            await self.ensure_indexes()
+
+        logger.info(f"Cart compaction: {stats}")
+        return stats
+
+    async def compact_in_background(self):
+        try:
+            await self.compact()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Cart compaction failed")
+
+    async def _drop_duplicates(self, user_id: str) -> int:
+        # Keep the most recently updated cart
+        carts: List[dict] = await self.collection.find(
+            {"user_id": user_id}, {"_id": 1, "updated_at": 1}
+        ).to_list(None)
+        carts.sort(key=lambda c: _parse_timestamp(c.get("updated_at")) or datetime.min.replace(tzinfo=timezone.utc),
+                   reverse=True)
+        result = await self.collection.delete_many({"_id": {"$in": [c["_id"] for c in carts[1:]]}})
+        return result.deleted_count
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from pydantic import TypeAdapter
+
+from change_streams import ChangeEvent
+from compression import available_encodings, compress, negotiate
+from fieldsets import FieldSets
+
+# Static catalog snapshots.
+# The catalog only changes a few times a day, so instead of answering every
+# browse request from MongoDB the publisher renders it to versioned JSON
+# files on disk:
+#
+#   <dir>/manifest.json                       {"version", "base", ...}, replaced atomically
+#   <dir>/<version>/products.json             full listing (+ .gz/.br variants)
+#   <dir>/<version>/products.summary.json     summary listing
+#   <dir>/<version>/categories.json
+#   <dir>/<version>/category/<name>[.summary].json
+#   <dir>/<version>/product/<id>.json
+#
+# The version is a hash of the content, so a snapshot never changes once
+# written and every worker publishing the same catalog lands on the same
+# directory. It is built in a temporary directory and renamed into place,
+# then the manifest is swapped, so readers never see a half-written one.
+# Files under a version are immutable and cached as such; only the
+# manifest is revalidated. A front proxy can serve <dir> directly
+# (precompressed variants included) and pass only the manifest through.
+#
+# Product edits trigger a publish after `delay` seconds, so a burst of
+# edits produces one snapshot. Stock and rating changes are too frequent
+# for that (the product page gets live stock over the stock feed), so they
+# are picked up by the periodic refresh instead.
+
+logger = logging.getLogger(__name__)
+
+VOLATILE_FIELDS = {"stock", "rating", "reviews_count", "top_reviews"}
+VERSION_PATTERN = re.compile(r"^[0-9a-f]{16}$")
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def _file_name(value: str) -> str:
+    return quote(value, safe="")
+
+
+class CatalogPublisher:
+    def __init__(self, db, directory: Path, fieldsets: FieldSets, delay: float = 2.0,
+                 refresh_interval: float = 300.0, keep: int = 3, minimum_size: int = 1024):
+        self.products = db.products
+        self.directory = Path(directory)
+        self.fieldsets = fieldsets
+        self.delay = delay
+        self.refresh_interval = refresh_interval
+        self.keep = keep
+        self.minimum_size = minimum_size
+        self._product = TypeAdapter(fieldsets.full_model)
+        self.manifest: Optional[dict] = None
+        self._changed = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"published": 0, "unchanged": 0}
+
+    # ---- rendering ----
+
+    def _render(self, products: List[dict]) -> Dict[str, bytes]:
+        full = self.fieldsets.select("full")
+        summary = self.fieldsets.select("summary")
+        files = {
+            "products.json": full.render(products),
+            "products.summary.json": summary.render(products),
+        }
+        categories = list(dict.fromkeys(p["category"] for p in products if p.get("category")))
+        files["categories.json"] = json.dumps({"categories": categories}).encode()
+        for category in categories:
+            members = [p for p in products if p.get("category") == category]
+            files[f"category/{_file_name(category)}.json"] = full.render(members)
+            files[f"category/{_file_name(category)}.summary.json"] = summary.render(members)
+        for product in products:
+            files[f"product/{_file_name(product['id'])}.json"] = self._product.dump_json(
+                self._product.validate_python(product)
+            )
+        return files
+
+    @staticmethod
+    def _version(files: Dict[str, bytes]) -> str:
+        digest = hashlib.sha256()
+        for path in sorted(files):
+            digest.update(path.encode() + b"\0" + hashlib.sha256(files[path]).digest())
+        return digest.hexdigest()[:16]
+
+    # ---- writing ----
+
+    def _write(self, products: List[dict]) -> Tuple[dict, bool]:
+        files = self._render(products)
+        version = self._version(files)
+        target = self.directory / version
+        created = False
+        if not target.exists():
+            staging = self.directory / f".tmp-{uuid.uuid4().hex}"
+            for path, body in files.items():
+                destination = staging / path
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                destination.write_bytes(body)
+                if len(body) >= self.minimum_size:
+                    for encoding in available_encodings():
+                        destination.with_name(destination.name + ENCODING_SUFFIXES[encoding]).write_bytes(
+                            compress(body, encoding)
+                        )
+            try:
+                os.rename(staging, target)
+                created = True
+            except OSError:
+                # Published concurrently by another worker; same content
+                shutil.rmtree(staging, ignore_errors=True)
+
+        categories = json.loads(files["categories.json"])["categories"]
+        manifest = {
+            "version": version,
+            "published_at": datetime.now(timezone.utc).isoformat(),
+            "base": f"/api/catalog/{version}/",
+            "products": "products.json",
+            "summary": "products.summary.json",
+            "categories": {
+                category: {"full": f"category/{_file_name(category)}.json",
+                           "summary": f"category/{_file_name(category)}.summary.json"}
+                for category in categories
+            },
+            "product": "product/{id}.json",
+            "count": len(products),
+        }
+        if self.manifest is None or self.manifest["version"] != version:
+            staged_manifest = self.directory / f".manifest-{uuid.uuid4().hex}.json"
+            staged_manifest.write_text(json.dumps(manifest))
+            os.replace(staged_manifest, self.directory / "manifest.json")
+        self._prune(version)
+        return manifest, created
+
+    def _prune(self, current: str):
+        versions = [p for p in self.directory.iterdir() if p.is_dir() and VERSION_PATTERN.match(p.name)]
+        versions.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+        # Older snapshots stay a while for clients that loaded the previous manifest
+        for old in [p for p in versions if p.name != current][max(self.keep - 1, 0):]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    async def publish(self) -> dict:
+        async with self._lock:
+            products = await self.products.find({}, self.fieldsets.select("full").projection).to_list(None)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            previous = self.manifest["version"] if self.manifest else None
+            manifest, created = await asyncio.to_thread(self._write, products)
+            self.manifest = manifest
+            if manifest["version"] == previous:
+                self.stats["unchanged"] += 1
+            else:
+                self.stats["published"] += 1
+                logger.info(f"Catalog snapshot {manifest['version']} published "
+                            f"({len(products)} products{'' if created else ', already on disk'})")
+            return manifest
+
+    # ---- serving ----
+
+    def resolve(self, version: str, path: str, accept_encoding: str) -> Optional[Tuple[Path, Optional[str]]]:
+        """File to send for a snapshot path and its Content-Encoding; None if there is no such file."""
+        if not VERSION_PATTERN.match(version) or not path.endswith(".json"):
+            return None
+        root = (self.directory / version).resolve()
+        file = (root / path).resolve()
+        if root not in file.parents or not file.is_file():
+            return None
+        encoding = negotiate(accept_encoding)
+        if encoding is not None:
+            variant = file.with_name(file.name + ENCODING_SUFFIXES[encoding])
+            if variant.is_file():
+                return variant, encoding
+        return file, None
+
+    # ---- triggers ----
+
+    async def on_change(self, event: ChangeEvent):
+        if event.updated_fields is not None and set(event.updated_fields) <= VOLATILE_FIELDS:
+            return  # left to the periodic refresh
+        self._changed.set()
+
+    def _load_manifest(self):
+        try:
+            manifest = json.loads((self.directory / "manifest.json").read_text())
+        except (OSError, ValueError):
+            return
+        if (self.directory / manifest.get("version", "")).is_dir():
+            self.manifest = manifest
+
+    async def start(self):
+        # Serve the last snapshot right away; the first publish runs in the background
+        await asyncio.to_thread(self._load_manifest)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            try:
+                await self.publish()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Catalog publish failed")
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=self.refresh_interval)
+                await asyncio.sleep(self.delay)  # let a burst of edits settle into one snapshot
+            except asyncio.TimeoutError:
+                pass
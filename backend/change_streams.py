@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Cross-worker cache invalidation.
+# Local caches and indexes subscribe to an InvalidationBus per collection.
+# The ChangeStreamListener feeds the bus from a MongoDB change stream when the
+# server is a replica set, and otherwise falls back to polling a small,
+# TTL-expired `invalidations` log that every worker appends to on writes.
+
+logger = logging.getLogger(__name__)
+
+# Operation used when a consumer must drop everything it holds for a collection
+INVALIDATE_ALL = "invalidate_all"
+
+# Server error codes meaning the stored resume token can no longer be used
+RESUME_TOKEN_LOST_CODES = {260, 280, 286}
+
+
+@dataclass
+class ChangeEvent:
+    collection: str
+    operation: str  # insert, update, replace, delete or invalidate_all
+    document_id: Optional[str] = None
+    document: Optional[dict] = None
+    updated_fields: Optional[List[str]] = None
+    origin: Optional[str] = None
+
+    def touches(self, fields) -> bool:
+        """Whether the change may affect any of the given fields."""
+        if self.updated_fields is None:
+            return True
+        return any(f in fields for f in self.updated_fields)
+
+
+Handler = Callable[[ChangeEvent], Awaitable[None]]
+
+
+class InvalidationBus:
+    def __init__(self):
+        self._subscribers: Dict[str, List[Handler]] = defaultdict(list)
+
+    def subscribe(self, collection: str, handler: Handler):
+        self._subscribers[collection].append(handler)
+
+    async def publish(self, event: ChangeEvent):
+        for handler in self._subscribers.get(event.collection, []):
+            try:
+                await handler(event)
+            except Exception:
+                logger.exception(f"Invalidation handler failed for {event.collection}")
+
+
+class ChangeStreamListener:
+    def __init__(self, db, bus: InvalidationBus, collections: List[str], worker_id: str,
+                 mode: str = "auto", poll_interval: float = 2.0, log_ttl_seconds: int = 3600,
+                 token_save_interval: float = 1.0, token_ttl_seconds: int = 7 * 86400):
+        self.db = db
+        self.bus = bus
+        self.collections = collections
+        # worker_id keys the stored resume token, so it must differ between the
+        # workers of a host (the default is host:pid) and is kept across restarts
+        # only when set explicitly; origin is unique per running process so
+        # pollers can skip their own writes
+        self.worker_id = worker_id
+        self.origin = f"{worker_id}:{os.getpid()}"
+        self.mode = mode  # auto, stream or poll
+        self.poll_interval = poll_interval
+        self.log_ttl_seconds = log_ttl_seconds
+        self.token_save_interval = token_save_interval
+        self.token_ttl_seconds = token_ttl_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+        self._token_saved_at = 0.0
+
+    # ---- local writes ----
+
+    async def notify(self, collection: str, operation: str, document_id: Optional[str] = None,
+                     document: Optional[dict] = None, updated_fields: Optional[List[str]] = None):
+        """Publish a write made by this worker.
+
+        Local subscribers are updated immediately. In polling mode the change
+        is also appended to the shared log for the other workers; with change
+        streams they learn about it from MongoDB directly.
+        """
+        await self.bus.publish(ChangeEvent(collection, operation, document_id, document, updated_fields, self.origin))
+        if self.mode == "poll":
+            await self.db.invalidations.insert_one({
+                "collection": collection,
+                "operation": operation,
+                "document_id": document_id,
+                "updated_fields": updated_fields,
+                "origin": self.origin,
+                "ts": datetime.now(timezone.utc),
+            })
+
+    # ---- lifecycle ----
+
+    async def _supports_change_streams(self) -> bool:
+        try:
+            hello = await self.db.client.admin.command("hello")
+        except Exception:
+            return False
+        return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    async def start(self):
+        if self.mode == "auto":
+            self.mode = "stream" if await self._supports_change_streams() else "poll"
+        if self.mode == "poll":
+            await self.db.invalidations.create_index("ts", expireAfterSeconds=self.log_ttl_seconds)
+            self._task = asyncio.create_task(self._poll())
+        else:
+            # Tokens of workers that are gone (a new pid each restart) expire
+            await self.db.change_stream_tokens.create_index("updated_at", expireAfterSeconds=self.token_ttl_seconds)
+            self._task = asyncio.create_task(self._watch())
+        logger.info(f"Cache invalidation listener started in {self.mode} mode")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.mode == "stream":
+            await self._save_token(force=True)
+
+    async def invalidate_all(self):
+        for collection in self.collections:
+            await self.bus.publish(ChangeEvent(collection, INVALIDATE_ALL))
+
+    # ---- change stream mode ----
+
+    async def _load_token(self):
+        state = await self.db.change_stream_tokens.find_one({"_id": self.worker_id})
+        return state.get("token") if state else None
+
+    async def _save_token(self, force: bool = False):
+        if self._resume_token is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._token_saved_at < self.token_save_interval:
+            return
+        self._token_saved_at = now
+        await self.db.change_stream_tokens.update_one(
+            {"_id": self.worker_id},
+            {"$set": {"token": self._resume_token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def _to_event(self, change: dict) -> ChangeEvent:
+        operation = change["operationType"]
+        document = change.get("fullDocument")
+        document_id = None
+        if document is not None:
+            document_id = document.get("id")
+            document = {k: v for k, v in document.items() if k != "_id"}
+        elif change.get("fullDocumentBeforeChange"):
+            document_id = change["fullDocumentBeforeChange"].get("id")
+
+        updated_fields = None
+        if operation == "update":
+            description = change.get("updateDescription", {})
+            updated_fields = list(description.get("updatedFields", {})) + description.get("removedFields", [])
+            updated_fields = [f.split(".")[0] for f in updated_fields]
+
+        if operation == "delete" and document_id is None:
+            # Without pre-images the app-level id of a deleted document is unknown
+            operation = INVALIDATE_ALL
+        return ChangeEvent(change["ns"]["coll"], operation, document_id, document, updated_fields)
+
+    async def _watch(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": self.collections}}}]
+        self._resume_token = await self._load_token()
+        while True:
+            try:
+                async with self.db.watch(pipeline, full_document="updateLookup", resume_after=self._resume_token) as stream:
+                    async for change in stream:
+                        if change["operationType"] in ("insert", "update", "replace", "delete"):
+                            await self.bus.publish(self._to_event(change))
+                        self._resume_token = stream.resume_token
+                        await self._save_token()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in RESUME_TOKEN_LOST_CODES:
+                    # Missed changes cannot be replayed, so drop every cache
+                    logger.warning("Change stream history lost; invalidating all local caches")
+                    self._resume_token = None
+                    await self.db.change_stream_tokens.delete_one({"_id": self.worker_id})
+                    await self.invalidate_all()
+                    continue
+                logger.exception("Change stream failed; retrying")
+                await asyncio.sleep(self.poll_interval)
+            except PyMongoError:
+                logger.exception("Change stream interrupted; retrying")
+                await asyncio.sleep(self.poll_interval)
+
+    # ---- polling mode ----
+
+    async def _poll(self):
+        # Re-read a short overlap window each time so entries whose timestamps
+        # were assigned slightly out of order by different workers are not missed.
+        # The window is read in pages ordered by (ts, _id), so a burst of more
+        # entries than a page still moves forward instead of re-reading the first page.
+        overlap = timedelta(seconds=max(self.poll_interval * 2, 5))
+        page_size = 1000
+        last_ts = datetime.now(timezone.utc)
+        seen = deque(maxlen=10_000)
+        seen_ids = set()
+        while True:
+            try:
+                query = {"ts": {"$gte": last_ts - overlap}, "origin": {"$ne": self.origin}}
+                while True:
+                    entries = await self.db.invalidations.find(query).sort(
+                        [("ts", 1), ("_id", 1)]
+                    ).to_list(page_size)
+                    for entry in entries:
+                        if entry["_id"] in seen_ids:
+                            continue
+                        if len(seen) == seen.maxlen:
+                            seen_ids.discard(seen[0])
+                        seen.append(entry["_id"])
+                        seen_ids.add(entry["_id"])
+                        ts = entry["ts"] if entry["ts"].tzinfo else entry["ts"].replace(tzinfo=timezone.utc)
+                        last_ts = max(last_ts, ts)
+                        await self.bus.publish(ChangeEvent(
+                            entry["collection"], entry["operation"], entry.get("document_id"),
+                            None, entry.get("updated_fields"), entry.get("origin"),
+                        ))
+                    if len(entries) < page_size:
+                        break
+                    last = entries[-1]
+                    query = {
+                        "origin": {"$ne": self.origin},
+                        "$or": [{"ts": {"$gt": last["ts"]}}, {"ts": last["ts"], "_id": {"$gt": last["_id"]}}],
+                    }
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Invalidation poll failed")
+            await asyncio.sleep(self.poll_interval)
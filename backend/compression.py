@@ -0,0 +1,268 @@
+import asyncio
+import hashlib
+import logging
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional, only gzip is offered when unavailable
+    brotli = None
+
+# HTTP response compression.
+# CompressionMiddleware negotiates br/gzip from Accept-Encoding and compresses
+# compressible responses above a size threshold, streaming bodies chunk by
+# chunk (flushing after each so streamed data isn't held back). Responses that
+# already carry a Content-Encoding pass through untouched.
+#
+# PrecompressedCache serves hot, cacheable payloads (the catalog) from memory:
+# each payload is serialized and compressed once per catalog generation, in a
+# thread, and every request after that only picks the variant matching its
+# Accept-Encoding. Product change events bump the generation.
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "text/css", "text/csv",
+                      "application/javascript", "text/javascript", "application/xml", "image/svg+xml")
+
+
+def available_encodings():
+    return ("br", "gzip") if brotli else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Preferred encoding we support from an Accept-Encoding header, br first on ties."""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+    best, best_q = None, 0.0
+    for encoding in available_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if level is None else level)
+    compressor = zlib.compressobj(9 if level is None else level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class _StreamCompressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def _compressible(headers: Headers, status: int) -> bool:
+    if status < 200 or status in (204, 206, 304) or "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return content_type in COMPRESSIBLE_TYPES
+
+
+def _add_vary(headers: MutableHeaders):
+    vary = headers.get("vary")
+    if not vary:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, encoding, self))
+
+
+class _CompressingSend:
+    def __init__(self, send, encoding: str, config: CompressionMiddleware):
+        self.send = send
+        self.encoding = encoding
+        self.config = config
+        self.start: Optional[dict] = None
+        self.buffer = bytearray()
+        self.mode = None  # None while undecided, then "passthrough" or "compress"
+        self.compressor: Optional[_StreamCompressor] = None
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            if not _compressible(Headers(raw=message["headers"]), message["status"]):
+                self.mode = "passthrough"
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.mode == "passthrough":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.mode == "compress":
+            data = self.compressor.chunk(body) if more_body else self.compressor.finish(body)
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        self.buffer += body
+        if not more_body and len(self.buffer) < self.config.minimum_size:
+            # Too small to be worth it
+            self.mode = "passthrough"
+            await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": bytes(self.buffer)})
+            return
+        if more_body and len(self.buffer) < self.config.minimum_size:
+            return
+
+        self.mode = "compress"
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        _add_vary(headers)
+        if more_body:
+            del headers["Content-Length"]
+            self.compressor = _StreamCompressor(self.encoding, self.config.gzip_level, self.config.brotli_quality)
+            data = self.compressor.chunk(bytes(self.buffer))
+        else:
+            level = self.config.brotli_quality if self.encoding == "br" else self.config.gzip_level
+            data = compress(bytes(self.buffer), self.encoding, level)
+            headers["Content-Length"] = str(len(data))
+        self.buffer = bytearray()
+        await self.send(self.start)
+        await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+
+@dataclass
+class _Entry:
+    generation: int
+    etag: str
+    bodies: Dict[Optional[str], bytes] = field(default_factory=dict)
+
+    @property
+    def size(self) -> int:
+        return sum(len(b) for b in self.bodies.values())
+
+
+class PrecompressedCache:
+    def __init__(self, minimum_size: int = 1024, max_bytes: int = 64 * 1024 * 1024, level: Optional[int] = None,
+                 volatile_fields: frozenset = frozenset(), volatile_level: Optional[int] = None):
+        self.minimum_size = minimum_size
+        self.max_bytes = max_bytes
+        self.level = level
+        self.volatile_fields = volatile_fields
+        self.volatile_level = volatile_level
+        self._build_level = level
+        self.generation = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._building: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "builds": 0, "not_modified": 0}
+
+    async def on_change(self, event):
+        # Any product change makes every cached catalog payload stale. Changes to
+        # volatile fields alone (stock rollups during a sale) keep coming, so the
+        # payloads rebuilt after them are compressed at the cheaper volatile_level
+        volatile = event.updated_fields is not None and set(event.updated_fields) <= self.volatile_fields
+        self._build_level = self.volatile_level if volatile else self.level
+        self.generation += 1
+        self._entries.clear()
+
+    def _encode(self, generation: int, body: bytes, level: Optional[int]) -> _Entry:
+        entry = _Entry(generation, f'W/"{generation}-{hashlib.sha1(body).hexdigest()[:16]}"', {None: body})
+        if len(body) >= self.minimum_size:
+            for encoding in available_encodings():
+                entry.bodies[encoding] = compress(body, encoding, level)
+        return entry
+
+    async def _get(self, key: str, build: Callable[[], Awaitable[bytes]]) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is not None and entry.generation == self.generation:
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry
+
+        building = self._building.get(key)
+        if building is not None:
+            return await asyncio.shield(building)
+        future = asyncio.get_running_loop().create_future()
+        self._building[key] = future
+        try:
+            # Read the generation first: a change during the build leaves this entry already stale
+            generation, level = self.generation, self._build_level
+            body = await build()
+            entry = await asyncio.to_thread(self._encode, generation, body, level)
+            self.stats["builds"] += 1
+            if generation == self.generation:
+                self._store(key, entry)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved; with no waiters it would be logged as unhandled
+            raise
+        finally:
+            del self._building[key]
+
+    def _store(self, key: str, entry: _Entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        total = sum(e.size for e in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            total -= evicted.size
+
+    async def respond(self, request: Request, key: str, build: Callable[[], Awaitable[bytes]],
+                      media_type: str = "application/json") -> Response:
+        """Cached response for `key`; `build` produces the uncompressed body on a miss."""
+        entry = await self._get(key, build)
+        headers = {"ETag": entry.etag, "Vary": "Accept-Encoding"}
+        if request.headers.get("if-none-match") == entry.etag:
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        encoding = negotiate(request.headers.get("accept-encoding", ""))
+        if encoding is not None and encoding in entry.bodies:
+            headers["Content-Encoding"] = encoding
+            return Response(entry.bodies[encoding], media_type=media_type, headers=headers)
+        return Response(entry.bodies[None], media_type=media_type, headers=headers)
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+# MongoDB client construction and connection pool telemetry.
+# All tuning knobs come from the environment so each deployment can size the
+# pool for its worker count without code changes.
+
+
+@dataclass
+class MongoSettings:
+    url: str
+    db_name: str
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_idle_time_ms: Optional[int] = None
+    wait_queue_timeout_ms: Optional[int] = 2000
+    server_selection_timeout_ms: int = 5000
+    connect_timeout_ms: int = 5000
+    socket_timeout_ms: Optional[int] = None
+    compressors: List[str] = field(default_factory=list)
+    read_preference: str = "primary"
+    write_concern: Optional[str] = None
+    app_name: str = "appliancehub-api"
+
+    @classmethod
+    def from_env(cls) -> "MongoSettings":
+        def optional_int(name: str, default: Optional[int]) -> Optional[int]:
+            value = os.environ.get(name)
+            if value is None:
+                return default
+            return int(value) if value else None
+
+        return cls(
+            url=os.environ['MONGO_URL'],
+            db_name=os.environ['DB_NAME'],
+            max_pool_size=int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+            min_pool_size=int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+            max_idle_time_ms=optional_int('MONGO_MAX_IDLE_TIME_MS', None),
+            wait_queue_timeout_ms=optional_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000),
+            server_selection_timeout_ms=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+            connect_timeout_ms=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+            socket_timeout_ms=optional_int('MONGO_SOCKET_TIMEOUT_MS', None),
+            compressors=[c.strip() for c in os.environ.get('MONGO_COMPRESSORS', '').split(',') if c.strip()],
+            read_preference=os.environ.get('MONGO_READ_PREFERENCE', 'primary'),
+            write_concern=os.environ.get('MONGO_WRITE_CONCERN') or None,
+        )
+
+
+class PoolStats(monitoring.ConnectionPoolListener, monitoring.CommandListener):
+    """Aggregates CMAP and command events into counters for health checks.
+
+    Events are delivered on driver threads, so updates take a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkout_started = threading.local()
+        self.connections_open = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_timeouts = 0
+        self.last_checkout_timeout: Optional[float] = None
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.commands = 0
+        self.command_failures = 0
+        self.command_time_total = 0.0
+        self.pool_cleared = 0
+
+    # ---- connection pool events ----
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open = max(0, self.connections_open - 1)
+
+    def connection_check_out_started(self, event):
+        # Checkout runs on the calling thread, so a thread-local marks the start
+        self._checkout_started.value = time.perf_counter()
+
+    def _record_wait(self) -> None:
+        started = getattr(self._checkout_started, "value", None)
+        if started is not None:
+            waited = time.perf_counter() - started
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+            self._checkout_started.value = None
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._record_wait()
+            self.checkout_failures += 1
+            if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+                self.checkout_timeouts += 1
+                self.last_checkout_timeout = time.time()
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self._record_wait()
+            self.checkouts += 1
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    # ---- command events ----
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        with self._lock:
+            self.commands += 1
+            self.command_time_total += event.duration_micros / 1_000_000
+
+    def failed(self, event):
+        with self._lock:
+            self.commands += 1
+            self.command_failures += 1
+            self.command_time_total += event.duration_micros / 1_000_000
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "checked_out": self.checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checkout_timeouts": self.checkout_timeouts,
+                "wait_time_avg_ms": round(self.wait_time_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_time_max_ms": round(self.wait_time_max * 1000, 3),
+                "commands": self.commands,
+                "command_failures": self.command_failures,
+                "command_time_avg_ms": round(self.command_time_total / self.commands * 1000, 3) if self.commands else 0.0,
+                "pool_cleared": self.pool_cleared,
+            }
+
+
+def create_client(settings: MongoSettings, pool_stats: Optional[PoolStats] = None) -> AsyncIOMotorClient:
+    options = {
+        "maxPoolSize": settings.max_pool_size,
+        "minPoolSize": settings.min_pool_size,
+        "serverSelectionTimeoutMS": settings.server_selection_timeout_ms,
+        "connectTimeoutMS": settings.connect_timeout_ms,
+        "readPreference": settings.read_preference,
+        "appname": settings.app_name,
+    }
+    if settings.max_idle_time_ms is not None:
+        options["maxIdleTimeMS"] = settings.max_idle_time_ms
+    if settings.wait_queue_timeout_ms is not None:
+        options["waitQueueTimeoutMS"] = settings.wait_queue_timeout_ms
+    if settings.socket_timeout_ms is not None:
+        options["socketTimeoutMS"] = settings.socket_timeout_ms
+    if settings.compressors:
+        options["compressors"] = ",".join(settings.compressors)
+    if settings.write_concern is not None:
+        options["w"] = int(settings.write_concern) if settings.write_concern.isdigit() else settings.write_concern
+    if pool_stats is not None:
+        options["event_listeners"] = [pool_stats]
+    return AsyncIOMotorClient(settings.url, **options)
+
+
+async def check_readiness(client: AsyncIOMotorClient, settings: MongoSettings, pool_stats: PoolStats,
+                          saturation: float = 0.9, timeout_backoff: float = 10.0) -> dict:
+    """Decide whether this worker should receive traffic.
+
+    A worker is not ready when MongoDB does not answer a ping, when nearly
+    every pooled connection is checked out, or when a checkout timed out in
+    the last few seconds.
+    """
+    reasons = []
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        reasons.append(f"mongodb unreachable: {e.__class__.__name__}")
+
+    stats = pool_stats.snapshot()
+    if stats["checked_out"] >= settings.max_pool_size * saturation:
+        reasons.append("connection pool saturated")
+    last_timeout = pool_stats.last_checkout_timeout
+    if last_timeout is not None and time.time() - last_timeout < timeout_backoff:
+        reasons.append("recent connection checkout timeouts")
+
+    return {"ready": not reasons, "reasons": reasons, "pool": stats}
@@ -0,0 +1,76 @@
+import json
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, TypeAdapter
+
+# Response shapes for list endpoints: ?view=full|summary or ?fields=a,b,c.
+# Each shape maps to a MongoDB projection, so fields a page doesn't render
+# are neither read from the database nor serialized nor sent:
+#
+#   view=full     the full response model (the default, as before)
+#   view=summary  a slimmed model with what a grid card or table row shows
+#   fields=a,b,c  just those fields of the full model (plus `id`)
+#
+# Selection.key names the shape, so a cache can store each shape of a
+# payload separately.
+
+
+class FieldSetError(ValueError):
+    pass
+
+
+@dataclass
+class Selection:
+    key: str
+    projection: dict
+    render: Callable[[List[dict]], bytes]  # documents -> JSON body
+
+
+class FieldSets:
+    def __init__(self, full_model: Type[BaseModel], summary_model: Type[BaseModel],
+                 full_projection: Optional[dict] = None, summary_projection: Optional[dict] = None,
+                 prepare_summary: Optional[Callable[[dict], dict]] = None, always: tuple = ("id",)):
+        self.full_model = full_model
+        self.always = always
+        self.full_projection = full_projection or {"_id": 0}
+        self.summary_projection = summary_projection or {
+            "_id": 0, **{name: 1 for name in summary_model.model_fields}
+        }
+        self.prepare_summary = prepare_summary or (lambda doc: doc)
+        self._full = TypeAdapter(List[full_model])
+        self._summary = TypeAdapter(List[summary_model])
+
+    def select(self, view: str = "full", fields: Optional[str] = None) -> Selection:
+        if fields:
+            names = sorted(set(self.always) | {f.strip() for f in fields.split(",") if f.strip()})
+            unknown = [name for name in names if name not in self.full_model.model_fields]
+            if unknown:
+                raise FieldSetError(f"Unknown fields: {', '.join(unknown)}")
+            return Selection(
+                key=f"fields={','.join(names)}",
+                projection={"_id": 0, **{name: 1 for name in names}},
+                render=lambda docs: self._render_fields(docs, names),
+            )
+        if view == "summary":
+            return Selection(
+                key="summary",
+                projection=self.summary_projection,
+                render=lambda docs: self._summary.dump_json(
+                    self._summary.validate_python([self.prepare_summary(doc) for doc in docs])
+                ),
+            )
+        if view == "full":
+            return Selection(
+                key="full",
+                projection=self.full_projection,
+                render=lambda docs: self._full.dump_json(self._full.validate_python(docs)),
+            )
+        raise FieldSetError("view must be full or summary")
+
+    @staticmethod
+    def _render_fields(docs: List[dict], names: List[str]) -> bytes:
+        # Documents from elsewhere (e.g. the order archive) may hold more than the projection
+        trimmed = [{name: doc[name] for name in names if name in doc} for doc in docs]
+        return json.dumps(jsonable_encoder(trimmed), separators=(",", ":")).encode()
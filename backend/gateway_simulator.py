@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import uuid
+from typing import Dict, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+from lazy_imports import lazy_import
+from payments import SIGNATURE_HEADER, sign_payload
+
+# Local stand-in for the payment gateway, for development and benchmarks.
+# It speaks the API GatewayClient expects:
+#
+#   POST /v1/charges      {reference, amount, currency, callback_url, metadata}
+#                         -> 202 {id, reference, status: "pending"}
+#   GET  /v1/charges/{id} -> {id, reference, status: pending|succeeded|failed}
+#
+# Requests need `Authorization: Bearer <api_key>`; an Idempotency-Key
+# returns the charge already created under it. Each charge is settled
+# `settle_delay` seconds later and the outcome POSTed to its callback_url,
+# signed like a real gateway, with retries and backoff until it's answered
+# with a 2xx (up to `delivery_attempts`).
+#
+#   latency       seconds before the charge request is answered (+-50% jitter)
+#   failure_rate  share of charge requests answered 503, to exercise retries
+#   decline_rate  share of charges settled as failed
+#
+# In-process, webhooks are delivered straight to `webhook_app` (the shop's
+# ASGI app) without a network; standalone:
+#
+#   python gateway_simulator.py --port 8100 --secret whsec --latency 0.2 --failure-rate 0.05
+
+logger = logging.getLogger(__name__)
+
+httpx = lazy_import("httpx")
+
+
+class GatewaySimulator:
+    def __init__(self, api_key: str, webhook_secret: str, latency: float = 0.2, settle_delay: float = 1.0,
+                 failure_rate: float = 0.0, decline_rate: float = 0.0, delivery_attempts: int = 8,
+                 webhook_app=None, seed: Optional[int] = None):
+        self.api_key = api_key
+        self.webhook_secret = webhook_secret
+        self.latency = latency
+        self.settle_delay = settle_delay
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self.delivery_attempts = delivery_attempts
+        self.webhook_app = webhook_app
+        self.random = random.Random(seed)
+        self.charges: Dict[str, dict] = {}
+        self._by_key: Dict[str, str] = {}
+        self._tasks = set()
+        self._client = None
+        self.stats = {"requests": 0, "injected_failures": 0, "charges": 0, "succeeded": 0, "declined": 0,
+                      "deliveries": 0, "delivery_failures": 0}
+        self.app = self._build_app()
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Payment gateway simulator")
+
+        def authorize(authorization: Optional[str]):
+            if authorization != f"Bearer {self.api_key}":
+                raise HTTPException(status_code=401, detail="Invalid API key")
+
+        @app.post("/v1/charges", status_code=202)
+        async def create_charge(request: Request, authorization: Optional[str] = Header(None),
+                                idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+            authorize(authorization)
+            self.stats["requests"] += 1
+            await self._delay()
+            if self.random.random() < self.failure_rate:
+                self.stats["injected_failures"] += 1
+                return JSONResponse(status_code=503, content={"error": "Simulated outage"})
+            body = await request.json()
+            if idempotency_key and idempotency_key in self._by_key:
+                return self._public(self.charges[self._by_key[idempotency_key]])
+            if not isinstance(body.get("amount"), int) or body["amount"] <= 0:
+                return JSONResponse(status_code=400, content={"error": "amount must be a positive integer"})
+            charge = {
+                "id": f"ch_{uuid.uuid4().hex}",
+                "reference": body.get("reference"),
+                "amount": body["amount"],
+                "currency": body.get("currency", "usd"),
+                "callback_url": body.get("callback_url"),
+                "status": "pending",
+            }
+            self.charges[charge["id"]] = charge
+            if idempotency_key:
+                self._by_key[idempotency_key] = charge["id"]
+            self.stats["charges"] += 1
+            self._spawn(self._settle(charge))
+            return self._public(charge)
+
+        @app.get("/v1/charges/{charge_id}")
+        async def get_charge(charge_id: str, authorization: Optional[str] = Header(None)):
+            authorize(authorization)
+            charge = self.charges.get(charge_id)
+            if charge is None:
+                raise HTTPException(status_code=404, detail="No such charge")
+            return self._public(charge)
+
+        return app
+
+    @staticmethod
+    def _public(charge: dict) -> dict:
+        return {key: charge[key] for key in ("id", "reference", "amount", "currency", "status")}
+
+    async def _delay(self):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+
+    def _spawn(self, coroutine):
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _settle(self, charge: dict):
+        await asyncio.sleep(self.settle_delay)
+        declined = self.random.random() < self.decline_rate
+        charge["status"] = "failed" if declined else "succeeded"
+        self.stats["declined" if declined else "succeeded"] += 1
+        if charge["callback_url"]:
+            await self._deliver(charge)
+
+    async def _deliver(self, charge: dict):
+        event = {**self._public(charge), "type": f"charge.{charge['status']}"}
+        if charge["status"] == "failed":
+            event["error"] = "Card declined"
+        body = json.dumps(event).encode()
+        for attempt in range(self.delivery_attempts):
+            try:
+                response = await self._webhook_client().post(
+                    charge["callback_url"], content=body,
+                    headers={"Content-Type": "application/json",
+                             SIGNATURE_HEADER: sign_payload(self.webhook_secret, body)},
+                )
+                if response.status_code < 300:
+                    self.stats["deliveries"] += 1
+                    return
+                reason = f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                reason = f"{type(e).__name__}: {e}"
+            self.stats["delivery_failures"] += 1
+            logger.info(f"Webhook for {charge['id']} not accepted ({reason}), attempt {attempt + 1}")
+            await asyncio.sleep(min(0.5 * 2 ** attempt, 30))
+        logger.warning(f"Gave up delivering the webhook for {charge['id']}")
+
+    def _webhook_client(self):
+        if self._client is None:
+            transport = httpx.ASGITransport(app=self.webhook_app) if self.webhook_app is not None else None
+            self._client = httpx.AsyncClient(transport=transport, timeout=10.0)
+        return self._client
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local payment gateway simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--api-key", default="sim_key")
+    parser.add_argument("--secret", required=True, help="webhook signing secret (PAYMENT_WEBHOOK_SECRET)")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--settle-delay", type=float, default=1.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--decline-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = GatewaySimulator(args.api_key, args.secret, latency=args.latency, settle_delay=args.settle_delay,
+                                 failure_rate=args.failure_rate, decline_rate=args.decline_rate)
+    uvicorn.run(simulator.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Dict, Optional
+
+# Carts for shoppers who aren't logged in, kept entirely on the client.
+# The cart travels as a compact signed token (X-Guest-Cart header):
+#
+#   g1.<base64url JSON {"i": [[product_id, quantity], ...], "t": issued_at}>.<base64url HMAC-SHA256>
+#
+# The server verifies the signature and expiry and never stores anything,
+# so guest browsing costs no database writes. On login/register the items
+# are merged into the user's server cart (CartStore.merge_items).
+
+TOKEN_VERSION = "g1"
+MAX_TOKEN_LENGTH = 4096
+MAX_ITEMS = 50
+MAX_QUANTITY = 999
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class GuestCartError(ValueError):
+    pass
+
+
+class GuestCartCodec:
+    def __init__(self, secret: str, max_age_seconds: float):
+        # Separate key from the JWT one, so neither token verifies as the other
+        self.key = hashlib.sha256(f"guest-cart:{secret}".encode()).digest()
+        self.max_age_seconds = max_age_seconds
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self.key, f"{TOKEN_VERSION}.{payload}".encode(), hashlib.sha256).digest())
+
+    def encode(self, items: Dict[str, int]) -> str:
+        payload = _b64encode(json.dumps(
+            {"i": [[product_id, quantity] for product_id, quantity in items.items()], "t": int(time.time())},
+            separators=(",", ":"),
+        ).encode())
+        return f"{TOKEN_VERSION}.{payload}.{self._sign(payload)}"
+
+    def decode(self, token: Optional[str]) -> Dict[str, int]:
+        """Items of a guest cart token; an absent or expired token is an empty cart."""
+        if not token:
+            return {}
+        if len(token) > MAX_TOKEN_LENGTH:
+            raise GuestCartError("Guest cart token too large")
+        try:
+            version, payload, signature = token.split(".")
+        except ValueError:
+            raise GuestCartError("Malformed guest cart token")
+        if version != TOKEN_VERSION or not hmac.compare_digest(signature, self._sign(payload)):
+            raise GuestCartError("Invalid guest cart signature")
+        try:
+            data = json.loads(_b64decode(payload))
+            issued_at = int(data["t"])
+            items = {str(product_id): int(quantity) for product_id, quantity in data["i"]}
+        except (ValueError, KeyError, TypeError):
+            raise GuestCartError("Malformed guest cart token")
+        if time.time() - issued_at > self.max_age_seconds:
+            return {}
+        return items
+
+    @staticmethod
+    def set_item(items: Dict[str, int], product_id: str, quantity: int) -> Dict[str, int]:
+        if product_id not in items and len(items) >= MAX_ITEMS:
+            raise GuestCartError(f"Guest carts hold at most {MAX_ITEMS} products")
+        return {**items, product_id: max(1, min(quantity, MAX_QUANTITY))}
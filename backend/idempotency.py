@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+
+# Idempotency-Key support for non-idempotent writes (order creation, payment).
+# The first request with a key claims a record in `idempotency_keys`, runs the
+# handler and stores the response; retries with the same key get the stored
+# response back. Concurrent duplicates wait for the first execution instead
+# of running the handler again.
+
+MAX_KEY_LENGTH = 255
+
+# Errors worth replaying; anything else (5xx, conflicts, rate limits) releases
+# the key so the client can retry for real
+REPLAYABLE_ERROR_STATUSES = {400, 401, 403, 404, 422}
+
+# Returned while waiting when a stale in-progress record was taken over
+TAKEN_OVER = object()
+
+
+def request_fingerprint(request: Request, body: bytes = b"") -> str:
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.url.path.encode())
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, collection, ttl_seconds: int = 86400, lock_timeout: float = 30.0,
+                 wait_timeout: float = 10.0, poll_interval: float = 0.05):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        # Executions running in this worker; local duplicates await these directly
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def _response(record: dict, replayed: bool) -> JSONResponse:
+        headers = {"Idempotent-Replayed": "true"} if replayed else {}
+        return JSONResponse(status_code=record["status_code"], content=record["body"], headers=headers)
+
+    async def _claim(self, record_id: str, fingerprint: str) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.insert_one({
+                "_id": record_id,
+                "fingerprint": fingerprint,
+                "state": "in_progress",
+                "locked_at": now,
+                "expires_at": now + timedelta(seconds=self.ttl_seconds),
+            })
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def execute(self, key: str, scope: str, user_id: str, fingerprint: str,
+                      handler: Callable[[], Awaitable[Any]], status_code: int = 200) -> JSONResponse:
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid Idempotency-Key header")
+
+        record_id = f"{scope}:{user_id}:{key}"
+        while True:
+            if await self._claim(record_id, fingerprint):
+                return await self._run(record_id, fingerprint, handler, status_code)
+            outcome = await self._await_existing(record_id, fingerprint)
+            if outcome is TAKEN_OVER:
+                return await self._run(record_id, fingerprint, handler, status_code)
+            if outcome is not None:
+                return outcome
+            # The first execution failed and released the key; claim it again
+
+    async def _run(self, record_id: str, fingerprint: str, handler: Callable[[], Awaitable[Any]],
+                   status_code: int) -> JSONResponse:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[record_id] = (fingerprint, future)
+        try:
+            try:
+                result = await handler()
+                record = {"status_code": status_code, "body": jsonable_encoder(result)}
+            except HTTPException as e:
+                if e.status_code not in REPLAYABLE_ERROR_STATUSES:
+                    await self.collection.delete_one({"_id": record_id})
+                    raise
+                record = {"status_code": e.status_code, "body": {"detail": e.detail}}
+            except BaseException:
+                await self.collection.delete_one({"_id": record_id})
+                raise
+
+            await self.collection.update_one(
+                {"_id": record_id},
+                {"$set": {"state": "completed", **record}}
+            )
+            future.set_result(record)
+            return self._response(record, replayed=False)
+        finally:
+            if not future.done():
+                future.set_result(None)
+            self._inflight.pop(record_id, None)
+
+    async def _await_existing(self, record_id: str, fingerprint: str):
+        """Wait for another execution of the same key.
+
+        Returns the stored response, TAKEN_OVER when the owner's lock expired
+        and this request now owns the key, or None when the key was released.
+        """
+        local = self._inflight.get(record_id)
+        if local is not None:
+            local_fingerprint, future = local
+            if local_fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            record = await asyncio.shield(future)
+            if record is None:
+                return None
+            return self._response(record, replayed=True)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        while True:
+            existing = await self.collection.find_one({"_id": record_id})
+            if existing is None:
+                return None
+            if existing["fingerprint"] != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            if existing["state"] == "completed":
+                return self._response(existing, replayed=True)
+
+            locked_at = existing["locked_at"]
+            if locked_at.tzinfo is None:
+                locked_at = locked_at.replace(tzinfo=timezone.utc)
+            if datetime.now(timezone.utc) - locked_at > timedelta(seconds=self.lock_timeout):
+                # The owner died mid-request; take the key over
+                taken = await self.collection.update_one(
+                    {"_id": record_id, "state": "in_progress", "locked_at": existing["locked_at"]},
+                    {"$set": {"locked_at": datetime.now(timezone.utc)}}
+                )
+                if taken.modified_count:
+                    return TAKEN_OVER
+                continue
+
+            if loop.time() > deadline:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(self.poll_interval)
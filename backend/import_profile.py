@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Import-time profile of server.py, kept as a cold-start regression benchmark.
+# Imports `server` in fresh interpreters with `-X importtime`, reports the
+# slowest modules it pulls in and, with --check, fails when the total
+# exceeds the budget in import_budget.json or when a module that should be
+# deferred (ReportLab, pandas, ...) is imported at startup again.
+#
+#   python import_profile.py            # print the report
+#   python import_profile.py --check    # exit 1 on regression
+
+ROOT_DIR = Path(__file__).parent
+BUDGET_FILE = ROOT_DIR / 'import_budget.json'
+
+
+def profile_once(module: str) -> dict:
+    env = dict(os.environ)
+    # Creating the Mongo client does not connect, any URL will do
+    env.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    env.setdefault('DB_NAME', 'import_profile')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        modules[name.strip()] = {'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000,
+                                 'depth': depth}
+    return modules
+
+
+def profile(module: str, runs: int) -> dict:
+    samples = [profile_once(module) for _ in range(runs)]
+    names = set.intersection(*(set(s) for s in samples))
+    modules = {
+        name: {
+            'cumulative_ms': statistics.median(s[name]['cumulative_ms'] for s in samples),
+            'self_ms': statistics.median(s[name]['self_ms'] for s in samples),
+            'depth': samples[0][name]['depth'],
+        }
+        for name in names
+    }
+    return {'module': module, 'runs': runs, 'total_ms': modules[module]['cumulative_ms'], 'modules': modules}
+
+
+def print_report(report: dict, top: int):
+    print(f"import {report['module']}: {report['total_ms']:.0f} ms (median of {report['runs']} runs)")
+    direct = [(n, m) for n, m in report['modules'].items() if m['depth'] == 1]
+    print("\nDirect imports by cumulative time:")
+    for name, m in sorted(direct, key=lambda x: -x[1]['cumulative_ms'])[:top]:
+        print(f"  {m['cumulative_ms']:8.1f} ms  {name}")
+    print("\nSlowest modules by own time:")
+    for name, m in sorted(report['modules'].items(), key=lambda x: -x[1]['self_ms'])[:top]:
+        print(f"  {m['self_ms']:8.1f} ms  {name}")
+
+
+def check(report: dict, budget: dict) -> list:
+    problems = []
+    if report['total_ms'] > budget['max_total_ms']:
+        problems.append(f"import {report['module']} took {report['total_ms']:.0f} ms, "
+                        f"budget is {budget['max_total_ms']} ms")
+    loaded = {name.split('.')[0] for name in report['modules']}
+    for name in budget.get('deferred_modules', []):
+        if name in loaded:
+            problems.append(f"{name} is imported at startup but should be loaded lazily")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time profile of server.py')
+    parser.add_argument('--module', default='server')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--check', action='store_true', help='compare against import_budget.json')
+    parser.add_argument('--json', type=Path, help='also write the full report to this file')
+    args = parser.parse_args()
+
+    report = profile(args.module, args.runs)
+    print_report(report, args.top)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.check:
+        problems = check(report, json.loads(BUDGET_FILE.read_text()))
+        if problems:
+            print("\nImport budget exceeded:")
+            for problem in problems:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print("\nImport budget OK")
+
+
+if __name__ == "__main__":
+    main()
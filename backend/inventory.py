@@ -0,0 +1,389 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# Product stock, sharded for hot products.
+# Normally stock is the `stock` field of the product document. A product
+# whose decrement rate crosses `promote_rate` is promoted: its stock is
+# split across `shard_count` documents in `stock_shards`, and each
+# decrement goes to a random shard with enough stock, so concurrent
+# purchases no longer serialize on one document. `products.stock` then
+# becomes a display value that a rollup refreshes from the shards at most
+# once per `rollup_interval` (which also bounds catalog invalidations).
+# Products whose shards see no writes for `idle_seconds` are demoted back.
+#
+# Both transitions are fenced and idempotent, keyed by `stock_migration` on
+# the product, so any worker can finish one that a crashed worker started:
+#   promotion: flip `stock_sharded`, then move the stock into the shards,
+#              each shard recording the migration id it applied;
+#   demotion:  flip back with stock 0, then close each shard (no more
+#              decrements), add its final count to the product once
+#              (`stock_drained`) and delete it.
+# Decrements on unsharded products stay unconditional on the amount, as
+# before: a paid order is never refused here.
+#
+# decrement_once() keys a decrement (by the event that sold the stock) with a
+# claim in `stock_decrements`, so redelivered events don't take stock twice.
+
+logger = logging.getLogger(__name__)
+
+StockChanged = Callable[[str], Awaitable[None]]
+
+
+class DecrementInProgress(Exception):
+    """Another worker is applying the same keyed decrement; retry later."""
+
+
+def _split(total: int, parts: int) -> list:
+    if total < 0:
+        # An oversold balance is carried over on one shard
+        return [total] + [0] * (parts - 1)
+    base, extra = divmod(total, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+class Inventory:
+    def __init__(self, db, on_change: StockChanged, shard_count: int = 8, promote_rate: float = 5.0,
+                 rate_window: float = 10.0, idle_seconds: float = 600.0, rollup_interval: float = 1.0,
+                 claim_timeout: float = 60.0, claim_days: int = 7):
+        self.products = db.products
+        self.shards = db.stock_shards
+        self.claims = db.stock_decrements
+        self.on_change = on_change
+        self.shard_count = shard_count
+        self.promote_rate = promote_rate
+        self.rate_window = rate_window
+        self.idle_seconds = idle_seconds
+        self.rollup_interval = rollup_interval
+        self.claim_timeout = claim_timeout
+        self.claim_days = claim_days
+        self._recent: Dict[str, Deque[float]] = defaultdict(deque)
+        self._sharded: Dict[str, int] = {}  # product id -> shard count, as last seen
+        self._promoting: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Task] = set()
+        self.stats = {"direct": 0, "sharded": 0, "split": 0, "oversold": 0, "promoted": 0, "demoted": 0,
+                      "repeats": 0}
+
+    async def ensure_indexes(self):
+        await self.shards.create_index("product_id")
+        await self.products.create_index("stock_sharded", sparse=True)
+        await self.products.create_index("stock_migration", sparse=True)
+        await self.claims.create_index("expires_at", expireAfterSeconds=0)
+
+    @property
+    def sharded_products(self) -> list:
+        return sorted(self._sharded)
+
+    # ---- reads ----
+
+    async def available(self, product: dict) -> int:
+        """Sellable quantity of a product document (one extra query only for sharded products)."""
+        if not product.get("stock_sharded") and not product.get("stock_migration"):
+            return product.get("stock", 0)
+        if product.get("stock_sharded") and product.get("stock_migration"):
+            # Promotion in flight: the stock is still on the product
+            return product.get("stock", 0)
+        shards = await self.shards.find({"product_id": product["id"]}, {"_id": 1, "count": 1}).to_list(None)
+        if product.get("stock_sharded"):
+            return sum(s["count"] for s in shards)
+        drained = set(product.get("stock_drained", []))
+        return product.get("stock", 0) + sum(s["count"] for s in shards if s["_id"] not in drained)
+
+    # ---- writes ----
+
+    def _record(self, product_id: str):
+        now = time.monotonic()
+        recent = self._recent[product_id]
+        recent.append(now)
+        while recent and recent[0] < now - self.rate_window:
+            recent.popleft()
+        if (len(recent) / self.rate_window >= self.promote_rate and product_id not in self._sharded
+                and product_id not in self._promoting):
+            self._promoting.add(product_id)
+            # Held until done, so the task is not garbage collected mid-promotion
+            task = asyncio.create_task(self._promote_in_background(product_id))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def decrement(self, product_id: str, quantity: int):
+        self._record(product_id)
+        if product_id not in self._sharded:
+            result = await self.products.update_one(
+                {"id": product_id, "stock_sharded": {"$ne": True}}, {"$inc": {"stock": -quantity}}
+            )
+            if result.matched_count:
+                self.stats["direct"] += 1
+                await self.on_change(product_id)
+                return
+        for attempt in range(20):
+            product = await self.products.find_one(
+                {"id": product_id}, {"_id": 0, "id": 1, "stock_sharded": 1, "stock_shards": 1, "stock_migration": 1}
+            )
+            if product is None:
+                return
+            if not product.get("stock_sharded"):
+                # Demoted since we looked
+                self._sharded.pop(product_id, None)
+                return await self.decrement(product_id, quantity)
+            self._sharded[product_id] = product.get("stock_shards", self.shard_count)
+            if product.get("stock_migration"):
+                # Stock is still being moved into the shards
+                await asyncio.sleep(0.01 * (attempt + 1))
+                continue
+            await self._decrement_shards(product_id, self._sharded[product_id], quantity)
+            return
+        logger.warning(f"Stock promotion of {product_id} did not finish; decrementing shards anyway")
+        await self._decrement_shards(product_id, self._sharded.get(product_id, self.shard_count), quantity)
+
+    async def decrement_once(self, key: str, product_id: str, quantity: int):
+        """decrement(), applied at most once per `key` and product.
+
+        The key is claimed before the decrement and marked applied after it.
+        A repeat of an applied key is skipped; one another worker is still
+        applying raises DecrementInProgress. A claim left behind by a crash
+        mid-decrement is taken as applied, so stock is never taken twice.
+        """
+        claim_id = f"{key}:{product_id}"
+        now = datetime.now(timezone.utc)
+        try:
+            await self.claims.insert_one({"_id": claim_id, "state": "applying", "claimed_at": now,
+                                          "expires_at": now + timedelta(days=self.claim_days)})
+        except DuplicateKeyError:
+            claim = await self.claims.find_one({"_id": claim_id})
+            if claim is not None and claim["state"] == "applying":
+                claimed_at = claim["claimed_at"]
+                if claimed_at.tzinfo is None:
+                    claimed_at = claimed_at.replace(tzinfo=timezone.utc)
+                if now - claimed_at < timedelta(seconds=self.claim_timeout):
+                    raise DecrementInProgress(claim_id)
+                logger.warning(f"Stock decrement {claim_id} was interrupted; not applying it again")
+            self.stats["repeats"] += 1
+            return
+        try:
+            await self.decrement(product_id, quantity)
+        except BaseException:
+            await self.claims.delete_one({"_id": claim_id})
+            raise
+        await self.claims.update_one({"_id": claim_id}, {"$set": {"state": "applied"}})
+
+    async def _decrement_shards(self, product_id: str, shard_count: int, quantity: int):
+        now = datetime.now(timezone.utc)
+        order = random.sample(range(shard_count), shard_count)
+        for i in order:
+            result = await self.shards.update_one(
+                {"_id": f"{product_id}:{i}", "count": {"$gte": quantity}, "closed": {"$ne": True}},
+                {"$inc": {"count": -quantity}, "$set": {"last_write": now}},
+            )
+            if result.matched_count:
+                self.stats["sharded"] += 1
+                return
+
+        # No single shard has enough: take what each one has
+        self.stats["split"] += 1
+        remaining = quantity
+        for _ in range(5):
+            shards = await self.shards.find(
+                {"product_id": product_id, "count": {"$gt": 0}, "closed": {"$ne": True}}, {"_id": 1, "count": 1}
+            ).sort("count", -1).to_list(None)
+            if not shards:
+                break
+            for shard in shards:
+                take = min(shard["count"], remaining)
+                result = await self.shards.update_one(
+                    {"_id": shard["_id"], "count": shard["count"], "closed": {"$ne": True}},
+                    {"$inc": {"count": -take}, "$set": {"last_write": now}},
+                )
+                if result.matched_count:
+                    remaining -= take
+                    if remaining == 0:
+                        return
+        # Sold more than there is; record it like the unsharded path would
+        self.stats["oversold"] += 1
+        logger.warning(f"Oversold {remaining} of product {product_id}")
+        result = await self.shards.update_one(
+            {"_id": f"{product_id}:{order[0]}", "closed": {"$ne": True}},
+            {"$inc": {"count": -remaining}, "$set": {"last_write": now}},
+        )
+        if not result.matched_count:
+            # Being demoted; the product document is authoritative again
+            self._sharded.pop(product_id, None)
+            await self.decrement(product_id, remaining)
+
+    async def set_stock(self, product_id: str, stock: int) -> bool:
+        """Set a sharded product's stock by adjusting its shards; False if it isn't sharded."""
+        product = await self.products.find_one({"id": product_id}, {"_id": 0})
+        if not product or not product.get("stock_sharded") or product.get("stock_migration"):
+            return False
+        delta = stock - await self.available(product)
+        if delta > 0:
+            shard = random.randrange(product.get("stock_shards", self.shard_count))
+            await self.shards.update_one({"_id": f"{product_id}:{shard}", "closed": {"$ne": True}},
+                                         {"$inc": {"count": delta}})
+        elif delta < 0:
+            await self._decrement_shards(product_id, product.get("stock_shards", self.shard_count), -delta)
+        await self.rollup({product_id})
+        return True
+
+    async def forget(self, product_id: str):
+        self._sharded.pop(product_id, None)
+        self._recent.pop(product_id, None)
+        await self.shards.delete_many({"product_id": product_id})
+
+    # ---- promotion / demotion ----
+
+    async def _promote_in_background(self, product_id: str):
+        try:
+            await self.promote(product_id)
+        except Exception:
+            logger.exception(f"Stock promotion of {product_id} failed")
+        finally:
+            self._promoting.discard(product_id)
+
+    async def promote(self, product_id: str) -> bool:
+        migration = uuid.uuid4().hex
+        product = await self.products.find_one_and_update(
+            {"id": product_id, "stock_sharded": {"$ne": True}, "stock_migration": {"$exists": False}},
+            {"$set": {"stock_sharded": True, "stock_shards": self.shard_count, "stock_migration": migration}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if product is None:
+            return False
+        await self._finish_promotion(product)
+        self.stats["promoted"] += 1
+        logger.info(f"Product {product_id} stock sharded {self.shard_count} ways")
+        return True
+
+    async def _finish_promotion(self, product: dict):
+        product_id, migration = product["id"], product["stock_migration"]
+        shard_count = product.get("stock_shards", self.shard_count)
+        now = datetime.now(timezone.utc)
+        for i, share in enumerate(_split(product.get("stock", 0), shard_count)):
+            try:
+                await self.shards.update_one(
+                    {"_id": f"{product_id}:{i}", "migration": {"$ne": migration}},
+                    {"$inc": {"count": share},
+                     "$set": {"product_id": product_id, "migration": migration, "last_write": now}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                pass  # this shard already has its share
+        await self.products.update_one({"id": product_id, "stock_migration": migration},
+                                       {"$unset": {"stock_migration": ""}})
+        self._sharded[product_id] = shard_count
+
+    async def demote(self, product_id: str) -> bool:
+        migration = uuid.uuid4().hex
+        product = await self.products.find_one_and_update(
+            {"id": product_id, "stock_sharded": True, "stock_migration": {"$exists": False}},
+            {"$set": {"stock_sharded": False, "stock": 0, "stock_migration": migration, "stock_drained": []}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if product is None:
+            return False
+        self._sharded.pop(product_id, None)
+        await self._finish_demotion(product)
+        self.stats["demoted"] += 1
+        logger.info(f"Product {product_id} stock unsharded")
+        return True
+
+    async def _finish_demotion(self, product: dict):
+        product_id, migration = product["id"], product["stock_migration"]
+        shards = await self.shards.find({"product_id": product_id}, {"_id": 1}).to_list(None)
+        for shard in shards:
+            closed = await self.shards.find_one_and_update(
+                {"_id": shard["_id"]}, {"$set": {"closed": True}}, return_document=ReturnDocument.AFTER
+            )
+            if closed is None:
+                continue
+            await self.products.update_one(
+                {"id": product_id, "stock_migration": migration, "stock_drained": {"$ne": shard["_id"]}},
+                {"$inc": {"stock": closed["count"]}, "$push": {"stock_drained": shard["_id"]}},
+            )
+            await self.shards.delete_one({"_id": shard["_id"]})
+        await self.products.update_one(
+            {"id": product_id, "stock_migration": migration},
+            {"$unset": {"stock_migration": "", "stock_drained": "", "stock_shards": ""}},
+        )
+        await self.on_change(product_id)
+
+    # ---- background ----
+
+    async def rollup(self, product_ids: Optional[Set[str]] = None) -> Dict[str, dict]:
+        """Copy shard totals into products.stock; returns totals and last write per product."""
+        match = {"product_id": {"$in": list(product_ids)}} if product_ids is not None else {}
+        groups = await self.shards.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$product_id", "total": {"$sum": "$count"}, "last_write": {"$max": "$last_write"}}},
+        ]).to_list(None)
+        totals = {g["_id"]: g for g in groups}
+        for product_id, group in totals.items():
+            result = await self.products.update_one(
+                {"id": product_id, "stock_sharded": True, "stock_migration": {"$exists": False},
+                 "stock": {"$ne": group["total"]}},
+                {"$set": {"stock": group["total"]}},
+            )
+            if result.modified_count:
+                await self.on_change(product_id)
+        return totals
+
+    async def maintain(self):
+        products = await self.products.find(
+            {"$or": [{"stock_sharded": True}, {"stock_migration": {"$exists": True}}]},
+            {"_id": 0, "id": 1, "stock": 1, "stock_sharded": 1, "stock_shards": 1, "stock_migration": 1},
+        ).to_list(None)
+        sharded = set()
+        for product in products:
+            if product.get("stock_migration"):
+                # Finish transitions left behind; harmless if the owner is still at it
+                if product.get("stock_sharded"):
+                    await self._finish_promotion(product)
+                else:
+                    await self._finish_demotion(product)
+            if product.get("stock_sharded"):
+                sharded.add(product["id"])
+                self._sharded[product["id"]] = product.get("stock_shards", self.shard_count)
+        for product_id in set(self._sharded) - sharded:
+            del self._sharded[product_id]
+
+        if not sharded:
+            return
+        totals = await self.rollup(sharded)
+        idle_before = datetime.now(timezone.utc) - timedelta(seconds=self.idle_seconds)
+        for product_id, group in totals.items():
+            last_write = group.get("last_write")
+            if last_write is not None and last_write.tzinfo is None:
+                last_write = last_write.replace(tzinfo=timezone.utc)
+            if last_write is None or last_write < idle_before:
+                await self.demote(product_id)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.rollup_interval)
+            try:
+                await self.maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Inventory maintenance failed")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in list(self._background):
+            task.cancel()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,68 @@
+import importlib
+import logging
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+# Deferred imports for heavy, rarely used dependencies.
+# `lazy_import("pandas")` returns a stand-in that imports the real module on
+# first attribute access, so feature modules can keep module-level names
+# (`pd.DataFrame`) without paying the import cost when the server starts.
+# Every lazy module is registered so `prewarm()` can load them in the
+# background once the server is ready, before the first request needs one.
+
+logger = logging.getLogger(__name__)
+
+_registry: Dict[str, "LazyModule"] = {}
+_lock = threading.Lock()
+
+
+class LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    module = _registry.get(name)
+    if module is None:
+        module = _registry.setdefault(name, LazyModule(name))
+    return module
+
+
+def prewarm(names: Optional[Iterable[str]] = None) -> Dict[str, float]:
+    """Import registered modules now; returns seconds spent per module."""
+    timings = {}
+    for name in list(names if names is not None else _registry):
+        module = lazy_import(name)
+        if module.loaded:
+            continue
+        start = time.perf_counter()
+        try:
+            module.load()
+        except ImportError as e:
+            # Optional dependencies may be missing; callers report that themselves
+            logger.info(f"Skipping prewarm of {name}: {e}")
+            continue
+        timings[name] = time.perf_counter() - start
+    if timings:
+        logger.info("Prewarmed " + ", ".join(f"{n} ({t * 1000:.0f} ms)" for n, t in timings.items()))
+    return timings
@@ -0,0 +1,903 @@
+import copy
+import re
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+# In-memory stand-in for the Motor client, for hermetic in-process tests.
+# It implements the subset of the Motor API this backend uses (CRUD,
+# query/update operators, projections, sorting, unique, sparse and TTL
+# indexes, bulk writes, a basic aggregation pipeline) with the same async call
+# shapes, result types and errors, so `create_app(database=...)` runs the
+# whole API without a MongoDB server. Documents are deep-copied in and out
+# and datetimes are stored as naive UTC with millisecond precision, as a
+# real server returns them. Like a standalone mongod it has no change
+# streams or transactions, so the app falls back to polling.
+
+_MISSING = object()
+
+
+# ---- values ----
+
+def _to_stored(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    if isinstance(value, dict):
+        return {k: _to_stored(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_stored(v) for v in value]
+    return value
+
+
+def _type_rank(value) -> int:
+    if value is None or value is _MISSING:
+        return 0
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def _sort_key(value):
+    rank = _type_rank(value)
+    if rank == 0:
+        return (0, 0)
+    if rank in (3, 4, 10):
+        return (rank, repr(value))
+    return (rank, value)
+
+
+def _compare(a, b) -> Optional[int]:
+    """Comparison within one type class; None when the types don't compare."""
+    if _type_rank(a) != _type_rank(b):
+        return None
+    ka, kb = _sort_key(a), _sort_key(b)
+    return (ka > kb) - (ka < kb)
+
+
+# ---- paths ----
+
+def _resolve(value, parts: List[str]) -> list:
+    """All values at a dotted path, descending into arrays like MongoDB."""
+    if not parts:
+        return [value]
+    if isinstance(value, dict):
+        if parts[0] in value:
+            return _resolve(value[parts[0]], parts[1:])
+        return []
+    if isinstance(value, list):
+        found = []
+        if parts[0].isdigit() and int(parts[0]) < len(value):
+            found += _resolve(value[int(parts[0])], parts[1:])
+        for element in value:
+            if isinstance(element, dict):
+                found += _resolve(element, parts)
+        return found
+    return []
+
+
+def _candidates(values: list) -> list:
+    out = []
+    for value in values:
+        out.append(value)
+        if isinstance(value, list):
+            out.extend(value)
+    return out
+
+
+def _set_path(doc: dict, path: str, value):
+    parts = path.split(".")
+    target = doc
+    for i, part in enumerate(parts[:-1]):
+        if isinstance(target, list):
+            target = target[int(part)]
+            continue
+        if part not in target or not isinstance(target[part], (dict, list)):
+            target[part] = {}
+        target = target[part]
+    last = parts[-1]
+    if isinstance(target, list):
+        index = int(last)
+        while len(target) <= index:
+            target.append(None)
+        target[index] = value
+    else:
+        target[last] = value
+
+
+def _get_path(doc: dict, path: str, default=_MISSING):
+    target = doc
+    for part in path.split("."):
+        if isinstance(target, dict) and part in target:
+            target = target[part]
+        elif isinstance(target, list) and part.isdigit() and int(part) < len(target):
+            target = target[int(part)]
+        else:
+            return default
+    return target
+
+
+def _unset_path(doc: dict, path: str):
+    parts = path.split(".")
+    parent = _get_path(doc, ".".join(parts[:-1])) if len(parts) > 1 else doc
+    if isinstance(parent, dict):
+        parent.pop(parts[-1], None)
+
+
+# ---- queries ----
+
+def _is_operator_dict(value) -> bool:
+    return isinstance(value, dict) and bool(value) and all(k.startswith("$") for k in value)
+
+
+def _regex(pattern, options: str = "") -> "re.Pattern":
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)):
+        if option in options:
+            flags |= flag
+    return re.compile(pattern, flags)
+
+
+def _equals(value, target) -> bool:
+    if isinstance(target, re.Pattern):
+        return isinstance(value, str) and target.search(value) is not None
+    if _type_rank(value) != _type_rank(target):
+        return False
+    return value == target
+
+
+def _match_operator(op: str, arg, values: list, spec: dict) -> bool:
+    candidates = _candidates(values)
+    if op == "$eq":
+        return any(_equals(v, arg) for v in candidates) or (arg is None and not values)
+    if op == "$ne":
+        return not _match_operator("$eq", arg, values, spec)
+    if op == "$in":
+        return any(_match_operator("$eq", a, values, spec) for a in arg)
+    if op == "$nin":
+        return not _match_operator("$in", arg, values, spec)
+    if op in ("$lt", "$lte", "$gt", "$gte"):
+        for v in candidates:
+            result = _compare(v, arg)
+            if result is None:
+                continue
+            if (op == "$lt" and result < 0) or (op == "$lte" and result <= 0) \
+                    or (op == "$gt" and result > 0) or (op == "$gte" and result >= 0):
+                return True
+        return False
+    if op == "$exists":
+        return bool(values) == bool(arg)
+    if op == "$regex":
+        pattern = _regex(arg, spec.get("$options", ""))
+        return any(isinstance(v, str) and pattern.search(v) for v in candidates)
+    if op == "$options":
+        return True
+    if op == "$size":
+        return any(isinstance(v, list) and len(v) == arg for v in values)
+    if op == "$elemMatch":
+        for v in values:
+            if not isinstance(v, list):
+                continue
+            for element in v:
+                if isinstance(element, dict) and not _is_operator_dict(arg) and _matches(element, arg):
+                    return True
+                if _is_operator_dict(arg) and all(_match_operator(o, a, [element], arg) for o, a in arg.items()):
+                    return True
+        return False
+    if op == "$not":
+        if _is_operator_dict(arg):
+            return not all(_match_operator(o, a, values, arg) for o, a in arg.items())
+        return not _match_operator("$regex", arg, values, {})
+    if op == "$all":
+        return all(_match_operator("$eq", a, values, spec) for a in arg)
+    raise OperationFailure(f"unknown operator: {op}", code=2)
+
+
+def _match_field(doc, path: str, condition) -> bool:
+    values = _resolve(doc, path.split("."))
+    if _is_operator_dict(condition):
+        return all(_match_operator(op, arg, values, condition) for op, arg in condition.items())
+    return _match_operator("$eq", condition, values, {})
+
+
+def _matches(doc: dict, query: Optional[dict]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(_matches(doc, q) for q in condition):
+                return False
+        elif key == "$nor":
+            if any(_matches(doc, q) for q in condition):
+                return False
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}", code=2)
+        elif not _match_field(doc, key, condition):
+            return False
+    return True
+
+
+def _query_equalities(query: dict) -> Dict[str, Any]:
+    """Fields an upsert copies from its filter."""
+    fields = {}
+    for key, condition in query.items():
+        if key == "$and":
+            for sub in condition:
+                fields.update(_query_equalities(sub))
+        elif key.startswith("$"):
+            continue
+        elif _is_operator_dict(condition):
+            if "$eq" in condition:
+                fields[key] = condition["$eq"]
+        else:
+            fields[key] = condition
+    return fields
+
+
+# ---- updates ----
+
+def _positional_path(doc: dict, path: str, query: dict) -> str:
+    if ".$." not in path and not path.endswith(".$"):
+        return path
+    prefix, _, rest = path.partition(".$")
+    array = _get_path(doc, prefix)
+    if isinstance(array, list):
+        for index, element in enumerate(array):
+            for key, condition in query.items():
+                if key == prefix:
+                    if _match_field({"v": element}, "v", condition):
+                        return f"{prefix}.{index}{rest}"
+                elif key.startswith(prefix + "."):
+                    if _match_field(element, key[len(prefix) + 1:], condition):
+                        return f"{prefix}.{index}{rest}"
+    raise OperationFailure("The positional operator did not find the match needed from the query.", code=2)
+
+
+def _apply_update(doc: dict, update: dict, query: dict, inserting: bool) -> bool:
+    """Apply update operators in place; returns whether the document changed."""
+    before = copy.deepcopy(doc)
+    for op, fields in update.items():
+        if not op.startswith("$"):
+            raise OperationFailure("update only works with $ operators", code=9)
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for raw_path, arg in fields.items():
+            path = _positional_path(doc, raw_path, query)
+            current = _get_path(doc, path)
+            if op in ("$set", "$setOnInsert"):
+                _set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$unset":
+                _unset_path(doc, path)
+            elif op == "$inc":
+                _set_path(doc, path, (0 if current is _MISSING else current) + arg)
+            elif op == "$mul":
+                _set_path(doc, path, (0 if current is _MISSING else current) * arg)
+            elif op in ("$min", "$max"):
+                if current is _MISSING or (_compare(arg, current) or 0) * (1 if op == "$max" else -1) > 0:
+                    _set_path(doc, path, copy.deepcopy(arg))
+            elif op in ("$push", "$addToSet"):
+                items = arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]
+                array = [] if current is _MISSING else current
+                if not isinstance(array, list):
+                    raise OperationFailure(f"The field '{path}' must be an array", code=2)
+                for item in items:
+                    if op == "$push" or item not in array:
+                        array.append(copy.deepcopy(item))
+                _set_path(doc, path, array)
+            elif op == "$pull":
+                if isinstance(current, list):
+                    if isinstance(arg, dict) and not _is_operator_dict(arg):
+                        kept = [e for e in current if not (isinstance(e, dict) and _matches(e, arg))]
+                    elif _is_operator_dict(arg):
+                        kept = [e for e in current if not _match_field({"v": e}, "v", arg)]
+                    else:
+                        kept = [e for e in current if e != arg]
+                    _set_path(doc, path, kept)
+            elif op == "$currentDate":
+                _set_path(doc, path, _to_stored(datetime.now(timezone.utc)))
+            else:
+                raise OperationFailure(f"Unknown modifier: {op}", code=9)
+    changed = doc != before
+    if changed:
+        doc.update(_to_stored(doc))
+    return changed
+
+
+# ---- projections and sorting ----
+
+def _project(doc: dict, projection) -> dict:
+    if projection is None:
+        return copy.deepcopy(doc)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = bool(projection.get("_id", 1))
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(fields.values()):
+        result = {}
+        for path in fields:
+            _copy_path(doc, result, path.split("."))
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return copy.deepcopy(result)
+    result = copy.deepcopy(doc)
+    for path in fields:
+        _unset_path(result, path)
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def _copy_path(source, target: dict, parts: List[str]):
+    if not isinstance(source, dict) or parts[0] not in source:
+        return
+    value = source[parts[0]]
+    if len(parts) == 1:
+        target[parts[0]] = value
+    elif isinstance(value, dict):
+        _copy_path(value, target.setdefault(parts[0], {}), parts[1:])
+    elif isinstance(value, list):
+        projected = target.setdefault(parts[0], [{} for _ in value] if all(isinstance(e, dict) for e in value) else [])
+        for element, out in zip(value, projected):
+            if isinstance(element, dict):
+                _copy_path(element, out, parts[1:])
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(k, d) for k, d in key_or_list]
+
+
+def _sort_docs(docs: List[dict], spec: List[Tuple[str, int]]) -> List[dict]:
+    for path, direction in reversed(spec):
+        def key(doc, path=path, direction=direction):
+            values = _candidates(_resolve(doc, path.split(".")))
+            values = [v for v in values if not isinstance(v, list)] or [None]
+            chosen = min(values, key=_sort_key) if direction == 1 else max(values, key=_sort_key)
+            return _sort_key(chosen)
+        docs.sort(key=key, reverse=direction == -1)
+    return docs
+
+
+def _normalize_index_keys(keys) -> List[Tuple[str, int]]:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    return [(k, d) for k, d in keys]
+
+
+# ---- cursors ----
+
+class MemoryCursor:
+    def __init__(self, producer, projection=None):
+        self._producer = producer
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[List[dict]] = None
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _materialize(self) -> List[dict]:
+        if self._results is None:
+            docs = _sort_docs(list(self._producer()), self._sort)[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            self._results = [_project(d, self._projection) for d in docs]
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._materialize()
+        if length:
+            taken, self._results = results[:length], results[length:]
+            return taken
+        self._results = []
+        return results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        results = self._materialize()
+        if not results:
+            raise StopAsyncIteration
+        return results.pop(0)
+
+    async def next(self):
+        return await self.__anext__()
+
+    async def close(self):
+        self._results = []
+
+
+# ---- aggregation ----
+
+def _expression(doc: dict, expr):
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get_path(doc, expr[1:], None)
+    if isinstance(expr, dict):
+        if len(expr) == 1 and next(iter(expr)).startswith("$"):
+            op, args = next(iter(expr.items()))
+            values = [_expression(doc, a) for a in (args if isinstance(args, list) else [args])]
+            if op == "$add":
+                return sum(values)
+            if op == "$multiply":
+                result = 1
+                for v in values:
+                    result *= v
+                return result
+            if op == "$subtract":
+                return values[0] - values[1]
+            if op == "$divide":
+                return values[0] / values[1]
+            raise OperationFailure(f"Unsupported expression operator: {op}", code=168)
+        return {k: _expression(doc, v) for k, v in expr.items()}
+    return expr
+
+
+def _group(docs: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[Any, dict] = {}
+    members: Dict[Any, List[dict]] = {}
+    for doc in docs:
+        key = _expression(doc, spec["_id"])
+        marker = repr(key)
+        groups.setdefault(marker, {"_id": key})
+        members.setdefault(marker, []).append(doc)
+    out = []
+    for marker, result in groups.items():
+        rows = members[marker]
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            op, expr = next(iter(accumulator.items()))
+            values = [_expression(row, expr) for row in rows]
+            present = [v for v in values if v is not None]
+            if op == "$sum":
+                result[field] = sum(v for v in values if isinstance(v, (int, float)))
+            elif op == "$avg":
+                numbers = [v for v in present if isinstance(v, (int, float))]
+                result[field] = sum(numbers) / len(numbers) if numbers else None
+            elif op == "$min":
+                result[field] = min(present, key=_sort_key) if present else None
+            elif op == "$max":
+                result[field] = max(present, key=_sort_key) if present else None
+            elif op == "$first":
+                result[field] = values[0]
+            elif op == "$last":
+                result[field] = values[-1]
+            elif op == "$push":
+                result[field] = values
+            elif op == "$addToSet":
+                result[field] = [v for i, v in enumerate(values) if v not in values[:i]]
+            elif op == "$count":
+                result[field] = len(rows)
+            else:
+                raise OperationFailure(f"Unsupported accumulator: {op}", code=15952)
+        out.append(result)
+    return out
+
+
+def _run_pipeline(docs: List[dict], pipeline: List[dict]) -> List[dict]:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if _matches(d, spec)]
+        elif name == "$group":
+            docs = _group(docs, spec)
+        elif name == "$sort":
+            docs = _sort_docs(docs, _normalize_sort(spec))
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$project":
+            docs = [_project(d, spec) for d in docs]
+        elif name == "$unwind":
+            path = (spec if isinstance(spec, str) else spec["path"])[1:]
+            unwound = []
+            for d in docs:
+                for element in _get_path(d, path, None) or []:
+                    row = copy.deepcopy(d)
+                    _set_path(row, path, element)
+                    unwound.append(row)
+            docs = unwound
+        elif name == "$count":
+            docs = [{spec: len(docs)}]
+        else:
+            raise OperationFailure(f"Unrecognized pipeline stage name: {name}", code=40324)
+    return docs
+
+
+# ---- collections ----
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        self._indexes: Dict[str, dict] = {"_id_": {"key": [("_id", 1)], "unique": True}}
+        # Unique secondary indexes: index name -> key -> _id
+        self._unique: Dict[str, Dict[tuple, Any]] = {}
+        self._ttl_checked = 0.0
+
+    def __getitem__(self, name: str) -> "MemoryCollection":
+        return self.database[f"{self.name}.{name}"]
+
+    # ---- indexes ----
+
+    async def create_index(self, keys, unique: bool = False, expireAfterSeconds: Optional[int] = None,
+                           name: Optional[str] = None, **kwargs) -> str:
+        keys = _normalize_index_keys(keys)
+        name = name or "_".join(f"{k}_{d}" for k, d in keys)
+        spec = {"key": keys, "unique": unique}
+        if kwargs.get("sparse"):
+            spec["sparse"] = True
+        if expireAfterSeconds is not None:
+            spec["expireAfterSeconds"] = expireAfterSeconds
+        if unique and name not in self._unique:
+            entries = {}
+            for doc in self._docs.values():
+                key = self._index_key(doc, keys, spec.get("sparse", False))
+                if key is None:
+                    continue
+                if key in entries:
+                    raise DuplicateKeyError(self._duplicate_message(name), 11000)
+                entries[key] = doc["_id"]
+            self._unique[name] = entries
+        self._indexes[name] = spec
+        return name
+
+    async def index_information(self) -> dict:
+        return copy.deepcopy(self._indexes)
+
+    async def drop_indexes(self):
+        self._indexes = {"_id_": self._indexes["_id_"]}
+        self._unique = {}
+
+    @staticmethod
+    def _index_key(doc: dict, keys: List[Tuple[str, int]], sparse: bool = False) -> Optional[tuple]:
+        """Key of `doc` in an index; None when a sparse index leaves the document out."""
+        if sparse and all(_get_path(doc, path) is _MISSING for path, _ in keys):
+            return None
+        return tuple(repr(_get_path(doc, path, None)) for path, _ in keys)
+
+    def _unique_key(self, doc: dict, name: str) -> Optional[tuple]:
+        spec = self._indexes[name]
+        return self._index_key(doc, spec["key"], spec.get("sparse", False))
+
+    def _duplicate_message(self, index: str) -> str:
+        return f"E11000 duplicate key error collection: {self.database.name}.{self.name} index: {index}"
+
+    def _check_unique(self, doc: dict, ignore_id=_MISSING):
+        for name, entries in self._unique.items():
+            key = self._unique_key(doc, name)
+            other_id = _MISSING if key is None else entries.get(key, _MISSING)
+            if other_id is not _MISSING and other_id != ignore_id:
+                raise DuplicateKeyError(self._duplicate_message(name), 11000)
+
+    def _store(self, doc: dict):
+        """Insert or replace a document, keeping unique indexes in step."""
+        old = self._docs.get(doc["_id"])
+        if old is not None:
+            self._unstore(doc["_id"])
+        self._docs[doc["_id"]] = doc
+        for name, entries in self._unique.items():
+            key = self._unique_key(doc, name)
+            if key is not None:
+                entries[key] = doc["_id"]
+
+    def _unstore(self, doc_id):
+        doc = self._docs.pop(doc_id)
+        for name, entries in self._unique.items():
+            key = self._unique_key(doc, name)
+            if key is not None and entries.get(key) == doc_id:
+                del entries[key]
+
+    def _expire(self):
+        # TTL monitor; a real server runs it every 60 seconds, this runs at most once a second
+        now = time.monotonic()
+        if now - self._ttl_checked < 1.0:
+            return
+        self._ttl_checked = now
+        for spec in self._indexes.values():
+            if "expireAfterSeconds" not in spec:
+                continue
+            path = spec["key"][0][0]
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=spec["expireAfterSeconds"])
+            for doc_id, doc in list(self._docs.items()):
+                value = _get_path(doc, path, None)
+                if isinstance(value, datetime) and value < cutoff:
+                    self._unstore(doc_id)
+
+    def _select(self, query: Optional[dict]) -> List[dict]:
+        self._expire()
+        query = _to_stored(query or {})
+        return [doc for doc in self._docs.values() if _matches(doc, query)]
+
+    # ---- reads ----
+
+    def find(self, filter: Optional[dict] = None, projection=None, sort=None, skip: int = 0, limit: int = 0,
+             session=None, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(lambda: self._select(filter), projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    async def find_one(self, filter=None, projection=None, sort=None, session=None, **kwargs) -> Optional[dict]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        docs = await self.find(filter, projection, sort=sort, limit=1).to_list(1)
+        return docs[0] if docs else None
+
+    async def count_documents(self, filter: dict, session=None, **kwargs) -> int:
+        docs = self._select(filter)
+        skip, limit = kwargs.get("skip", 0), kwargs.get("limit", 0)
+        docs = docs[skip:]
+        return len(docs[:limit] if limit else docs)
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    async def distinct(self, key: str, filter: Optional[dict] = None, session=None, **kwargs) -> list:
+        values = []
+        for doc in self._select(filter):
+            for value in _candidates(_resolve(doc, key.split("."))):
+                if isinstance(value, list) or value in values:
+                    continue
+                values.append(copy.deepcopy(value))
+        return values
+
+    def aggregate(self, pipeline: List[dict], session=None, **kwargs) -> MemoryCursor:
+        return MemoryCursor(lambda: _run_pipeline(copy.deepcopy(self._select({})), _to_stored(pipeline)))
+
+    # ---- writes ----
+
+    def _insert(self, document: dict):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        doc = _to_stored(copy.deepcopy(document))
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(self._duplicate_message("_id_"), 11000)
+        self._check_unique(doc)
+        self._store(doc)
+        return doc["_id"]
+
+    async def insert_one(self, document: dict, session=None, **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True, session=None,
+                          **kwargs) -> InsertManyResult:
+        return InsertManyResult([self._insert(d) for d in documents], True)
+
+    def _update(self, filter: dict, update: dict, upsert: bool, multi: bool, sort=None) -> Tuple[dict, list]:
+        """Returns the raw result and (before, after) pairs of changed documents."""
+        filter = _to_stored(filter)
+        update = _to_stored(update)
+        matched = _sort_docs(self._select(filter), _normalize_sort(sort))
+        if not multi:
+            matched = matched[:1]
+        changes = []
+        modified = 0
+        for doc in matched:
+            candidate = copy.deepcopy(doc)
+            if _apply_update(candidate, update, filter, inserting=False):
+                if candidate.get("_id") != doc["_id"]:
+                    raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'", code=66)
+                self._check_unique(candidate, ignore_id=doc["_id"])
+                modified += 1
+            changes.append((copy.deepcopy(doc), candidate))
+        for _, after in changes:
+            self._store(after)
+        raw = {"n": len(matched), "nModified": modified}
+
+        if not matched and upsert:
+            doc = {}
+            for path, value in _query_equalities(filter).items():
+                _set_path(doc, path, copy.deepcopy(value))
+            _apply_update(doc, update, filter, inserting=True)
+            raw["upserted"] = self._insert(doc)
+            raw["n"] = 1
+            changes.append((None, self._docs[raw["upserted"]]))
+        return raw, changes
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, session=None,
+                         **kwargs) -> UpdateResult:
+        raw, _ = self._update(filter, update, upsert, multi=False, sort=kwargs.get("sort"))
+        return UpdateResult(raw, True)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, session=None,
+                          **kwargs) -> UpdateResult:
+        raw, _ = self._update(filter, update, upsert, multi=True)
+        return UpdateResult(raw, True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, session=None,
+                          **kwargs) -> UpdateResult:
+        matched = self._select(filter)[:1]
+        if matched:
+            doc_id = matched[0]["_id"]
+            doc = _to_stored(copy.deepcopy(replacement))
+            doc["_id"] = doc_id
+            self._check_unique(doc, ignore_id=doc_id)
+            modified = int(self._docs[doc_id] != doc)
+            self._store(doc)
+            return UpdateResult({"n": 1, "nModified": modified}, True)
+        if upsert:
+            doc = copy.deepcopy(replacement)
+            equalities = _query_equalities(_to_stored(filter))
+            if "_id" in equalities and "_id" not in doc:
+                doc["_id"] = equalities["_id"]
+            return UpdateResult({"n": 1, "nModified": 0, "upserted": self._insert(doc)}, True)
+        return UpdateResult({"n": 0, "nModified": 0}, True)
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection=None, sort=None,
+                                  upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                                  session=None, **kwargs) -> Optional[dict]:
+        _, changes = self._update(filter, update, upsert, multi=False, sort=sort)
+        if not changes:
+            return None
+        before, after = changes[0]
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return None if doc is None else _project(doc, projection)
+
+    async def find_one_and_delete(self, filter: dict, projection=None, sort=None, session=None,
+                                  **kwargs) -> Optional[dict]:
+        matched = _sort_docs(self._select(filter), _normalize_sort(sort))[:1]
+        if not matched:
+            return None
+        self._unstore(matched[0]["_id"])
+        return _project(matched[0], projection)
+
+    async def delete_one(self, filter: dict, session=None, **kwargs) -> DeleteResult:
+        matched = self._select(filter)[:1]
+        for doc in matched:
+            self._unstore(doc["_id"])
+        return DeleteResult({"n": len(matched)}, True)
+
+    async def delete_many(self, filter: dict, session=None, **kwargs) -> DeleteResult:
+        matched = self._select(filter)
+        for doc in matched:
+            self._unstore(doc["_id"])
+        return DeleteResult({"n": len(matched)}, True)
+
+    async def bulk_write(self, requests: list, ordered: bool = True, session=None, **kwargs) -> BulkWriteResult:
+        result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        for index, request in enumerate(requests):
+            kind = type(request).__name__
+            if kind == "InsertOne":
+                await self.insert_one(request._doc)
+                result["nInserted"] += 1
+                continue
+            if kind in ("DeleteOne", "DeleteMany"):
+                deleted = await (self.delete_one if kind == "DeleteOne" else self.delete_many)(request._filter)
+                result["nRemoved"] += deleted.deleted_count
+                continue
+            if kind == "ReplaceOne":
+                updated = await self.replace_one(request._filter, request._doc, upsert=bool(request._upsert))
+            elif kind in ("UpdateOne", "UpdateMany"):
+                raw, _ = self._update(request._filter, request._doc, bool(request._upsert), multi=kind == "UpdateMany")
+                updated = UpdateResult(raw, True)
+            else:
+                raise OperationFailure(f"Unsupported bulk write operation: {kind}", code=2)
+            if updated.upserted_id is not None:
+                result["nUpserted"] += 1
+                result["upserted"].append({"index": index, "_id": updated.upserted_id})
+            else:
+                result["nMatched"] += updated.matched_count
+                result["nModified"] += updated.modified_count
+        return BulkWriteResult(result, True)
+
+    async def drop(self, session=None):
+        self._docs.clear()
+        await self.drop_indexes()
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+
+# ---- databases and client ----
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return [name for name, c in self._collections.items() if c._docs]
+
+    async def drop_collection(self, name: str, **kwargs):
+        self._collections.pop(name, None)
+
+    async def command(self, command, *args, **kwargs) -> dict:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name == "ping":
+            return {"ok": 1.0}
+        if name in ("hello", "isMaster", "ismaster"):
+            # A standalone server: no replica set, so no change streams or snapshot reads
+            return {"isWritablePrimary": True, "ismaster": True, "maxWireVersion": 21, "ok": 1.0}
+        if name == "buildInfo":
+            return {"version": "7.0.0-memory", "ok": 1.0}
+        raise OperationFailure(f"no such command: '{name}'", code=59)
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+
+class MemoryClient:
+    def __init__(self):
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        return self[name]
+
+    async def list_database_names(self) -> List[str]:
+        return list(self._databases)
+
+    async def start_session(self, **kwargs):
+        raise OperationFailure("Sessions are not supported by the in-memory backend", code=20)
+
+    def close(self):
+        pass
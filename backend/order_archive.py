@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+import zlib
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from outbox import OUTBOX_FIELD
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib is used when unavailable
+    zstandard = None
+
+# Hot/cold tiering for orders.
+# Delivered orders older than `min_age_days` are moved out of `orders` into
+# append-only segment files, one set per month of order creation. A segment
+# is a sequence of independently compressed blocks of JSON lines, so reading
+# one order only decompresses its block. `order_archive_index` maps each
+# archived order to its segment/block and keeps the few fields needed for
+# listing, which keeps the hot collection small.
+#
+# Segments live on local disk under `archive_dir`, so every worker that
+# serves orders must see the same directory: on more than one host it has
+# to be a shared mount. A worker without the segment logs it as missing and
+# leaves the order out.
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64  # orders per compressed block
+
+
+class _Codec:
+    def __init__(self, name: str):
+        self.name = name
+
+    def compress(self, data: bytes) -> bytes:
+        if self.name == "zstd":
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return zlib.compress(data, 9)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.name == "zstd":
+            return zstandard.ZstdDecompressor().decompress(data)
+        return zlib.decompress(data)
+
+
+CODECS = {"zlib": _Codec("zlib"), "zstd": _Codec("zstd")}
+
+
+class OrderArchive:
+    def __init__(self, db, archive_dir: Path, min_age_days: int = 180, block_cache_size: int = 64,
+                 codec: Optional[str] = None):
+        self.db = db
+        self.archive_dir = Path(archive_dir)
+        self.min_age_days = min_age_days
+        self.codec = CODECS[codec or ("zstd" if zstandard else "zlib")]
+        self._block_cache: "OrderedDict[Tuple[str, int], List[dict]]" = OrderedDict()
+        self._block_cache_size = block_cache_size
+        self._running = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        await self.db.order_archive_index.create_index([("user_id", 1), ("created_at", -1)])
+        # Keep the hot listing queries on an index as well
+        await self.db.orders.create_index([("user_id", 1), ("created_at", -1)])
+        await self.db.orders.create_index([("status", 1), ("created_at", 1)])
+
+    # ---- archiving ----
+
+    def _write_segment(self, month: str, orders: List[dict]) -> Tuple[str, List[Tuple[int, int]]]:
+        """Write one immutable segment file; returns its name and block extents."""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        name = f"orders-{month}-{uuid.uuid4().hex[:8]}.{self.codec.name}.seg"
+        tmp_path = self.archive_dir / f".{name}.tmp"
+        extents = []
+        offset = 0
+        with open(tmp_path, "wb") as f:
+            for start in range(0, len(orders), BLOCK_SIZE):
+                lines = "\n".join(json.dumps(o, default=str) for o in orders[start:start + BLOCK_SIZE])
+                block = self.codec.compress(lines.encode("utf-8"))
+                f.write(block)
+                extents.append((offset, len(block)))
+                offset += len(block)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.archive_dir / name)
+        return name, extents
+
+    async def archive_once(self, batch_size: int = 5000) -> int:
+        """Move eligible orders to segment files. Returns the number archived."""
+        async with self._running:
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=self.min_age_days)).isoformat()
+            orders = await self.db.orders.find(
+                # Orders with undelivered outbox events wait for the relay
+                {"status": "delivered", "created_at": {"$lt": cutoff}, OUTBOX_FIELD: {"$exists": False}}, {"_id": 0}
+            ).sort("created_at", 1).to_list(batch_size)
+            if not orders:
+                return 0
+
+            by_month: Dict[str, List[dict]] = defaultdict(list)
+            for order in orders:
+                by_month[order["created_at"][:7]].append(order)
+
+            archived = 0
+            for month, month_orders in by_month.items():
+                segment, extents = await asyncio.to_thread(self._write_segment, month, month_orders)
+                index_ops = []
+                for i, order in enumerate(month_orders):
+                    offset, length = extents[i // BLOCK_SIZE]
+                    index_ops.append(UpdateOne({"_id": order["id"]}, {"$set": {
+                        "user_id": order["user_id"],
+                        "created_at": order["created_at"],
+                        "status": order["status"],
+                        "payment_status": order["payment_status"],
+                        "total_amount": order["total_amount"],
+                        "item_count": len(order.get("items", [])),
+                        "segment": segment,
+                        "offset": offset,
+                        "length": length,
+                    }}, upsert=True))
+                # Index first, then delete: a crash in between leaves the order
+                # readable from both tiers, never from neither
+                await self.db.order_archive_index.bulk_write(index_ops, ordered=False)
+                ids = [o["id"] for o in month_orders]
+                await self.db.orders.delete_many({"id": {"$in": ids}, "status": "delivered"})
+                archived += len(ids)
+                logger.info(f"Archived {len(ids)} orders from {month} into {segment}")
+            return archived
+
+    # ---- reading ----
+
+    def _read_block(self, segment: str, offset: int, length: int) -> List[dict]:
+        # Runs in a worker thread: file IO and decompression only
+        codec = CODECS[segment.rsplit(".", 2)[-2]]
+        with open(self.archive_dir / segment, "rb") as f:
+            f.seek(offset)
+            data = codec.decompress(f.read(length))
+        return [json.loads(line) for line in data.decode("utf-8").split("\n") if line]
+
+    async def _load(self, entries: List[dict]) -> Dict[str, dict]:
+        blocks = {(e["segment"], e["offset"], e["length"]) for e in entries}
+        wanted = {e["_id"] for e in entries}
+        found = {}
+        for segment, offset, length in blocks:
+            key = (segment, offset)
+            orders = self._block_cache.get(key)
+            if orders is not None:
+                self._block_cache.move_to_end(key)
+            else:
+                try:
+                    orders = await asyncio.to_thread(self._read_block, segment, offset, length)
+                except FileNotFoundError:
+                    logger.error(f"Archive segment {segment} is missing")
+                    continue
+                self._block_cache[key] = orders
+                if len(self._block_cache) > self._block_cache_size:
+                    self._block_cache.popitem(last=False)
+            for order in orders:
+                if order["id"] in wanted:
+                    found[order["id"]] = order
+        return found
+
+    async def find(self, order_id: str, user_id: Optional[str] = None) -> Optional[dict]:
+        query = {"_id": order_id}
+        if user_id is not None:
+            query["user_id"] = user_id
+        entry = await self.db.order_archive_index.find_one(query)
+        if not entry:
+            return None
+        return (await self._load([entry])).get(order_id)
+
+    async def list_entries(self, user_id: str, limit: int = 1000) -> List[dict]:
+        """Index entries of a user's archived orders, newest first, without reading any segment."""
+        entries = await self.db.order_archive_index.find({"user_id": user_id}).sort("created_at", -1).to_list(limit)
+        return [{**entry, "id": entry["_id"]} for entry in entries]
+
+    async def load(self, entries: List[dict]) -> Dict[str, dict]:
+        """Full archived orders for `entries`, by id; orders whose segment is missing are left out."""
+        if not entries:
+            return {}
+        return await self._load(entries)
+
+    async def iter_orders(self, created_window: dict, batch_size: int = 5000):
+        """Yield archived orders created within `created_window`, oldest first."""
+        cursor = self.db.order_archive_index.find({"created_at": created_window}).sort("created_at", 1)
+        entries = []
+        async for entry in cursor:
+            entries.append(entry)
+            if len(entries) >= batch_size:
+                yield await self._load_batch(entries)
+                entries = []
+        if entries:
+            yield await self._load_batch(entries)
+
+    async def _load_batch(self, entries: List[dict]) -> List[dict]:
+        found = await self._load(entries)
+        # Orders caught between indexing and deletion are still hot; report them once
+        ids = list(found)
+        hot = {o["id"] async for o in self.db.orders.find({"id": {"$in": ids}}, {"_id": 0, "id": 1})}
+        return [found[e["_id"]] for e in entries if e["_id"] in found and e["_id"] not in hot]
+
+    # ---- background ----
+
+    async def _acquire_run_lock(self, hold: timedelta) -> bool:
+        # Only one worker archives per interval
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.archive_locks.update_one(
+                {"_id": "orders", "until": {"$lt": now}}, {"$set": {"until": now + hold}}, upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def run_forever(self, interval_hours: float, batch_size: int = 5000):
+        while True:
+            try:
+                if await self._acquire_run_lock(timedelta(hours=interval_hours)):
+                    while await self.archive_once(batch_size) == batch_size:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Order archiving failed")
+            await asyncio.sleep(interval_hours * 3600)
@@ -0,0 +1,278 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import socket
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone, timedelta
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set
+
+from pymongo.errors import PyMongoError
+
+# Server-Sent Events fan-out for order and payment status.
+# Handlers publish to a per-user topic on the EventBroker; every open
+# EventSource connection holds a small queue subscribed to its topic. A
+# broadcast backend carries events to the other workers, and a short history
+# per topic lets reconnecting clients resume from Last-Event-ID.
+#
+# An event published with a key is delivered once per worker however many
+# times it is published, so a change can be announced right away by the
+# worker that made it and again, at least once, by the outbox relay.
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StreamEvent:
+    id: str
+    topic: str
+    event: str
+    data: dict = field(default_factory=dict)
+    key: Optional[str] = None  # dedupe key, see EventBroker.publish
+
+    @property
+    def sort_key(self):
+        return parse_event_id(self.id)
+
+    def encode(self) -> str:
+        return f"id: {self.id}\nevent: {self.event}\ndata: {json.dumps(self.data, default=str)}\n\n"
+
+
+def parse_event_id(event_id: str):
+    # Ids are "<epoch ms>-<sequence>" so they order across workers by time
+    try:
+        ms, seq = event_id.split("-", 1)
+        return int(ms), int(seq)
+    except ValueError:
+        return None
+
+
+class LocalBroadcastBackend:
+    """Single-worker deployments: nothing to forward."""
+
+    async def start(self, broker: "EventBroker"):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: StreamEvent):
+        pass
+
+
+class MongoBroadcastBackend:
+    """Forwards events to other workers through a TTL-indexed collection."""
+
+    def __init__(self, collection, poll_interval: float = 0.5, ttl_seconds: int = 600):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.ttl_seconds = ttl_seconds
+        self.origin = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, broker: "EventBroker"):
+        await self.collection.create_index("ts", expireAfterSeconds=self.ttl_seconds)
+        self._task = asyncio.create_task(self._poll(broker))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def publish(self, event: StreamEvent):
+        await self.collection.insert_one({
+            "event_id": event.id,
+            "topic": event.topic,
+            "event": event.event,
+            "data": event.data,
+            "key": event.key,
+            "origin": self.origin,
+            "ts": datetime.now(timezone.utc),
+        })
+
+    async def _poll(self, broker: "EventBroker"):
+        # Re-reads an overlap window for events timestamped slightly out of order,
+        # in pages ordered by (ts, _id) so a burst bigger than a page still moves on.
+        # Ids seen are remembered for as long as they can be read again.
+        overlap = timedelta(seconds=max(self.poll_interval * 4, 2))
+        page_size = 1000
+        last_ts = datetime.now(timezone.utc)
+        seen: Deque = deque()  # (ts, _id), oldest first
+        seen_ids: Set = set()
+        while True:
+            try:
+                query = {"ts": {"$gte": last_ts - overlap}, "origin": {"$ne": self.origin}}
+                while True:
+                    entries = await self.collection.find(query).sort([("ts", 1), ("_id", 1)]).to_list(page_size)
+                    for entry in entries:
+                        if entry["_id"] in seen_ids:
+                            continue
+                        ts = entry["ts"] if entry["ts"].tzinfo else entry["ts"].replace(tzinfo=timezone.utc)
+                        seen.append((ts, entry["_id"]))
+                        seen_ids.add(entry["_id"])
+                        last_ts = max(last_ts, ts)
+                        broker.deliver(StreamEvent(entry["event_id"], entry["topic"], entry["event"], entry["data"],
+                                                   entry.get("key")))
+                    if len(entries) < page_size:
+                        break
+                    last = entries[-1]
+                    query = {
+                        "origin": {"$ne": self.origin},
+                        "$or": [{"ts": {"$gt": last["ts"]}}, {"ts": last["ts"], "_id": {"$gt": last["_id"]}}],
+                    }
+                while seen and seen[0][0] < last_ts - overlap:
+                    seen_ids.discard(seen.popleft()[1])
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Event broadcast poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+
+class EventBroker:
+    def __init__(self, backend=None, history_size: int = 50, history_ttl: float = 300.0, queue_size: int = 100):
+        self.backend = backend or LocalBroadcastBackend()
+        self.history_size = history_size
+        self.history_ttl = history_ttl
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._history: Dict[str, Deque] = defaultdict(deque)
+        # Sort key of the newest event dropped from each topic's history
+        self._dropped: Dict[str, tuple] = {}
+        self._seq = itertools.count()
+        # Keys delivered within the history TTL, oldest first
+        self._keys: Deque = deque()  # (monotonic time, key)
+        self._key_set: Set[str] = set()
+        self._delivered = 0
+        # Events at or before the horizon may be missing for topics with no
+        # history of their own (process start, swept topics)
+        self._horizon = parse_event_id(self.next_id())
+
+    async def start(self):
+        await self.backend.start(self)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    def next_id(self) -> str:
+        return f"{int(time.time() * 1000)}-{next(self._seq)}"
+
+    def subscribe(self, topic: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[topic].add(queue)
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(topic)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[topic]
+
+    def subscriber_count(self) -> int:
+        return sum(len(s) for s in self._subscribers.values())
+
+    async def publish(self, topic: str, event: str, data: dict, key: Optional[str] = None) -> StreamEvent:
+        """Deliver locally and broadcast. With a `key`, repeats within the history
+        TTL are dropped on every worker, and a failed broadcast raises so the
+        caller can publish again."""
+        stream_event = StreamEvent(self.next_id(), topic, event, data, key)
+        self.deliver(stream_event)
+        try:
+            await self.backend.publish(stream_event)
+        except PyMongoError:
+            if key is not None:
+                raise
+            # Local subscribers already have it; other workers resync on reconnect
+            logger.exception("Failed to broadcast stream event")
+        return stream_event
+
+    def deliver(self, event: StreamEvent):
+        now = time.monotonic()
+        while self._keys and now - self._keys[0][0] > self.history_ttl:
+            self._key_set.discard(self._keys.popleft()[1])
+        if event.key is not None:
+            if event.key in self._key_set:
+                return
+            self._keys.append((now, event.key))
+            self._key_set.add(event.key)
+
+        history = self._history[event.topic]
+        history.append((now, event))
+        while history and (len(history) > self.history_size or now - history[0][0] > self.history_ttl):
+            _, dropped = history.popleft()
+            self._dropped[event.topic] = dropped.sort_key
+
+        self._delivered += 1
+        if self._delivered % 1000 == 0:
+            self._sweep(now)
+
+        for queue in list(self._subscribers.get(event.topic, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: close its stream, the client reconnects and resyncs
+                self.unsubscribe(event.topic, queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def _sweep(self, now: float):
+        # Forget topics whose whole history has expired
+        for topic in list(self._history):
+            history = self._history[topic]
+            while history and now - history[0][0] > self.history_ttl:
+                _, dropped = history.popleft()
+                self._dropped[topic] = dropped.sort_key
+            if not history:
+                del self._history[topic]
+                self._horizon = max(self._horizon, self._dropped.pop(topic, self._horizon))
+
+    def replay(self, topic: str, last_event_id: str) -> Optional[List[StreamEvent]]:
+        """Events after last_event_id, or None when the gap can't be covered."""
+        last_key = parse_event_id(last_event_id)
+        if last_key is None:
+            return None
+        dropped = self._dropped.get(topic, self._horizon)
+        if dropped > last_key:
+            # Some events after the client's last one are no longer buffered
+            return None
+        return [e for _, e in self._history.get(topic, ()) if e.sort_key > last_key]
+
+
+async def sse_stream(broker: EventBroker, topic: str, request, last_event_id: Optional[str] = None,
+                     heartbeat: float = 15.0) -> AsyncIterator[str]:
+    queue = broker.subscribe(topic)
+    try:
+        yield "retry: 3000\n\n"
+        last_key = None
+        if last_event_id:
+            missed = broker.replay(topic, last_event_id)
+            if missed is None:
+                # Client must re-fetch its state once
+                yield StreamEvent(broker.next_id(), topic, "resync").encode()
+            else:
+                for event in missed:
+                    last_key = event.sort_key
+                    yield event.encode()
+
+        while True:
+            if await request.is_disconnected():
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                break
+            if last_key is not None and event.sort_key <= last_key:
+                continue
+            yield event.encode()
+    finally:
+        broker.unsubscribe(topic, queue)
@@ -0,0 +1,348 @@
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# Append-only order event log with incrementally maintained read models.
+# Every order state change is appended to `order_events` with a global,
+# gap-free sequence number. A single projector (whichever worker holds the
+# lease) applies new events in sequence order to the read models:
+#   - user_order_lists: per-user order summaries
+#   - order_status_counts: number of orders in each status
+#   - order_revenue_daily: paid revenue and paid orders per UTC day
+# Consumers can tail the log from any offset, so reporting never has to scan
+# the orders collection.
+#
+# An order is created, paid, cancelled and moved to each status at most once
+# (transitions only go forward), so every event has a natural id,
+# "<order id>:<type>[:<status>]". Appends are unique on it: a redelivered
+# outbox event, a re-run backfill and a backfill racing live appends all log
+# each event once.
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = "created"
+ORDER_PAID = "paid"
+ORDER_STATUS_CHANGED = "status_changed"
+ORDER_CANCELLED = "cancelled"
+# Fills the sequence number of an append that lost a race on event_id
+ORDER_DUPLICATE = "duplicate"
+
+ORDER_STATUSES = ("pending", "processing", "shipped", "delivered", "cancelled")
+
+# Allowed status transitions; delivered and cancelled are final
+ORDER_TRANSITIONS: Dict[str, set] = {
+    "pending": {"processing", "cancelled"},
+    "processing": {"shipped", "cancelled"},
+    "shipped": {"delivered"},
+    "delivered": set(),
+    "cancelled": set(),
+}
+
+PROJECTOR_ID = "order_projections"
+BACKFILL_ID = "order_events_backfill"
+
+
+def event_key(order_id: str, event_type: str, to_status: Optional[str] = None) -> str:
+    if event_type == ORDER_STATUS_CHANGED:
+        return f"{order_id}:{event_type}:{to_status}"
+    return f"{order_id}:{event_type}"
+
+
+def validate_transition(current: str, target: str):
+    if target not in ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown order status: {target}")
+    if target not in ORDER_TRANSITIONS.get(current, set()):
+        raise HTTPException(status_code=400, detail=f"Cannot change order status from {current} to {target}")
+
+
+def _parse_ts(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _day(ts) -> str:
+    # MongoDB hands datetimes back naive (in UTC); astimezone would read those as local time
+    return _parse_ts(ts).astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+
+class OrderEventLog:
+    def __init__(self, db, batch_size: int = 500, lease_seconds: float = 10.0, poll_interval: float = 1.0,
+                 gap_timeout: float = 30.0):
+        self.db = db
+        self.gap_timeout = gap_timeout
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+        self._projecting = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        await self.db.order_events.create_index("seq", unique=True)
+        await self.db.order_events.create_index([("order_id", 1), ("seq", 1)])
+        try:
+            await self.db.order_events.create_index("event_id", unique=True, sparse=True)
+        except OperationFailure:
+            # Built without unique before
+            await self.db.order_events.drop_index("event_id_1")
+            await self.db.order_events.create_index("event_id", unique=True, sparse=True)
+
+    # ---- writing ----
+
+    async def _next_seq(self) -> int:
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": "order_events"},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter["seq"]
+
+    async def append(self, event_type: str, order: dict, ts: Optional[datetime] = None,
+                     event_id: Optional[str] = None, **data) -> dict:
+        """Append an event; with `event_id` only once."""
+        if event_id is not None:
+            existing = await self.db.order_events.find_one({"event_id": event_id}, {"_id": 0})
+            if existing:
+                return existing
+        event = {
+            "seq": await self._next_seq(),
+            "type": event_type,
+            "order_id": order["id"],
+            "user_id": order["user_id"],
+            "ts": ts or datetime.now(timezone.utc),
+            "appended_at": datetime.now(timezone.utc),
+            "data": data,
+        }
+        if event_id is not None:
+            event["event_id"] = event_id
+        try:
+            await self.db.order_events.insert_one(event)
+        except DuplicateKeyError:
+            if event_id is None:
+                raise
+            # Appended concurrently (the same outbox event relayed twice): keep theirs and
+            # fill our sequence number, so the projector doesn't wait on the gap
+            await self.db.order_events.insert_one({
+                "seq": event["seq"], "type": ORDER_DUPLICATE, "order_id": event["order_id"],
+                "user_id": event["user_id"], "ts": event["ts"], "appended_at": event["appended_at"],
+                "data": {"event_id": event_id},
+            })
+            return await self.db.order_events.find_one({"event_id": event_id}, {"_id": 0})
+        event.pop("_id", None)
+        # Bring the read models up to date right away when this worker projects
+        await self.project()
+        return event
+
+    async def order_created(self, order: dict, ts: Optional[datetime] = None):
+        return await self.append(
+            ORDER_CREATED, order, ts, event_key(order["id"], ORDER_CREATED),
+            status=order["status"],
+            payment_status=order["payment_status"],
+            total_amount=order["total_amount"],
+            created_at=order["created_at"],
+        )
+
+    async def order_paid(self, order: dict, new_status: str, ts: Optional[datetime] = None):
+        return await self.append(
+            ORDER_PAID, order, ts, event_key(order["id"], ORDER_PAID),
+            from_status=order["status"],
+            to_status=new_status,
+            total_amount=order["total_amount"],
+        )
+
+    async def status_changed(self, order: dict, new_status: str, ts: Optional[datetime] = None):
+        event_type = ORDER_CANCELLED if new_status == "cancelled" else ORDER_STATUS_CHANGED
+        return await self.append(
+            event_type, order, ts, event_key(order["id"], event_type, new_status),
+            from_status=order["status"],
+            to_status=new_status,
+            was_paid=order["payment_status"] == "paid",
+            total_amount=order["total_amount"],
+        )
+
+    # ---- reading ----
+
+    async def read(self, after: int = 0, limit: int = 100) -> List[dict]:
+        return await self.db.order_events.find(
+            {"seq": {"$gt": after}}, {"_id": 0}
+        ).sort("seq", 1).limit(limit).to_list(limit)
+
+    async def offset(self) -> int:
+        state = await self.db.projector_state.find_one({"_id": PROJECTOR_ID})
+        return state["offset"] if state else 0
+
+    # ---- projection ----
+
+    async def _acquire_lease(self) -> Optional[int]:
+        now = datetime.now(timezone.utc)
+        try:
+            state = await self.db.projector_state.find_one_and_update(
+                {"_id": PROJECTOR_ID, "$or": [{"owner": self.owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "lease_until": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another worker holds the lease
+            return None
+        return state.get("offset", 0)
+
+    async def project(self):
+        """Apply all events after the stored offset to the read models."""
+        async with self._projecting:
+            offset = await self._acquire_lease()
+            if offset is None:
+                return
+            while True:
+                events = await self.read(offset, self.batch_size)
+                for event in events:
+                    if event["seq"] != offset + 1:
+                        # A gap is an append still in flight; wait for it unless
+                        # the writer evidently died after taking the sequence number
+                        age = datetime.now(timezone.utc) - _parse_ts(event["appended_at"])
+                        if age < timedelta(seconds=self.gap_timeout):
+                            return
+                        logger.warning(f"Skipping missing order events {offset + 1}..{event['seq'] - 1}")
+                    await self._apply(event)
+                    offset = event["seq"]
+                    await self.db.projector_state.update_one(
+                        {"_id": PROJECTOR_ID, "owner": self.owner}, {"$set": {"offset": offset}}
+                    )
+                if len(events) < self.batch_size:
+                    return
+
+    async def _apply(self, event: dict):
+        data = event["data"]
+        order_id = event["order_id"]
+        if event["type"] == ORDER_DUPLICATE:
+            return
+        if event["type"] == ORDER_CREATED:
+            await self.db.user_order_lists.update_one(
+                {"_id": event["user_id"]},
+                {"$push": {"orders": {
+                    "order_id": order_id,
+                    "status": data["status"],
+                    "payment_status": data["payment_status"],
+                    "total_amount": data["total_amount"],
+                    "created_at": data["created_at"],
+                }}},
+                upsert=True,
+            )
+            await self.db.order_status_counts.update_one(
+                {"_id": data["status"]}, {"$inc": {"count": 1}}, upsert=True
+            )
+            return
+
+        from_status, to_status = data["from_status"], data["to_status"]
+        summary_update = {"orders.$.status": to_status}
+        if event["type"] == ORDER_PAID:
+            summary_update["orders.$.payment_status"] = "paid"
+            await self.db.order_revenue_daily.update_one(
+                {"_id": _day(event["ts"])},
+                {"$inc": {"revenue": data["total_amount"], "paid_orders": 1}},
+                upsert=True,
+            )
+        elif event["type"] == ORDER_CANCELLED and data.get("was_paid"):
+            # Refunds count against the day of cancellation
+            await self.db.order_revenue_daily.update_one(
+                {"_id": _day(event["ts"])},
+                {"$inc": {"revenue": -data["total_amount"], "refunded_orders": 1}},
+                upsert=True,
+            )
+
+        await self.db.user_order_lists.update_one(
+            {"_id": event["user_id"], "orders.order_id": order_id}, {"$set": summary_update}
+        )
+        if from_status != to_status:
+            await self.db.order_status_counts.update_one({"_id": from_status}, {"$inc": {"count": -1}}, upsert=True)
+            await self.db.order_status_counts.update_one({"_id": to_status}, {"$inc": {"count": 1}}, upsert=True)
+
+    async def status_counts(self) -> Dict[str, int]:
+        counts = {status: 0 for status in ORDER_STATUSES}
+        async for row in self.db.order_status_counts.find({}):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+    async def revenue_by_day(self, days: Optional[int] = None) -> List[dict]:
+        query = {}
+        if days:
+            query["_id"] = {"$gte": _day(datetime.now(timezone.utc) - timedelta(days=days - 1))}
+        rows = await self.db.order_revenue_daily.find(query).sort("_id", 1).to_list(None)
+        return [
+            {"day": r["_id"], "revenue": round(r.get("revenue", 0.0), 2),
+             "paid_orders": r.get("paid_orders", 0), "refunded_orders": r.get("refunded_orders", 0)}
+            for r in rows
+        ]
+
+    async def user_orders(self, user_id: str) -> List[dict]:
+        doc = await self.db.user_order_lists.find_one({"_id": user_id})
+        return list(reversed(doc["orders"])) if doc else []
+
+    # ---- bootstrap and background catch-up ----
+
+    async def backfill(self) -> bool:
+        """Seed the log from existing orders the first time it is enabled; True once done.
+
+        Runs on the worker holding the projector lease. Events get their
+        natural ids, so an interrupted backfill simply runs again (the marker
+        is written only at the end) and orders changing meanwhile are logged
+        once, whichever append comes first.
+        """
+        if await self.db.counters.find_one({"_id": BACKFILL_ID}):
+            return True
+        if await self._acquire_lease() is None:
+            return False
+        count = 0
+        async for order in self.db.orders.find({}, {"_id": 0}).sort("created_at", 1):
+            # Only the final state is known, so every event is dated at creation
+            ts = _parse_ts(order["created_at"])
+            current = dict(order, status="pending", payment_status="pending")
+            await self.order_created(current, ts)
+            if order.get("payment_status") == "paid":
+                await self.order_paid(current, "processing", ts)
+                current = dict(current, status="processing", payment_status="paid")
+            if order.get("status", "pending") != current["status"]:
+                await self.status_changed(current, order["status"], ts)
+            count += 1
+        await self.db.counters.update_one(
+            {"_id": BACKFILL_ID}, {"$set": {"at": datetime.now(timezone.utc), "orders": count}}, upsert=True
+        )
+        if count:
+            logger.info(f"Backfilled order event log from {count} existing orders")
+        return True
+
+    async def _run(self):
+        backfilled = False
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                # Taken over when the worker that started it went away
+                backfilled = backfilled or await self.backfill()
+                await self.project()
+            except Exception:
+                logger.exception("Order projection failed")
+
+    async def start(self):
+        await self.ensure_indexes()
+        try:
+            await self.backfill()
+        except Exception:
+            logger.exception("Order event log backfill failed; retrying in the background")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
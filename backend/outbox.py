@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# Transactional outbox.
+# MongoDB writes one document atomically (multi-document transactions need a
+# replica set), so the events of a state change travel inside the document
+# that changes: the update that marks an order paid also $pushes an
+# `order.paid` event onto the order's `_outbox` array. The change and its
+# events are stored together or not at all, and the request handler does
+# that one write and nothing else.
+#
+# The relay (whichever worker holds the lease, as with the order projector)
+# reads documents with pending events in batches, hands every event to the
+# subscribers of its type and then $pulls the delivered events:
+#
+#   - at least once: a crash between delivering and pulling delivers the
+#     event again, so handlers must tolerate repeats (events carry an id)
+#   - in order per aggregate (document): when a handler fails, the rest of
+#     that document's events wait, with backoff, until it succeeds; the
+#     subscribers that already succeeded are remembered in
+#     `outbox_receipts` and skipped on the retry
+#   - other aggregates carry on meanwhile, delivered concurrently
+#   - the lease is renewed before every batch, and a pass stops handing out
+#     events once half the lease has run out, so a slow pass can't overlap
+#     with a new lease holder's
+#
+# Subscribers are in-process handlers; LocalBroker stands in for a message
+# broker when events should be consumed outside the process.
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_FIELD = "_outbox"
+RELAY_ID = "outbox_relay"
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+def with_events(update: dict, *events: dict) -> dict:
+    """`update` plus $push of `events` onto the document's outbox."""
+    push = dict(update.get("$push", {}))
+    push[OUTBOX_FIELD] = {"$each": list(events)}
+    return {**update, "$push": push}
+
+
+class LocalBroker:
+    """In-memory stand-in for a message broker: a bounded log per topic."""
+
+    def __init__(self, retention: int = 10000):
+        self.retention = retention
+        self._topics: Dict[str, deque] = {}
+        self._offsets: Dict[str, int] = {}
+
+    async def publish(self, topic: str, key: str, message: dict):
+        offset = self._offsets.get(topic, 0) + 1
+        self._offsets[topic] = offset
+        log = self._topics.setdefault(topic, deque(maxlen=self.retention))
+        log.append({"offset": offset, "key": key, "message": message})
+
+    def read(self, topic: str, after: int = 0, limit: int = 100) -> List[dict]:
+        return [entry for entry in self._topics.get(topic, ()) if entry["offset"] > after][:limit]
+
+    @property
+    def stats(self) -> dict:
+        return {topic: {"offset": self._offsets[topic], "retained": len(log)} for topic, log in self._topics.items()}
+
+
+class Outbox:
+    def __init__(self, db, collections: Tuple[str, ...] = ("orders",), batch_size: int = 100,
+                 lease_seconds: float = 10.0, poll_interval: float = 1.0, retry_base: float = 1.0,
+                 max_retry_delay: float = 60.0, receipt_days: int = 7):
+        self.db = db
+        self.collections = collections
+        self.receipts = db.outbox_receipts
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.max_retry_delay = max_retry_delay
+        self.receipt_days = receipt_days
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._subscribers: Dict[str, List[Tuple[str, Handler]]] = {}
+        self._failures: Dict[Tuple[str, object], Tuple[int, float]] = {}  # aggregate -> (failures, retry at)
+        self._wakeup = asyncio.Event()
+        self._relaying = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._lease_deadline = 0.0  # monotonic; stop delivering after this
+        self.stats = {"passes": 0, "batches": 0, "delivered": 0, "handler_failures": 0, "skipped_repeats": 0,
+                      "lease_stops": 0}
+
+    async def ensure_indexes(self):
+        for collection in self.collections:
+            await self.db[collection].create_index(f"{OUTBOX_FIELD}.id", sparse=True)
+        await self.receipts.create_index("event_id")
+        await self.receipts.create_index("expires_at", expireAfterSeconds=0)
+
+    # ---- writing ----
+
+    @staticmethod
+    def event(event_type: str, **data) -> dict:
+        return {"id": uuid.uuid4().hex, "type": event_type, "at": datetime.now(timezone.utc), "data": data}
+
+    def notify(self):
+        """Deliver soon: called after writing events, so this worker's relay doesn't wait for its poll."""
+        self._wakeup.set()
+
+    # ---- subscribing ----
+
+    def subscribe(self, event_type: str, name: str, handler: Handler):
+        """Call `handler(event)` for every event of `event_type`; `name` must be unique and stable."""
+        self._subscribers.setdefault(event_type, []).append((name, handler))
+
+    def subscribe_all(self, name: str, handler: Handler):
+        self.subscribe("*", name, handler)
+
+    def _handlers(self, event_type: str) -> List[Tuple[str, Handler]]:
+        return self._subscribers.get(event_type, []) + self._subscribers.get("*", [])
+
+    # ---- relaying ----
+
+    async def _acquire_lease(self) -> bool:
+        """Take or renew the relay lease."""
+        now = datetime.now(timezone.utc)
+        renewed_at = time.monotonic()
+        try:
+            await self.db.projector_state.find_one_and_update(
+                {"_id": RELAY_ID, "$or": [{"owner": self.owner}, {"lease_until": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "lease_until": now + timedelta(seconds=self.lease_seconds)}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Another worker relays
+            return False
+        self._lease_deadline = renewed_at + self.lease_seconds / 2
+        return True
+
+    async def pending(self) -> int:
+        counts = [await self.db[c].count_documents({f"{OUTBOX_FIELD}.id": {"$exists": True}})
+                  for c in self.collections]
+        return sum(counts)
+
+    async def relay(self) -> int:
+        """Deliver pending events; returns how many were delivered."""
+        async with self._relaying:
+            if not await self._acquire_lease():
+                return 0
+            self.stats["passes"] += 1
+            delivered = 0
+            renew = False
+            for collection in self.collections:
+                while True:
+                    if renew and not await self._acquire_lease():
+                        return delivered
+                    renew = True
+                    now = time.monotonic()
+                    waiting = [key[1] for key, (_, retry_at) in self._failures.items()
+                               if key[0] == collection and retry_at > now]
+                    query = {f"{OUTBOX_FIELD}.id": {"$exists": True}}
+                    if waiting:
+                        query["_id"] = {"$nin": waiting}
+                    docs = await self.db[collection].find(
+                        query, {"_id": 1, "id": 1, OUTBOX_FIELD: 1}
+                    ).limit(self.batch_size).to_list(self.batch_size)
+                    if not docs:
+                        break
+                    self.stats["batches"] += 1
+                    done = await self._receipts([event["id"] for doc in docs for event in doc[OUTBOX_FIELD]])
+                    counts = await asyncio.gather(*[self._deliver(collection, doc, done) for doc in docs])
+                    delivered += sum(counts)
+                    if time.monotonic() > self._lease_deadline:
+                        # Ran long; whatever is left waits for the next pass
+                        self.stats["lease_stops"] += 1
+                        return delivered
+                    if len(docs) < self.batch_size:
+                        break
+            return delivered
+
+    async def _receipts(self, event_ids: List[str]) -> Dict[str, set]:
+        done: Dict[str, set] = {}
+        async for receipt in self.receipts.find({"event_id": {"$in": event_ids}}):
+            done.setdefault(receipt["event_id"], set()).add(receipt["subscriber"])
+        return done
+
+    async def _deliver(self, collection: str, doc: dict, done: Dict[str, set]) -> int:
+        key = (collection, doc["_id"])
+        delivered = []
+        for stored in doc[OUTBOX_FIELD]:
+            if time.monotonic() > self._lease_deadline:
+                break
+            event = {**stored, "aggregate": collection, "aggregate_id": doc.get("id", doc["_id"])}
+            succeeded = []
+            for name, handler in self._handlers(event["type"]):
+                if name in done.get(event["id"], ()):
+                    self.stats["skipped_repeats"] += 1
+                    continue
+                try:
+                    await handler(event)
+                except Exception:
+                    self.stats["handler_failures"] += 1
+                    failures = self._failures.get(key, (0, 0))[0] + 1
+                    delay = min(self.retry_base * 2 ** (failures - 1), self.max_retry_delay)
+                    self._failures[key] = (failures, time.monotonic() + delay)
+                    logger.exception(f"Outbox subscriber {name} failed on {event['type']} {event['id']}, "
+                                     f"retrying in {delay:.0f}s")
+                    await self._remember(event["id"], succeeded)
+                    await self._acknowledge(collection, doc["_id"], delivered, done)
+                    return len(delivered)
+                succeeded.append(name)
+            delivered.append(event["id"])
+        self._failures.pop(key, None)
+        await self._acknowledge(collection, doc["_id"], delivered, done)
+        return len(delivered)
+
+    async def _remember(self, event_id: str, subscribers: List[str]):
+        if not subscribers:
+            return
+        expires_at = datetime.now(timezone.utc) + timedelta(days=self.receipt_days)
+        try:
+            await self.receipts.insert_many(
+                [{"_id": f"{event_id}:{name}", "event_id": event_id, "subscriber": name, "expires_at": expires_at}
+                 for name in subscribers],
+                ordered=False,
+            )
+        except (BulkWriteError, DuplicateKeyError):
+            pass  # some were remembered on an earlier attempt
+
+    async def _acknowledge(self, collection: str, doc_id, event_ids: List[str], done: Dict[str, set]):
+        if not event_ids:
+            return
+        self.stats["delivered"] += len(event_ids)
+        await self.db[collection].update_one(
+            {"_id": doc_id}, {"$pull": {OUTBOX_FIELD: {"id": {"$in": event_ids}}}}
+        )
+        # Drop the empty array, unless a new event was pushed in the meantime
+        await self.db[collection].update_one(
+            {"_id": doc_id, OUTBOX_FIELD: {"$size": 0}}, {"$unset": {OUTBOX_FIELD: ""}}
+        )
+        if any(event_id in done for event_id in event_ids):
+            await self.receipts.delete_many({"event_id": {"$in": event_ids}})
+
+    # ---- background relay ----
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.relay()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Outbox relay failed")
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=self.poll_interval)
+            finally:
+                waiter.cancel()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
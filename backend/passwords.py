@@ -0,0 +1,14 @@
+from passlib.context import CryptContext
+
+# Password hashing. passlib/bcrypt are loaded on first use by server.py
+# rather than at startup.
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
@@ -0,0 +1,172 @@
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+import server
+from memory_db import MemoryClient
+from settings import Settings
+
+# Offline throughput benchmark of the payment pipeline.
+# Builds the API on the in-memory database with the in-process gateway
+# simulator, starts `--payments` payments through POST /orders/{id}/payments
+# (`--concurrency` at a time) and waits for every webhook to settle them. No
+# MongoDB, network or gateway account needed; the numbers measure the
+# pipeline itself (queueing, gateway round trips, webhook handling), so
+# compare runs on the same machine.
+#
+#   python payment_bench.py                                  # defaults
+#   python payment_bench.py --payments 2000 --workers 32 --latency 0.05
+#   python payment_bench.py --failure-rate 0.2 --json bench.json
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def seed(db, payments: int) -> str:
+    user_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    await db.users.insert_one({"id": user_id, "name": "Bench", "email": "bench@example.com",
+                               "password": "", "is_admin": False, "created_at": now})
+    await db.products.insert_one({"id": "bench-product", "name": "Bench Product", "description": "", "price": 10.0,
+                                  "category": "Bench", "image_url": "", "stock": payments * 10, "created_at": now})
+    await db.orders.insert_many([{
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "items": [{"product_id": "bench-product", "product_name": "Bench Product", "quantity": 1, "price": 10.0}],
+        "total_amount": 10.0,
+        "status": "pending",
+        "payment_status": "pending",
+        "created_at": now,
+    } for _ in range(payments)])
+    return user_id
+
+
+async def run(args) -> dict:
+    settings = Settings(
+        prewarm_imports=False,
+        payment_workers=args.workers,
+        payment_max_attempts=args.max_attempts,
+        payment_sim_latency=args.latency,
+        payment_sim_settle_delay=args.settle_delay,
+        payment_sim_failure_rate=args.failure_rate,
+        payment_sim_decline_rate=args.decline_rate,
+    )
+    db = MemoryClient()["payment_bench"]
+    app = server.create_app(settings, db)
+    processor = server.payment_processor
+    processor.retry_base = args.retry_base
+    await processor.ensure_indexes()
+    await processor.start()
+    await server.outbox.start()
+
+    user_id = await seed(db, args.payments)
+    order_ids = [order["id"] for order in await db.orders.find({}, {"_id": 0, "id": 1}).to_list(None)]
+    headers = {"Authorization": f"Bearer {server.create_access_token({'sub': user_id})}"}
+
+    checkout_seconds = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def checkout(client, order_id):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(f"/api/orders/{order_id}/payments", headers=headers)
+            checkout_seconds.append(time.perf_counter() - start)
+            if response.status_code != 202:
+                raise SystemExit(f"Starting a payment failed: {response.status_code} {response.text}")
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await asyncio.gather(*[checkout(client, order_id) for order_id in order_ids])
+    accepted = time.perf_counter() - started
+
+    timed_out = False
+    while await db.payment_transactions.count_documents(
+            {"payment_status": {"$in": ["paid", "failed"]}}) < args.payments:
+        if time.perf_counter() - started > args.timeout:
+            timed_out = True
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    transactions = await db.payment_transactions.find({}, {"_id": 0}).to_list(None)
+    confirm_seconds = [
+        (datetime.fromisoformat(t["updated_at"]) - datetime.fromisoformat(t["created_at"])).total_seconds()
+        for t in transactions if t["payment_status"] in ("paid", "failed")
+    ]
+    await processor.stop()
+    await server.outbox.stop()
+    if server.payment_simulator is not None:
+        await server.payment_simulator.stop()
+
+    settled = len(confirm_seconds)
+    return {
+        "payments": args.payments,
+        "settled": settled,
+        "timed_out": timed_out,
+        "paid": sum(1 for t in transactions if t["payment_status"] == "paid"),
+        "failed": sum(1 for t in transactions if t["payment_status"] == "failed"),
+        "accepted_seconds": accepted,
+        "elapsed_seconds": elapsed,
+        "throughput_per_second": settled / elapsed if elapsed else 0.0,
+        "checkout_ms": {"p50": percentile(checkout_seconds, 0.5) * 1000,
+                        "p95": percentile(checkout_seconds, 0.95) * 1000,
+                        "max": max(checkout_seconds, default=0) * 1000},
+        "confirm_ms": {"p50": percentile(confirm_seconds, 0.5) * 1000,
+                       "p95": percentile(confirm_seconds, 0.95) * 1000,
+                       "mean": (statistics.mean(confirm_seconds) if confirm_seconds else 0) * 1000},
+        "processor": dict(processor.stats),
+        "simulator": dict(server.payment_simulator.stats),
+    }
+
+
+def print_report(report: dict):
+    print(f"{report['settled']}/{report['payments']} payments settled in {report['elapsed_seconds']:.2f} s "
+          f"({report['throughput_per_second']:.0f}/s), {report['paid']} paid, {report['failed']} failed"
+          f"{', TIMED OUT' if report['timed_out'] else ''}")
+    print(f"All checkouts answered after {report['accepted_seconds']:.2f} s")
+    checkout, confirm = report['checkout_ms'], report['confirm_ms']
+    print(f"\nCheckout latency:      p50 {checkout['p50']:7.1f} ms  p95 {checkout['p95']:7.1f} ms  "
+          f"max {checkout['max']:7.1f} ms")
+    print(f"Time to confirmation:  p50 {confirm['p50']:7.1f} ms  p95 {confirm['p95']:7.1f} ms  "
+          f"mean {confirm['mean']:7.1f} ms")
+    print(f"\nProcessor: {report['processor']}")
+    print(f"Simulator: {report['simulator']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline payment pipeline benchmark')
+    parser.add_argument('--payments', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50, help='checkout requests in flight')
+    parser.add_argument('--workers', type=int, default=8, help='payment workers (PAYMENT_WORKERS)')
+    parser.add_argument('--max-attempts', type=int, default=5)
+    parser.add_argument('--retry-base', type=float, default=0.05, help='first retry delay in seconds')
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated gateway response time')
+    parser.add_argument('--settle-delay', type=float, default=0.1, help='simulated time until the webhook')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--decline-rate', type=float, default=0.0)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--json', type=Path, help='also write the report to this file')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2, sort_keys=True))
+    if report['timed_out']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional, Protocol
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from lazy_imports import lazy_import
+
+# Asynchronous payments.
+# Starting a payment only records a PaymentTransaction and returns; a pool of
+# background workers sends the charge to the gateway, and the outcome comes
+# back later on the signed webhook, which is what marks the order paid.
+#
+#   payment_transactions: {_id: "<order_id>:<n>", id, order_id, user_id,
+#       amount, currency, payment_status: pending|submitting|submitted|paid|failed,
+#       session_id (the gateway's charge id), attempts, next_attempt_at,
+#       lease_until, error, metadata, created_at, updated_at}
+#
+# _id numbers the attempts to pay an order (n = failed transactions so far),
+# so concurrent checkouts of the same order share one transaction.
+#
+# Submission: workers take transaction ids from an in-memory queue; retries
+# are queued again after an exponential backoff, and a periodic sweep
+# re-queues whatever is due but was lost (a restart, a full queue, a worker
+# that died mid-call). A worker claims a
+# transaction with a CAS that sets `lease_until`; the charge carries the
+# transaction id as Idempotency-Key, so resubmitting after a timeout never
+# charges twice. Charges confirmed by no webhook within `confirm_timeout`
+# are looked up at the gateway.
+#
+# Confirmation: the gateway POSTs {id, reference, status} signed with
+# HMAC-SHA256 over "<timestamp>.<body>" in `X-Gateway-Signature:
+# t=<timestamp>,v1=<hex>`. The outcome is applied once (CAS on
+# payment_status); if applying fails the webhook answers 5xx and the gateway
+# delivers it again, so on_paid must be idempotent.
+
+logger = logging.getLogger(__name__)
+
+httpx = lazy_import("httpx")
+
+SIGNATURE_HEADER = "X-Gateway-Signature"
+OPEN_STATUSES = ("pending", "submitting", "submitted")
+SETTLED_STATUSES = {"succeeded": "paid", "failed": "failed"}
+
+PaymentHandler = Callable[[dict], Awaitable[None]]
+
+
+class GatewayError(Exception):
+    """The charge didn't go through this time (network error, 5xx, 429); retry it."""
+
+
+class PaymentDeclined(Exception):
+    """The gateway refused the charge for good."""
+
+
+class WebhookError(ValueError):
+    pass
+
+
+def sign_payload(secret: str, body: bytes, timestamp: Optional[int] = None) -> str:
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret: str, body: bytes, header: Optional[str], tolerance: float = 300) -> None:
+    try:
+        parts = dict(part.split("=", 1) for part in (header or "").split(","))
+        timestamp = int(parts["t"])
+        signature = parts["v1"]
+    except (KeyError, ValueError):
+        raise WebhookError("Malformed signature header")
+    if abs(time.time() - timestamp) > tolerance:
+        raise WebhookError("Signature timestamp outside the tolerance")
+    expected = sign_payload(secret, body, timestamp).split("v1=", 1)[1]
+    if not hmac.compare_digest(expected, signature):
+        raise WebhookError("Signature mismatch")
+
+
+class PaymentGateway(Protocol):
+    async def start(self) -> None: ...
+
+    async def stop(self) -> None: ...
+
+    async def create_charge(self, reference: str, amount: int, currency: str,
+                            callback_url: str, metadata: dict) -> dict: ...
+
+    async def get_charge(self, charge_id: str) -> dict: ...
+
+
+class GatewayClient:
+    """HTTP client of the gateway API, one pooled connection set per worker.
+
+    `app` replaces the network with an ASGI app called in-process, e.g. the
+    local gateway simulator's.
+    """
+
+    def __init__(self, base_url: str, api_key: str, timeout: float = 10.0,
+                 max_connections: int = 100, app=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.app = app
+        self._client = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                transport=httpx.ASGITransport(app=self.app) if self.app is not None else None,
+            )
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, method: str, path: str, **kwargs) -> dict:
+        await self.start()
+        try:
+            response = await self._client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            raise GatewayError(f"{type(e).__name__}: {e}")
+        if response.status_code == 429 or response.status_code >= 500:
+            raise GatewayError(f"Gateway answered {response.status_code}")
+        if response.status_code >= 400:
+            raise PaymentDeclined(response.json().get("error", f"Gateway answered {response.status_code}"))
+        return response.json()
+
+    async def create_charge(self, reference: str, amount: int, currency: str,
+                            callback_url: str, metadata: dict) -> dict:
+        return await self._request("POST", "/v1/charges", headers={"Idempotency-Key": reference}, json={
+            "reference": reference, "amount": amount, "currency": currency,
+            "callback_url": callback_url, "metadata": metadata,
+        })
+
+    async def get_charge(self, charge_id: str) -> dict:
+        return await self._request("GET", f"/v1/charges/{charge_id}")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class PaymentProcessor:
+    def __init__(self, db, gateway: PaymentGateway, webhook_secret: str, callback_url: str,
+                 on_paid: PaymentHandler, on_failed: PaymentHandler, workers: int = 8,
+                 max_attempts: int = 5, retry_base: float = 1.0, lease_seconds: float = 60,
+                 confirm_timeout: float = 600, sweep_interval: float = 5.0, signature_tolerance: float = 300):
+        self.transactions = db.payment_transactions
+        self.gateway = gateway
+        self.webhook_secret = webhook_secret
+        self.callback_url = callback_url
+        self.on_paid = on_paid
+        self.on_failed = on_failed
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease_seconds = lease_seconds
+        self.confirm_timeout = confirm_timeout
+        self.sweep_interval = sweep_interval
+        self.signature_tolerance = signature_tolerance
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 100)
+        self._tasks = []
+        self.stats = {"created": 0, "submitted": 0, "retried": 0, "paid": 0, "failed": 0,
+                      "webhooks": 0, "duplicate_webhooks": 0, "rejected_webhooks": 0, "reconciled": 0}
+
+    async def ensure_indexes(self):
+        await self.transactions.create_index("id", unique=True)
+        await self.transactions.create_index("order_id")
+        await self.transactions.create_index([("payment_status", 1), ("next_attempt_at", 1)])
+        await self.transactions.create_index([("payment_status", 1), ("lease_until", 1)])
+
+    # ---- starting payments ----
+
+    async def create(self, order: dict, metadata: Optional[dict] = None) -> dict:
+        """The open (or paid) transaction of the order, creating and queueing one if there is none."""
+        existing = await self.transactions.find_one(
+            {"order_id": order["id"], "payment_status": {"$in": [*OPEN_STATUSES, "paid"]}}, {"_id": 0}
+        )
+        if existing:
+            return existing
+        failed = await self.transactions.count_documents({"order_id": order["id"], "payment_status": "failed"})
+        now = _now()
+        txn = {
+            "_id": f"{order['id']}:{failed}",
+            "id": str(uuid.uuid4()),
+            "session_id": "",
+            "order_id": order["id"],
+            "user_id": order["user_id"],
+            "amount": order["total_amount"],
+            "currency": "usd",
+            "payment_status": "pending",
+            "attempts": 0,
+            "next_attempt_at": time.time(),
+            "lease_until": 0,
+            "error": None,
+            "metadata": metadata or {},
+            "created_at": now,
+            "updated_at": now,
+        }
+        try:
+            await self.transactions.insert_one(txn)
+        except DuplicateKeyError:
+            # Started concurrently; both callers get that one
+            return await self.transactions.find_one({"_id": txn["_id"]}, {"_id": 0})
+        txn.pop("_id")
+        self.stats["created"] += 1
+        self._enqueue(txn["id"])
+        return txn
+
+    async def get(self, transaction_id: str) -> Optional[dict]:
+        return await self.transactions.find_one({"id": transaction_id}, {"_id": 0})
+
+    def _enqueue(self, transaction_id: str):
+        try:
+            self._queue.put_nowait(transaction_id)
+        except asyncio.QueueFull:
+            pass  # the sweep picks it up
+
+    # ---- submitting to the gateway ----
+
+    async def submit(self, transaction_id: str) -> Optional[dict]:
+        """Send one due transaction to the gateway; None if it isn't due or another worker has it."""
+        now = time.time()
+        txn = await self.transactions.find_one_and_update(
+            {"id": transaction_id, "payment_status": "pending", "next_attempt_at": {"$lte": now}},
+            {"$set": {"payment_status": "submitting", "lease_until": now + self.lease_seconds,
+                      "updated_at": _now()},
+             "$inc": {"attempts": 1}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+        if txn is None:
+            return None
+        try:
+            charge = await self.gateway.create_charge(
+                txn["id"], round(txn["amount"] * 100), txn["currency"], self.callback_url,
+                {"order_id": txn["order_id"], **txn.get("metadata", {})},
+            )
+        except PaymentDeclined as e:
+            return await self._settle(txn, "failed", error=str(e))
+        except GatewayError as e:
+            if txn["attempts"] >= self.max_attempts:
+                return await self._settle(txn, "failed", error=str(e))
+            delay = self.retry_base * 2 ** (txn["attempts"] - 1) * random.uniform(0.8, 1.2)
+            self.stats["retried"] += 1
+            logger.warning(f"Payment {txn['id']} attempt {txn['attempts']} failed ({e}), retrying in {delay:.1f}s")
+            await self.transactions.update_one(
+                {"id": txn["id"], "payment_status": "submitting"},
+                {"$set": {"payment_status": "pending", "next_attempt_at": time.time() + delay,
+                          "error": str(e), "updated_at": _now()}},
+            )
+            asyncio.get_running_loop().call_later(delay, self._enqueue, txn["id"])
+            return None
+
+        self.stats["submitted"] += 1
+        # A fast webhook may already have settled it
+        return await self.transactions.find_one_and_update(
+            {"id": txn["id"], "payment_status": "submitting"},
+            {"$set": {"payment_status": "submitted", "session_id": charge["id"],
+                      "lease_until": time.time() + self.confirm_timeout, "error": None, "updated_at": _now()}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+
+    # ---- confirmations ----
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        """Apply a gateway notification; raises WebhookError if it isn't authentic."""
+        try:
+            verify_signature(self.webhook_secret, body, signature, self.signature_tolerance)
+            event = json.loads(body)
+            reference, status = event["reference"], event["status"]
+        except (WebhookError, ValueError, KeyError, TypeError) as e:
+            self.stats["rejected_webhooks"] += 1
+            raise WebhookError(str(e) or "Malformed webhook body")
+        self.stats["webhooks"] += 1
+        if status not in SETTLED_STATUSES:
+            return
+        txn = await self.transactions.find_one({"id": reference}, {"_id": 0})
+        if txn is None:
+            logger.warning(f"Webhook for unknown payment {reference}")
+            return
+        await self._settle(txn, status, charge_id=event.get("id"), error=event.get("error"))
+
+    async def _settle(self, txn: dict, outcome: str, charge_id: Optional[str] = None,
+                      error: Optional[str] = None) -> Optional[dict]:
+        status = SETTLED_STATUSES.get(outcome, outcome)
+        if txn["payment_status"] in ("paid", "failed"):
+            self.stats["duplicate_webhooks"] += 1
+            return txn
+        if status == "paid":
+            # Before the CAS: if this fails the transaction stays open and the webhook is retried
+            await self.on_paid(txn)
+        update = {"payment_status": status, "error": error, "updated_at": _now()}
+        if charge_id:
+            update["session_id"] = charge_id
+        settled = await self.transactions.find_one_and_update(
+            {"id": txn["id"], "payment_status": {"$in": list(OPEN_STATUSES)}},
+            {"$set": update},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER,
+        )
+        if settled is None:
+            self.stats["duplicate_webhooks"] += 1
+            return await self.get(txn["id"])
+        self.stats[status] += 1
+        if status == "failed":
+            await self.on_failed(settled)
+        return settled
+
+    async def reconcile(self, txn: dict):
+        """Ask the gateway about a charge whose webhook never came."""
+        try:
+            charge = await self.gateway.get_charge(txn["session_id"])
+        except (GatewayError, PaymentDeclined) as e:
+            logger.warning(f"Could not look up payment {txn['id']}: {e}")
+            return
+        if charge.get("status") in SETTLED_STATUSES:
+            self.stats["reconciled"] += 1
+            await self._settle(txn, charge["status"], charge_id=charge.get("id"), error=charge.get("error"))
+        else:
+            await self.transactions.update_one(
+                {"id": txn["id"], "payment_status": "submitted"},
+                {"$set": {"lease_until": time.time() + self.confirm_timeout}},
+            )
+
+    # ---- background work ----
+
+    async def sweep(self):
+        now = time.time()
+        # Workers that died mid-call; the gateway dedupes the resubmission
+        await self.transactions.update_many(
+            {"payment_status": "submitting", "lease_until": {"$lt": now}},
+            {"$set": {"payment_status": "pending", "next_attempt_at": now}},
+        )
+        due = await self.transactions.find(
+            {"payment_status": "pending", "next_attempt_at": {"$lte": now}}, {"_id": 0, "id": 1}
+        ).limit(self._queue.maxsize).to_list(None)
+        for txn in due:
+            self._enqueue(txn["id"])
+        unconfirmed = await self.transactions.find(
+            {"payment_status": "submitted", "lease_until": {"$lt": now}}, {"_id": 0}
+        ).limit(100).to_list(None)
+        for txn in unconfirmed:
+            await self.reconcile(txn)
+
+    async def start(self):
+        await self.gateway.start()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._run_sweeps()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self.gateway.stop()
+
+    async def _work(self):
+        while True:
+            transaction_id = await self._queue.get()
+            try:
+                await self.submit(transaction_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Left in `submitting`; the sweep retries it once the lease is up
+                logger.exception(f"Submitting payment {transaction_id} failed")
+
+    async def _run_sweeps(self):
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Payment sweep failed")
+            await asyncio.sleep(self.sweep_interval)
@@ -0,0 +1,195 @@
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from pymongo.errors import DuplicateKeyError
+
+# Token-bucket rate limiting for expensive routes (login/register hash with
+# bcrypt). Every route has a list of limits; each limit is a bucket keyed by
+# client IP, submitted email or a single global key. A request must take one
+# token from every bucket before the handler does any real work.
+
+
+@dataclass(frozen=True)
+class Limit:
+    scope: str  # "ip", "email" or "global"
+    capacity: int
+    period: float  # seconds to refill an empty bucket
+
+    @property
+    def refill_rate(self) -> float:
+        return self.capacity / self.period
+
+
+DEFAULT_POLICIES: Dict[str, List[Limit]] = {
+    "auth.login": [
+        Limit("email", 5, 300),
+        Limit("ip", 20, 60),
+        Limit("global", 100, 1),
+    ],
+    "auth.register": [
+        Limit("ip", 5, 3600),
+        Limit("global", 20, 1),
+    ],
+}
+
+
+def parse_policies(spec: str) -> Dict[str, List[Limit]]:
+    """Parse "route=scope:capacity/period,...;route=..." into route policies.
+
+    Example: "auth.login=email:5/300,ip:20/60;auth.register=ip:5/3600"
+    """
+    policies: Dict[str, List[Limit]] = {}
+    for entry in filter(None, (e.strip() for e in spec.split(";"))):
+        route, _, limits = entry.partition("=")
+        parsed = []
+        for item in filter(None, (i.strip() for i in limits.split(","))):
+            scope, _, rate = item.partition(":")
+            capacity, _, period = rate.partition("/")
+            if scope not in ("ip", "email", "global"):
+                raise ValueError(f"Unknown rate limit scope: {scope}")
+            parsed.append(Limit(scope, int(capacity), float(period)))
+        policies[route.strip()] = parsed
+    return policies
+
+
+class RateLimitExceeded(HTTPException):
+    def __init__(self, retry_after: float):
+        seconds = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=429,
+            detail="Too many attempts. Please try again later.",
+            headers={"Retry-After": str(seconds)},
+        )
+
+
+class InMemoryRateLimitBackend:
+    """Per-process buckets; enough for a single worker."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def consume(self, key: str, limit: Limit, now: float) -> Tuple[bool, float]:
+        tokens, updated_at = self._buckets.get(key, (float(limit.capacity), now))
+        tokens = min(limit.capacity, tokens + (now - updated_at) * limit.refill_rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / limit.refill_rate
+
+    async def refund(self, key: str, limit: Limit):
+        if key in self._buckets:
+            tokens, updated_at = self._buckets[key]
+            self._buckets[key] = (min(limit.capacity, tokens + 1), updated_at)
+
+    async def ensure_indexes(self):
+        pass
+
+
+class MongoRateLimitBackend:
+    """Buckets shared by every worker through a MongoDB collection.
+
+    Updates use compare-and-swap on the previous state, so concurrent workers
+    never hand out the same token twice.
+    """
+
+    def __init__(self, collection, max_retries: int = 5):
+        self.collection = collection
+        self.max_retries = max_retries
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def _expires_at(self, limit: Limit) -> datetime:
+        # A bucket idle for a full period is back at capacity; drop the document
+        return datetime.now(timezone.utc) + timedelta(seconds=limit.period)
+
+    async def consume(self, key: str, limit: Limit, now: float) -> Tuple[bool, float]:
+        for _ in range(self.max_retries):
+            bucket = await self.collection.find_one({"_id": key})
+            if bucket is None:
+                try:
+                    await self.collection.insert_one({
+                        "_id": key,
+                        "tokens": limit.capacity - 1.0,
+                        "updated_at": now,
+                        "expires_at": self._expires_at(limit),
+                    })
+                    return True, 0.0
+                except DuplicateKeyError:
+                    continue
+
+            elapsed = max(0.0, now - bucket["updated_at"])
+            tokens = min(limit.capacity, bucket["tokens"] + elapsed * limit.refill_rate)
+            if tokens < 1:
+                return False, (1 - tokens) / limit.refill_rate
+
+            result = await self.collection.update_one(
+                {"_id": key, "tokens": bucket["tokens"], "updated_at": bucket["updated_at"]},
+                {"$set": {
+                    "tokens": tokens - 1,
+                    "updated_at": max(now, bucket["updated_at"]),
+                    "expires_at": self._expires_at(limit),
+                }},
+            )
+            if result.modified_count:
+                return True, 0.0
+
+        # Heavily contended bucket: treat as exhausted rather than spin
+        return False, 1 / limit.refill_rate
+
+    async def refund(self, key: str, limit: Limit):
+        await self.collection.update_one(
+            {"_id": key, "tokens": {"$lte": limit.capacity - 1}}, {"$inc": {"tokens": 1}}
+        )
+
+
+class RateLimiter:
+    def __init__(self, backend, policies: Optional[Dict[str, List[Limit]]] = None, trust_forwarded: bool = False):
+        self.backend = backend
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.trust_forwarded = trust_forwarded
+
+    def client_ip(self, request: Request) -> str:
+        if self.trust_forwarded:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                return forwarded.split(",")[0].strip()
+        return request.client.host if request.client else "unknown"
+
+    async def check(self, route: str, request: Request, email: Optional[str] = None):
+        """Take one token from each bucket of the route, or raise 429.
+
+        Email buckets go last and a refusal refunds the tokens already taken,
+        so requests refused by their IP (or the global) limit can't drain the
+        bucket of someone else's account and lock it out.
+        """
+        now = time.time()
+        taken = []
+        for limit in sorted(self.policies.get(route, []), key=lambda l: l.scope == "email"):
+            if limit.scope == "ip":
+                subject = self.client_ip(request)
+            elif limit.scope == "email":
+                if not email:
+                    continue
+                subject = email.strip().lower()
+            else:
+                subject = "*"
+
+            key = f"{route}:{limit.scope}:{subject}"
+            allowed, retry_after = await self.backend.consume(key, limit, now)
+            if not allowed:
+                for taken_key, taken_limit in taken:
+                    await self.backend.refund(taken_key, taken_limit)
+                raise RateLimitExceeded(retry_after)
+            taken.append((key, limit))
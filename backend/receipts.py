@@ -0,0 +1,121 @@
+from datetime import datetime
+from io import BytesIO
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.enums import TA_CENTER
+
+# Receipt PDF rendering. ReportLab is slow to import and only needed here,
+# so server.py loads this module on first use.
+
+
+def build_receipt_pdf(order: dict, user: dict) -> BytesIO:
+    pdf_buffer = BytesIO()
+    doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
+    story = []
+    styles = getSampleStyleSheet()
+
+    # Custom styles
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#0ea5e9'),
+        alignment=TA_CENTER,
+        spaceAfter=30
+    )
+
+    # Company name and title
+    story.append(Paragraph("ApplianceHub", title_style))
+    story.append(Paragraph("ORDER RECEIPT", styles['Heading2']))
+    story.append(Spacer(1, 0.3*inch))
+
+    # Order info
+    order_date = datetime.fromisoformat(order['created_at']).strftime('%B %d, %Y %I:%M %p')
+    info_data = [
+        ['Order ID:', order['id'][:8].upper()],
+        ['Date:', order_date],
+        ['Customer:', user['name']],
+        ['Email:', user['email']],
+        ['Payment Status:', order['payment_status'].upper()]
+    ]
+
+    info_table = Table(info_data, colWidths=[2*inch, 4*inch])
+    info_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#64748b')),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+    ]))
+    story.append(info_table)
+    story.append(Spacer(1, 0.5*inch))
+
+    # Items table
+    items_data = [['Product', 'Qty', 'Price', 'Total']]
+    for item in order['items']:
+        item_total = item['price'] * item['quantity']
+        items_data.append([
+            item['product_name'],
+            str(item['quantity']),
+            f"₱{item['price']:.2f}",
+            f"₱{item_total:.2f}"
+        ])
+
+    items_table = Table(items_data, colWidths=[3*inch, 0.8*inch, 1.2*inch, 1.2*inch])
+    items_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0ea5e9')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 11),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('TOPPADDING', (0, 1), (-1, -1), 8),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
+    ]))
+    story.append(items_table)
+    story.append(Spacer(1, 0.3*inch))
+
+    # Totals
+    totals_data = [
+        ['Subtotal:', f"₱{order['total_amount']:.2f}"],
+        ['Shipping:', 'FREE'],
+        ['', ''],
+        ['TOTAL:', f"₱{order['total_amount']:.2f}"]
+    ]
+
+    totals_table = Table(totals_data, colWidths=[5*inch, 1.2*inch])
+    totals_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (0, 1), 'Helvetica'),
+        ('FONTNAME', (0, 3), (0, 3), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 2), 10),
+        ('FONTSIZE', (0, 3), (-1, 3), 14),
+        ('TEXTCOLOR', (0, 3), (-1, 3), colors.HexColor('#0ea5e9')),
+        ('LINEABOVE', (0, 3), (-1, 3), 2, colors.HexColor('#0ea5e9')),
+        ('TOPPADDING', (0, 3), (-1, 3), 10),
+    ]))
+    story.append(totals_table)
+    story.append(Spacer(1, 0.5*inch))
+
+    # Footer
+    footer_style = ParagraphStyle(
+        'Footer',
+        parent=styles['Normal'],
+        fontSize=9,
+        textColor=colors.HexColor('#94a3b8'),
+        alignment=TA_CENTER
+    )
+    story.append(Paragraph("Thank you for shopping with ApplianceHub!", footer_style))
+    story.append(Paragraph("For questions or support, please contact us at support@appliancehub.com", footer_style))
+
+    # Build PDF
+    doc.build(story)
+    pdf_buffer.seek(0)
+    return pdf_buffer
@@ -0,0 +1,166 @@
+import base64
+import json
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# Product reviews: keyset pagination, sort modes, helpful votes and the
+# precomputed top reviews.
+# Every sort mode ends in (created_at, id), so the sort key is unique and a
+# page cursor is simply the key of the last review returned: the next page
+# is "everything after this key", served from the matching compound index
+# however deep the reader scrolls (no skip).
+#
+# The first TOP_REVIEWS of the "helpful" order are copied onto the product
+# as `top_reviews`, so the product page renders without a review query and
+# continues with `reviews_cursor`. They're recomputed when a review is added
+# and when a vote can change them. Votes live in `review_votes`, one per
+# user and review, with the count kept on the review as `helpful_count`.
+
+logger = logging.getLogger(__name__)
+
+TOP_REVIEWS = 5
+
+SORTS = {
+    "newest": [("created_at", -1), ("id", -1)],
+    "highest": [("rating", -1), ("created_at", -1), ("id", -1)],
+    "lowest": [("rating", 1), ("created_at", -1), ("id", -1)],
+    "helpful": [("helpful_count", -1), ("created_at", -1), ("id", -1)],
+}
+
+REVIEW_PROJECTION = {"_id": 0}
+
+
+class ReviewCursorError(ValueError):
+    pass
+
+
+def encode_cursor(sort: str, review: dict) -> str:
+    key = [review.get(field, 0 if field == "helpful_count" else None) for field, _ in SORTS[sort]]
+    return base64.urlsafe_b64encode(json.dumps([sort, key], separators=(",", ":")).encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(sort: str, cursor: str) -> list:
+    try:
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ReviewCursorError("Malformed cursor")
+    if cursor_sort != sort or not isinstance(key, list) or len(key) != len(SORTS[sort]):
+        raise ReviewCursorError("Cursor belongs to another sort order")
+    return key
+
+
+def _after(sort: str, key: list) -> dict:
+    """Filter for the reviews that come after `key` in `sort` order."""
+    fields = SORTS[sort]
+    clauses = []
+    for i, (field, direction) in enumerate(fields):
+        clause = {f: v for (f, _), v in zip(fields[:i], key[:i])}
+        clause[field] = {"$lt" if direction == -1 else "$gt": key[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+class ReviewStore:
+    def __init__(self, db, top_count: int = TOP_REVIEWS):
+        self.reviews = db.reviews
+        self.votes = db.review_votes
+        self.products = db.products
+        self.top_count = top_count
+
+    async def ensure_indexes(self):
+        # Reviews from before votes existed would fall outside the "helpful" keyset
+        await self.reviews.update_many({"helpful_count": {"$exists": False}}, {"$set": {"helpful_count": 0}})
+        for fields in SORTS.values():
+            await self.reviews.create_index([("product_id", 1)] + fields)
+        await self.reviews.create_index("id")
+        try:
+            await self.reviews.create_index([("product_id", 1), ("user_id", 1)], unique=True)
+        except (DuplicateKeyError, OperationFailure):
+            logger.warning("Duplicate reviews per user exist; one-review-per-user is enforced by the route only")
+
+    # ---- reading ----
+
+    async def page(self, product_id: str, sort: str = "newest", limit: int = 10,
+                   cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        query = {"product_id": product_id}
+        if cursor:
+            query.update(_after(sort, decode_cursor(sort, cursor)))
+        reviews = await self.reviews.find(query, REVIEW_PROJECTION).sort(SORTS[sort]).limit(limit + 1).to_list(limit + 1)
+        next_cursor = encode_cursor(sort, reviews[limit - 1]) if len(reviews) > limit else None
+        return reviews[:limit], next_cursor
+
+    async def top(self, product: dict) -> Tuple[List[dict], Optional[str]]:
+        """Top reviews of a product document and the cursor to continue after them."""
+        if "top_reviews" not in product:
+            # Written before top reviews were precomputed
+            product["top_reviews"] = await self.refresh_top(product["id"])
+        top = product["top_reviews"]
+        if len(top) < self.top_count or len(top) >= product.get("reviews_count", 0):
+            return top, None
+        return top, encode_cursor("helpful", top[-1])
+
+    # ---- writing ----
+
+    async def add(self, review: dict) -> bool:
+        """Store a new review and refresh the product's rating and top reviews; False if the user already reviewed it."""
+        review.setdefault("helpful_count", 0)
+        try:
+            await self.reviews.insert_one(review)
+        except DuplicateKeyError:
+            return False
+        review.pop("_id", None)
+        stats = await self.reviews.aggregate([
+            {"$match": {"product_id": review["product_id"]}},
+            {"$group": {"_id": None, "rating": {"$avg": "$rating"}, "count": {"$sum": 1}}},
+        ]).to_list(1)
+        await self.products.update_one(
+            {"id": review["product_id"]},
+            {"$set": {"rating": round(stats[0]["rating"], 1), "reviews_count": stats[0]["count"]}},
+        )
+        await self.refresh_top(review["product_id"])
+        return True
+
+    async def vote(self, review_id: str, user_id: str, helpful: bool = True) -> Optional[dict]:
+        """Add or withdraw the user's helpful vote; returns the review (None if there is none)."""
+        review = await self.reviews.find_one({"id": review_id}, REVIEW_PROJECTION)
+        if review is None:
+            return None
+        vote_id = f"{review_id}:{user_id}"
+        changed = False
+        if helpful:
+            try:
+                await self.votes.insert_one({"_id": vote_id, "review_id": review_id, "user_id": user_id,
+                                             "created_at": datetime.now(timezone.utc).isoformat()})
+                changed = True
+            except DuplicateKeyError:
+                pass  # already voted
+        else:
+            changed = (await self.votes.delete_one({"_id": vote_id})).deleted_count > 0
+        if not changed:
+            return review
+
+        review = await self.reviews.find_one_and_update(
+            {"id": review_id}, {"$inc": {"helpful_count": 1 if helpful else -1}},
+            projection=REVIEW_PROJECTION, return_document=ReturnDocument.AFTER,
+        )
+        if review is not None and await self._affects_top(review):
+            await self.refresh_top(review["product_id"])
+        return review
+
+    async def _affects_top(self, review: dict) -> bool:
+        product = await self.products.find_one({"id": review["product_id"]}, {"_id": 0, "top_reviews": 1})
+        top = (product or {}).get("top_reviews")
+        if top is None or len(top) < self.top_count or any(r["id"] == review["id"] for r in top):
+            return True
+        # Could it now rank above the last top review?
+        return review["helpful_count"] >= top[-1].get("helpful_count", 0)
+
+    async def refresh_top(self, product_id: str) -> List[dict]:
+        top, _ = await self.page(product_id, "helpful", self.top_count)
+        await self.products.update_one({"id": product_id}, {"$set": {"top_reviews": top}})
+        return top
+
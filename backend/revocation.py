@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional
+
+from pymongo.errors import PyMongoError
+
+# Access token revocation (logout, admin demotion).
+# Revocations are stored in `revoked_tokens` until the token would have
+# expired anyway (TTL index on `expires_at`). Two kinds of entries:
+#
+#   {"id": <jti>, "kind": "token"}                            one token
+#   {"id": "user:<user_id>", "kind": "user", "not_before": t} every token of
+#                                                             the user issued before t
+#
+# Checking a token must not cost a database round trip, so each worker keeps
+# a Bloom filter of revoked jtis plus an exact set of the most recent ones,
+# and the per-user cutoffs in a dict. A jti the filter rules out (almost all
+# of them) is accepted immediately; a filter hit confirmed by the exact set
+# is rejected; only the rare hit the exact set can't settle (a false positive
+# or an evicted old entry) is looked up in MongoDB. Workers pick up each
+# other's revocations by polling `revoked_at` incrementally and rebuild the
+# filter periodically so expired entries drop out of it.
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def _aware(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class TokenRevocationList:
+    def __init__(self, db, poll_interval: float = 2.0, rebuild_interval: float = 3600,
+                 capacity: int = 100_000, exact_size: int = 10_000):
+        self.collection = db.revoked_tokens
+        self.poll_interval = poll_interval
+        self.rebuild_interval = rebuild_interval
+        self.capacity = capacity
+        self.exact_size = exact_size
+        self._bloom = BloomFilter(capacity)
+        self._exact: "OrderedDict[str, None]" = OrderedDict()
+        self._user_cutoffs: Dict[str, datetime] = {}
+        self._loaded = False
+        self._last_seen = datetime.now(timezone.utc)
+        self._seen = deque()  # (revoked_at, key) of entries read in the overlap window, oldest first
+        self._seen_keys = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"checks": 0, "bloom_negative": 0, "exact_hits": 0, "db_lookups": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index("revoked_at")
+
+    # ---- local state ----
+
+    def _remember(self, entry: dict):
+        if entry.get("kind") == "user":
+            user_id = entry["id"][len("user:"):]
+            not_before = _aware(entry["not_before"])
+            if user_id not in self._user_cutoffs or self._user_cutoffs[user_id] < not_before:
+                self._user_cutoffs[user_id] = not_before
+            return
+        jti = entry["id"]
+        if jti not in self._exact:
+            self._bloom.add(jti)
+        self._exact[jti] = None
+        self._exact.move_to_end(jti)
+        while len(self._exact) > self.exact_size:
+            self._exact.popitem(last=False)
+
+    async def _rebuild(self):
+        """Reload every live revocation into a fresh filter."""
+        revoked_since = datetime.now(timezone.utc)
+        entries = await self.collection.find(
+            {"expires_at": {"$gt": revoked_since}}, {"_id": 0, "id": 1, "kind": 1, "not_before": 1, "revoked_at": 1}
+        ).sort("revoked_at", 1).to_list(None)
+        self._bloom = BloomFilter(max(self.capacity, len(entries) * 2))
+        self._exact = OrderedDict()
+        self._user_cutoffs = {}
+        for entry in entries:
+            self._remember(entry)
+        self._last_seen = min(self._last_seen, revoked_since) if self._loaded else revoked_since
+        self._loaded = True
+        logger.info(f"Token revocation list loaded: {len(entries)} entries")
+
+    async def _poll_once(self):
+        # Re-read an overlap window; entries from other workers may carry slightly older timestamps.
+        # Pages are ordered by (revoked_at, _id), so a burst bigger than a page still moves on.
+        overlap = timedelta(seconds=max(self.poll_interval * 2, 5))
+        page_size = 1000
+        projection = {"_id": 1, "id": 1, "kind": 1, "not_before": 1, "revoked_at": 1}
+        query = {"revoked_at": {"$gte": self._last_seen - overlap}}
+        while True:
+            entries = await self.collection.find(query, projection).sort(
+                [("revoked_at", 1), ("_id", 1)]
+            ).to_list(page_size)
+            for entry in entries:
+                # Revoking a user again rewrites the same document, so key on the timestamp too
+                key = (entry["_id"], entry["revoked_at"])
+                if key in self._seen_keys:
+                    continue
+                revoked_at = _aware(entry["revoked_at"])
+                self._seen.append((revoked_at, key))
+                self._seen_keys.add(key)
+                self._remember(entry)
+                self._last_seen = max(self._last_seen, revoked_at)
+            if len(entries) < page_size:
+                break
+            last = entries[-1]
+            query = {"$or": [{"revoked_at": {"$gt": last["revoked_at"]}},
+                             {"revoked_at": last["revoked_at"], "_id": {"$gt": last["_id"]}}]}
+        while self._seen and self._seen[0][0] < self._last_seen - overlap:
+            self._seen_keys.discard(self._seen.popleft()[1])
+
+    # ---- lifecycle ----
+
+    async def start(self):
+        try:
+            await self._rebuild()
+        except PyMongoError:
+            # Checks go to MongoDB until the list is loaded
+            logger.exception("Could not load the token revocation list; retrying in the background")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        rebuilt_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                if not self._loaded or time.monotonic() - rebuilt_at > self.rebuild_interval \
+                        or self._bloom.count > self._bloom.capacity:
+                    await self._rebuild()
+                    rebuilt_at = time.monotonic()
+                else:
+                    await self._poll_once()
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("Token revocation refresh failed")
+
+    # ---- revoking ----
+
+    async def _store(self, entry: dict):
+        entry["revoked_at"] = datetime.now(timezone.utc)
+        await self.collection.update_one({"id": entry["id"]}, {"$set": entry}, upsert=True)
+        self._remember(entry)
+
+    async def revoke_token(self, jti: str, expires_at: datetime):
+        await self._store({"id": jti, "kind": "token", "expires_at": expires_at})
+
+    async def revoke_user(self, user_id: str, token_lifetime: timedelta):
+        """Revoke every token issued to the user so far."""
+        # Token iat has whole-second resolution; round up so none issued before now slips through
+        not_before = datetime.now(timezone.utc).replace(microsecond=0) + timedelta(seconds=1)
+        await self._store({"id": f"user:{user_id}", "kind": "user", "not_before": not_before,
+                           "expires_at": not_before + token_lifetime})
+
+    # ---- checking ----
+
+    async def is_revoked(self, jti: Optional[str], user_id: str, issued_at: Optional[datetime]) -> bool:
+        self.stats["checks"] += 1
+        if not self._loaded:
+            return await self._lookup(jti, user_id, issued_at)
+        cutoff = self._user_cutoffs.get(user_id)
+        if cutoff is not None and (issued_at is None or issued_at < cutoff):
+            return True
+        if jti is None:
+            return False
+        if jti not in self._bloom:
+            self.stats["bloom_negative"] += 1
+            return False
+        if jti in self._exact:
+            self.stats["exact_hits"] += 1
+            return True
+        return await self._lookup(jti, user_id, issued_at)
+
+    async def _lookup(self, jti: Optional[str], user_id: str, issued_at: Optional[datetime]) -> bool:
+        self.stats["db_lookups"] += 1
+        ids = [f"user:{user_id}"] + ([jti] if jti else [])
+        entries = await self.collection.find({"id": {"$in": ids}}, {"_id": 0}).to_list(None)
+        revoked = False
+        for entry in entries:
+            self._remember(entry)
+            if entry.get("kind") == "user":
+                revoked |= issued_at is None or issued_at < _aware(entry["not_before"])
+            else:
+                revoked = True
+        return revoked
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+# Sales analytics over in-memory order snapshots.
+# All orders (hot and archived) are loaded once into two frames, one row
+# per order and one per line item, and every report is computed from them
+# with vectorized pandas/NumPy operations. A snapshot is identified by the
+# order event log sequence plus a product generation that is bumped on
+# product changes, so frames and reports are rebuilt only when an order or
+# product actually changed.
+
+logger = logging.getLogger(__name__)
+
+ORDER_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "created_at": 1, "total_amount": 1, "status": 1,
+                "payment_status": 1, "items.product_id": 1, "items.quantity": 1, "items.price": 1}
+
+RFM_SEGMENTS = ("champions", "loyal", "new", "potential", "at_risk", "hibernating")
+
+
+@dataclass
+class Snapshot:
+    version: Tuple[int, int]
+    orders: pd.DataFrame    # paid, non-cancelled orders
+    items: pd.DataFrame     # their line items
+    products: pd.DataFrame  # indexed by product id
+
+
+def _month_index(ts: pd.Series) -> pd.Series:
+    return ts.dt.year * 12 + ts.dt.month - 1
+
+
+def _month_label(index) -> str:
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def _score(values: pd.Series, ascending: bool = True) -> pd.Series:
+    # 1..5 quintile score by rank, so ties and small samples still spread out
+    pct = values.rank(method="first", ascending=ascending, pct=True)
+    return np.ceil(pct * 5).clip(1, 5).astype(int)
+
+
+# ---- reports (pure functions over a snapshot) ----
+
+def summary(snap: Snapshot, months: int = 12) -> dict:
+    orders = snap.orders
+    revenue = float(orders["total_amount"].sum())
+    count = len(orders)
+    monthly = orders.groupby(_month_index(orders["created_at"]))["total_amount"].agg(["sum", "size"]).tail(months)
+    return {
+        "revenue": round(revenue, 2),
+        "orders": count,
+        "customers": int(orders["user_id"].nunique()),
+        "average_order_value": round(revenue / count, 2) if count else 0.0,
+        "items_per_order": round(float(snap.items["quantity"].sum()) / count, 2) if count else 0.0,
+        "by_month": [
+            {"month": _month_label(m), "revenue": round(float(row["sum"]), 2), "orders": int(row["size"]),
+             "average_order_value": round(float(row["sum"] / row["size"]), 2)}
+            for m, row in monthly.iterrows()
+        ],
+    }
+
+
+def cohorts(snap: Snapshot, months: int = 12) -> dict:
+    """Monthly acquisition cohorts and the share of each still ordering N months later."""
+    orders = snap.orders
+    if orders.empty:
+        return {"cohorts": []}
+    active = pd.DataFrame({"user_id": orders["user_id"], "month": _month_index(orders["created_at"])})
+    active = active.drop_duplicates()
+    active["cohort"] = active.groupby("user_id")["month"].transform("min")
+    active["offset"] = active["month"] - active["cohort"]
+    matrix = active.groupby(["cohort", "offset"]).size().unstack(fill_value=0).sort_index().tail(months)
+    sizes = matrix[0]
+    retention = matrix.div(sizes, axis=0).round(4)
+    last = active["month"].max()
+    return {"cohorts": [
+        # Only offsets that have already happened for this cohort
+        {"cohort": _month_label(cohort), "customers": int(sizes[cohort]),
+         "retention": retention.loc[cohort].iloc[:last - cohort + 1].tolist()}
+        for cohort in matrix.index
+    ]}
+
+
+def rfm(snap: Snapshot, as_of: datetime, top: int = 20) -> dict:
+    """Recency/frequency/monetary scores per customer, grouped into segments."""
+    orders = snap.orders
+    if orders.empty:
+        return {"segments": [], "top_customers": []}
+    customers = orders.groupby("user_id").agg(
+        last_order=("created_at", "max"), frequency=("id", "size"), monetary=("total_amount", "sum")
+    )
+    customers["recency_days"] = (pd.Timestamp(as_of) - customers["last_order"]).dt.days
+    r = _score(customers["recency_days"], ascending=False)
+    f = _score(customers["frequency"])
+    m = _score(customers["monetary"])
+    fm = (f + m) / 2
+    customers["segment"] = np.select(
+        [(r >= 4) & (fm >= 4), (r >= 3) & (fm >= 3), (r >= 4) & (customers["frequency"] == 1), r >= 3, fm >= 3],
+        ["champions", "loyal", "new", "potential", "at_risk"],
+        default="hibernating",
+    )
+    customers["rfm"] = r * 100 + f * 10 + m
+
+    total = customers["monetary"].sum()
+    grouped = customers.groupby("segment").agg(
+        customers=("frequency", "size"), recency_days=("recency_days", "mean"),
+        frequency=("frequency", "mean"), monetary=("monetary", "sum"),
+    ).reindex(RFM_SEGMENTS).dropna()
+    top_customers = customers.nlargest(top, "monetary")
+    return {
+        "segments": [
+            {"segment": name, "customers": int(row["customers"]),
+             "avg_recency_days": round(float(row["recency_days"]), 1),
+             "avg_frequency": round(float(row["frequency"]), 2),
+             "revenue": round(float(row["monetary"]), 2),
+             "revenue_share": round(float(row["monetary"] / total), 4) if total else 0.0}
+            for name, row in grouped.iterrows()
+        ],
+        "top_customers": [
+            {"user_id": user_id, "segment": row["segment"], "rfm": int(row["rfm"]),
+             "recency_days": int(row["recency_days"]), "frequency": int(row["frequency"]),
+             "monetary": round(float(row["monetary"]), 2)}
+            for user_id, row in top_customers.iterrows()
+        ],
+    }
+
+
+def velocity(snap: Snapshot, as_of: datetime, days: int = 30, limit: int = 50) -> dict:
+    """Units sold per day in the last `days`, the trend against the window before and days of stock left."""
+    items = snap.items
+    as_of = pd.Timestamp(as_of)
+    start, prev_start = as_of - pd.Timedelta(days=days), as_of - pd.Timedelta(days=2 * days)
+    current = items.loc[items["created_at"] > start].groupby("product_id")["quantity"].sum()
+    previous = items.loc[(items["created_at"] > prev_start) & (items["created_at"] <= start)] \
+        .groupby("product_id")["quantity"].sum()
+
+    frame = pd.DataFrame({"units": current, "previous_units": previous}).fillna(0)
+    frame = frame.loc[frame["units"] > 0]
+    frame["units_per_day"] = frame["units"] / days
+    frame["trend"] = frame["units"] / frame["previous_units"].replace(0, np.nan) - 1
+    frame = frame.join(snap.products[["name", "category", "stock"]], how="left")
+    frame["days_of_stock"] = frame["stock"] / frame["units_per_day"]
+    frame = frame.sort_values("units_per_day", ascending=False).head(limit)
+    frame = frame.replace([np.inf, -np.inf], np.nan)
+    frame = frame.astype(object).where(frame.notna(), None)
+    return {"days": days, "products": [
+        {"product_id": product_id, "name": row["name"], "category": row["category"],
+         "units": int(row["units"]), "units_per_day": round(float(row["units_per_day"]), 3),
+         "trend": None if row["trend"] is None else round(float(row["trend"]), 4),
+         "stock": None if row["stock"] is None else int(row["stock"]),
+         "days_of_stock": None if row["days_of_stock"] is None else round(float(row["days_of_stock"]), 1)}
+        for product_id, row in frame.iterrows()
+    ]}
+
+
+def category_mix(snap: Snapshot, as_of: datetime, days: Optional[int] = None) -> dict:
+    items = snap.items
+    if days:
+        items = items.loc[items["created_at"] > pd.Timestamp(as_of) - pd.Timedelta(days=days)]
+    category = items["product_id"].map(snap.products["category"]).fillna("Unknown")
+    mix = items.groupby(category).agg(
+        revenue=("line_total", "sum"), units=("quantity", "sum"), orders=("order_id", "nunique")
+    ).sort_values("revenue", ascending=False)
+    total = mix["revenue"].sum()
+    return {"days": days, "categories": [
+        {"category": name, "revenue": round(float(row["revenue"]), 2), "units": int(row["units"]),
+         "orders": int(row["orders"]), "revenue_share": round(float(row["revenue"] / total), 4) if total else 0.0}
+        for name, row in mix.iterrows()
+    ]}
+
+
+REPORTS = {
+    "summary": lambda snap, as_of, **params: summary(snap, **params),
+    "cohorts": lambda snap, as_of, **params: cohorts(snap, **params),
+    "rfm": rfm,
+    "velocity": velocity,
+    "categories": category_mix,
+}
+
+
+# ---- loading and caching ----
+
+def _build_frames(orders: list, products: list) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    order_frame = pd.DataFrame({
+        "id": [o["id"] for o in orders],
+        "user_id": [o["user_id"] for o in orders],
+        "created_at": pd.to_datetime([o["created_at"] for o in orders], utc=True, format="ISO8601"),
+        "total_amount": np.array([o["total_amount"] for o in orders], dtype=np.float64),
+    })
+    counts = np.array([len(o.get("items", ())) for o in orders], dtype=np.int64)
+    lines = [item for o in orders for item in o.get("items", ())]
+    quantity = np.array([i["quantity"] for i in lines], dtype=np.int64)
+    price = np.array([i["price"] for i in lines], dtype=np.float64)
+    item_frame = pd.DataFrame({
+        # Order columns are repeated per line item without a Python-level join
+        "order_id": np.repeat(order_frame["id"].to_numpy(), counts),
+        "created_at": np.repeat(order_frame["created_at"].to_numpy(), counts),
+        "product_id": [i["product_id"] for i in lines],
+        "quantity": quantity,
+        "line_total": quantity * price,
+    })
+    item_frame["created_at"] = pd.to_datetime(item_frame["created_at"], utc=True)
+    product_frame = pd.DataFrame(products, columns=["id", "name", "category", "stock"]).set_index("id")
+    return order_frame, item_frame, product_frame
+
+
+class SalesAnalytics:
+    def __init__(self, db, archive=None):
+        self.db = db
+        self.archive = archive
+        self._product_generation = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._reports: Dict[tuple, dict] = {}
+        self._loading = asyncio.Lock()
+
+    async def on_product_change(self, event):
+        """InvalidationBus handler: names, categories and stock feed the reports."""
+        self._product_generation += 1
+
+    async def version(self) -> Tuple[int, int]:
+        counter = await self.db.counters.find_one({"_id": "order_events"})
+        return (counter["seq"] if counter else 0, self._product_generation)
+
+    async def _load_orders(self) -> list:
+        sales = {"payment_status": "paid", "status": {"$ne": "cancelled"}}
+        orders = []
+        if self.archive is not None:
+            async for batch in self.archive.iter_orders({"$exists": True}):
+                orders.extend(o for o in batch if o.get("payment_status") == "paid" and o.get("status") != "cancelled")
+        orders += await self.db.orders.find(sales, ORDER_FIELDS).to_list(None)
+        return orders
+
+    async def snapshot(self) -> Snapshot:
+        version = await self.version()
+        if self._snapshot and self._snapshot.version == version:
+            return self._snapshot
+        async with self._loading:
+            version = await self.version()
+            if self._snapshot is None or self._snapshot.version != version:
+                orders = await self._load_orders()
+                products = await self.db.products.find(
+                    {}, {"_id": 0, "id": 1, "name": 1, "category": 1, "stock": 1}
+                ).to_list(None)
+                frames = await asyncio.to_thread(_build_frames, orders, products)
+                self._snapshot = Snapshot(version, *frames)
+                self._reports = {}
+                logger.info(f"Loaded sales snapshot {version}: {len(frames[0])} orders, {len(frames[1])} line items")
+        return self._snapshot
+
+    async def report(self, name: str, **params) -> dict:
+        snap = await self.snapshot()
+        # Day granularity keeps recency-based reports fresh without recomputing per request
+        as_of = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        key = (name, as_of.date(), tuple(sorted(params.items())))
+        result = self._reports.get(key)
+        if result is None:
+            result = await asyncio.to_thread(REPORTS[name], snap, as_of, **params)
+            result = {"snapshot_version": "-".join(map(str, snap.version)), **result}
+            if snap is self._snapshot:
+                self._reports[key] = result
+        return result
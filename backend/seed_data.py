@@ -10,14 +10,14 @@ from passlib.context import CryptContext
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-mongo_url = os.environ['MONGO_URL']
-db_name = os.environ['DB_NAME']
-
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-async def seed_database():
-    client = AsyncIOMotorClient(mongo_url)
-    db = client[db_name]
+async def seed_database(db=None):
+    # backend_test.py --in-process seeds its in-memory database through here
+    client = None
+    if db is None:
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        db = client[os.environ['DB_NAME']]
     
     # Clear existing data
     await db.products.delete_many({})
@@ -251,7 +251,8 @@ async def seed_database():
     print("Password: admin123")
     print("="*50)
     
-    client.close()
+    if client is not None:
+        client.close()
 
 if __name__ == "__main__":
     asyncio.run(seed_database())
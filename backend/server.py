@@ -1,46 +1,270 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, WebSocket, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
+import asyncio
+import json
 import logging
 from pathlib import Path
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional, Dict
 import uuid
 from datetime import datetime, timezone, timedelta
-from passlib.context import CryptContext
 import jwt
-from io import BytesIO
-from fastapi.responses import StreamingResponse, Response
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+from fastapi.responses import StreamingResponse, Response, JSONResponse, FileResponse
+from lazy_imports import lazy_import, prewarm
+from database import MongoSettings, PoolStats, create_client, check_readiness
+from settings import Settings
+from similarity import SimilarityIndex, INDEXED_FIELDS
+from change_streams import InvalidationBus, ChangeStreamListener, ChangeEvent, INVALIDATE_ALL
+from order_events import EventBroker, LocalBroadcastBackend, MongoBroadcastBackend, sse_stream
+from stock_feed import StockFeed
+from idempotency import IdempotencyStore, request_fingerprint
+from order_log import OrderEventLog, validate_transition
+from order_archive import OrderArchive
+from carts import CartStore
+from guest_cart import GuestCartCodec, GuestCartError
+from revocation import TokenRevocationList
+from compression import CompressionMiddleware, PrecompressedCache
+from inventory import Inventory
+from waiting_room import WaitingRoom, WaitingRoomError
+from reviews import ReviewStore, ReviewCursorError, SORTS as REVIEW_SORTS
+from batch_loader import BatchLoader
+from fieldsets import FieldSets, FieldSetError
+from catalog_publisher import CatalogPublisher, VOLATILE_FIELDS
+from payments import GatewayClient, PaymentProcessor, WebhookError, SIGNATURE_HEADER
+from gateway_simulator import GatewaySimulator
+from outbox import Outbox, LocalBroker, OUTBOX_FIELD, with_events
+from analytics_export import AnalyticsExporter
+from sales_analytics import SalesAnalytics
+from rate_limit import RateLimiter, InMemoryRateLimitBackend, MongoRateLimitBackend, parse_policies
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Feature modules with heavy dependencies, imported on first use
+receipts = lazy_import("receipts")
+passwords = lazy_import("passwords")
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Settings, database handles and services of the running app; all set by
+# configure(), which create_app() calls with injected settings and database
+settings: Settings = None
+mongo_settings: MongoSettings = None
+pool_stats: PoolStats = None
+client = None
+db = None
+rate_limiter: RateLimiter = None
+similarity_index: SimilarityIndex = None
+invalidation_bus: InvalidationBus = None
+change_listener: ChangeStreamListener = None
+order_event_broker: EventBroker = None
+stock_feed: StockFeed = None
+idempotency_store: IdempotencyStore = None
+order_log: OrderEventLog = None
+order_archive: OrderArchive = None
+analytics_exporter: AnalyticsExporter = None
+sales_analytics: SalesAnalytics = None
+cart_store: CartStore = None
+guest_carts: GuestCartCodec = None
+token_revocations: TokenRevocationList = None
+catalog_cache: PrecompressedCache = None
+inventory: Inventory = None
+waiting_room: WaitingRoom = None
+review_store: ReviewStore = None
+product_loader: BatchLoader = None
+catalog_publisher: CatalogPublisher = None
+payment_simulator: Optional[GatewaySimulator] = None
+payment_processor: PaymentProcessor = None
+outbox: Outbox = None
+outbox_broker: Optional[LocalBroker] = None
+
+def configure(app_settings: Settings, database=None):
+    """Create the database handle and every service for `app_settings`.
+
+    `database` replaces the MongoDB connection, e.g. with memory_db for tests.
+    """
+    global settings, mongo_settings, pool_stats, client, db, rate_limiter, similarity_index, \
+        invalidation_bus, change_listener, order_event_broker, stock_feed, idempotency_store, \
+        order_log, order_archive, analytics_exporter, sales_analytics, cart_store, guest_carts, \
+        token_revocations, catalog_cache, inventory, waiting_room, review_store, product_loader, \
+        catalog_publisher, payment_simulator, payment_processor, outbox, outbox_broker
+
+    settings = app_settings
+    mongo_settings = settings.mongo
+
+    # MongoDB connection
+    pool_stats = PoolStats()
+    if database is None:
+        client = create_client(mongo_settings, pool_stats)
+        db = client[mongo_settings.db_name]
+    else:
+        client = database.client
+        db = database
+
+    # Rate limiting for auth routes (bcrypt is expensive)
+    if settings.rate_limit_backend == 'mongo':
+        rate_limit_backend = MongoRateLimitBackend(db.rate_limits)
+    else:
+        rate_limit_backend = InMemoryRateLimitBackend()
+    rate_limiter = RateLimiter(
+        rate_limit_backend,
+        policies=parse_policies(settings.rate_limit_policies),
+        trust_forwarded=settings.rate_limit_trust_forwarded,
+    )
+
+    # Content-based "similar products" index, rebuilt on startup
+    similarity_index = SimilarityIndex()
+
+    # Cross-worker invalidation of local caches (change streams or polling)
+    invalidation_bus = InvalidationBus()
+    change_listener = ChangeStreamListener(
+        db,
+        invalidation_bus,
+        collections=["products", "users", "orders"],
+        worker_id=settings.worker_id,
+        mode=settings.invalidation_mode,
+        poll_interval=settings.invalidation_poll_interval,
+    )
+
+    # Order/payment status push (SSE)
+    if settings.event_broadcast_backend == 'mongo':
+        event_broadcast_backend = MongoBroadcastBackend(db.stream_events)
+    else:
+        event_broadcast_backend = LocalBroadcastBackend()
+    order_event_broker = EventBroker(event_broadcast_backend)
+
+    # Live stock/price push for product pages (WebSocket)
+    stock_feed = StockFeed(db, interval=settings.stock_feed_interval)
+
+    # Idempotency-Key handling for order creation
+    idempotency_store = IdempotencyStore(db.idempotency_keys)
+
+    # Append-only order event log and its read models
+    order_log = OrderEventLog(db)
+
+    # Cold storage for old delivered orders
+    order_archive = OrderArchive(db, settings.order_archive_dir, min_age_days=settings.order_archive_min_age_days)
+
+    # Columnar (Parquet/Arrow) exports for offline analytics
+    analytics_exporter = AnalyticsExporter(db, settings.analytics_export_dir, archive=order_archive)
+
+    # Sales analytics (cohorts, RFM, velocity) over cached order snapshots
+    sales_analytics = SalesAnalytics(db, archive=order_archive)
+
+    # Carts, created on first write and expired by TTL
+    cart_store = CartStore(db.carts, ttl_days=settings.cart_ttl_days,
+                           empty_ttl_hours=settings.empty_cart_ttl_hours)
+    # Signed client-side carts for guests, merged into the server cart on login
+    guest_carts = GuestCartCodec(settings.jwt_secret, max_age_seconds=settings.cart_ttl_days * 86400)
+
+    # Revoked access tokens (logout, admin demotion), checked in memory
+    token_revocations = TokenRevocationList(db, poll_interval=settings.token_revocation_poll_interval)
+
+    # Catalog payloads serialized and compressed once per catalog generation;
+    # rebuilds after stock/rating-only changes use a quicker compression level
+    catalog_cache = PrecompressedCache(minimum_size=settings.compression_min_size,
+                                       volatile_fields=VOLATILE_FIELDS, volatile_level=5)
+
+    # Product stock, sharded automatically for hot products
+    inventory = Inventory(
+        db,
+        on_change=notify_stock_change,
+        shard_count=settings.stock_shard_count,
+        promote_rate=settings.stock_promote_rate,
+        idle_seconds=settings.stock_demote_idle_seconds,
+    )
+
+    # Flash-sale waiting room, admitting checkouts of flagged products at a fixed rate
+    waiting_room = WaitingRoom(
+        db,
+        settings.jwt_secret,
+        stock=sellable_stock,
+        default_admit_rate=settings.flash_sale_admit_rate,
+        pass_seconds=settings.flash_sale_pass_seconds,
+    )
 
-# JWT settings
-JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key')
-JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 1440))
+    # Paginated reviews, helpful votes and the top reviews kept on each product
+    review_store = ReviewStore(db)
+
+    # Product lookups by id, coalesced into one $in query per event-loop tick
+    product_loader = BatchLoader(load_products_by_id)
+
+    # Versioned static catalog snapshots on disk, republished on catalog edits
+    catalog_publisher = CatalogPublisher(
+        db,
+        settings.catalog_snapshot_dir,
+        product_fields,
+        delay=settings.catalog_publish_delay,
+        refresh_interval=settings.catalog_refresh_interval,
+        minimum_size=settings.compression_min_size,
+    )
+
+    # Payments: charges sent by background workers, confirmed by the gateway's webhook.
+    # Without a gateway URL the local simulator is called in-process.
+    if settings.payment_gateway_url:
+        payment_simulator = None
+        gateway = GatewayClient(settings.payment_gateway_url, settings.payment_gateway_api_key,
+                                max_connections=settings.payment_gateway_max_connections)
+    else:
+        payment_simulator = GatewaySimulator(
+            settings.payment_gateway_api_key,
+            settings.payment_webhook_secret,
+            latency=settings.payment_sim_latency,
+            settle_delay=settings.payment_sim_settle_delay,
+            failure_rate=settings.payment_sim_failure_rate,
+            decline_rate=settings.payment_sim_decline_rate,
+        )
+        gateway = GatewayClient("http://gateway-simulator", settings.payment_gateway_api_key,
+                                app=payment_simulator.app)
+    payment_processor = PaymentProcessor(
+        db,
+        gateway,
+        settings.payment_webhook_secret,
+        settings.payment_callback_url or "http://shop/api/payments/webhook",
+        on_paid=confirm_order_payment,
+        on_failed=record_payment_failure,
+        workers=settings.payment_workers,
+        max_attempts=settings.payment_max_attempts,
+    )
+
+    # Side effects of order changes, stored with the change and relayed to subscribers
+    outbox = Outbox(
+        db,
+        collections=("orders", "users"),
+        batch_size=settings.outbox_batch_size,
+        poll_interval=settings.outbox_poll_interval,
+    )
+    outbox.subscribe("order.created", "order_log", log_order_event)
+    outbox.subscribe("order.created", "order_cache", invalidate_order_caches)
+    outbox.subscribe("order.paid", "order_log", log_order_event)
+    outbox.subscribe("order.paid", "order_cache", invalidate_order_caches)
+    outbox.subscribe("order.paid", "inventory", decrement_paid_stock)
+    outbox.subscribe("order.paid", "cart", clear_paid_cart)
+    outbox.subscribe("order.payment_failed", "order_cache", invalidate_order_caches)
+    outbox.subscribe("order.status_changed", "order_log", log_order_event)
+    outbox.subscribe("order.status_changed", "order_cache", invalidate_order_caches)
+    outbox.subscribe("receipt.requested", "receipt_email", send_receipt_email)
+    for event_type in ORDER_STREAM_EVENTS:
+        outbox.subscribe(event_type, "order_stream", stream_order_change)
+    if settings.outbox_broker == 'local':
+        outbox_broker = LocalBroker()
+        outbox.subscribe_all("broker", lambda event: outbox_broker.publish(event["type"], event["aggregate_id"], event))
+    else:
+        outbox_broker = None
+
+    invalidation_bus.subscribe("products", refresh_similarity_index)
+    invalidation_bus.subscribe("products", stock_feed.on_product_change)
+    invalidation_bus.subscribe("products", sales_analytics.on_product_change)
+    invalidation_bus.subscribe("products", catalog_cache.on_change)
+    invalidation_bus.subscribe("products", catalog_publisher.on_change)
 
-# Create the main app
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
+health_router = APIRouter()
 
 # ============== MODELS ==============
 
@@ -93,6 +317,19 @@ class Product(BaseModel):
     reviews_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# What a product card or admin table row shows (?view=summary)
+class ProductSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    name: str
+    price: float
+    category: str
+    image_url: str
+    brand: str
+    stock: int = 0
+    rating: float = 0.0
+    reviews_count: int = 0
+
 # Cart Models
 class CartItem(BaseModel):
     product_id: str
@@ -101,7 +338,7 @@ class CartItem(BaseModel):
 class Cart(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
+    user_id: Optional[str] = None
     items: List[CartItem] = []
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -123,6 +360,17 @@ class Order(BaseModel):
     session_id: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# An order without its line items (?view=summary)
+class OrderSummary(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str
+    user_id: str
+    total_amount: float
+    status: str = "pending"
+    payment_status: str = "pending"
+    item_count: int = 0
+    created_at: datetime
+
 # Review Models
 class ReviewCreate(BaseModel):
     product_id: str
@@ -137,9 +385,30 @@ class Review(BaseModel):
     user_name: str
     rating: int
     comment: str
+    helpful_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-# Payment Transaction Model
+class ReviewPage(BaseModel):
+    reviews: List[Review]
+    next_cursor: Optional[str] = None
+
+class ProductBatch(BaseModel):
+    products: List[Product]
+    not_found: List[str] = []
+
+# Product page payload: the first reviews come with the product
+class ProductDetail(Product):
+    top_reviews: List[Review] = []
+    reviews_cursor: Optional[str] = None
+
+class FlashSaleUpdate(BaseModel):
+    admit_rate: Optional[float] = Field(None, gt=0)
+
+# Payment Models
+class PaymentCreate(BaseModel):
+    payment_method: str = "card"
+    last4: Optional[str] = Field(None, pattern=r"^[0-9]{4}$")
+
 class PaymentTransaction(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -149,6 +418,8 @@ class PaymentTransaction(BaseModel):
     amount: float
     currency: str = "usd"
     payment_status: str = "pending"
+    attempts: int = 0
+    error: Optional[str] = None
     metadata: Dict = {}
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -156,45 +427,89 @@ class PaymentTransaction(BaseModel):
 # ============== AUTH HELPERS ==============
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return passwords.hash_password(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return passwords.verify_password(plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    now = datetime.now(timezone.utc)
+    expire = now + timedelta(minutes=settings.access_token_expire_minutes)
+    # jti/iat make the token revocable on its own or with all of its user's tokens
+    to_encode.update({"exp": expire, "iat": now, "jti": uuid.uuid4().hex})
+    encoded_jwt = jwt.encode(to_encode, settings.jwt_secret, algorithm=settings.jwt_algorithm)
     return encoded_jwt
 
+def create_stream_ticket(user_id: str) -> str:
+    expire = datetime.now(timezone.utc) + timedelta(seconds=settings.stream_ticket_expire_seconds)
+    return jwt.encode({"sub": user_id, "scope": "events", "exp": expire}, settings.jwt_secret, algorithm=settings.jwt_algorithm)
+
+def verify_stream_ticket(ticket: str) -> str:
+    try:
+        payload = jwt.decode(ticket, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket")
+    if payload.get("scope") != "events" or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid stream ticket")
+    return payload["sub"]
+
+def decode_access_token(token: str) -> dict:
+    try:
+        payload = jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.PyJWTError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
+        payload = decode_access_token(credentials.credentials)
+        user_id: str = payload["sub"]
+        issued_at = datetime.fromtimestamp(payload["iat"], timezone.utc) if "iat" in payload else None
+        if await token_revocations.is_revoked(payload.get("jti"), user_id, issued_at):
+            raise HTTPException(status_code=401, detail="Token revoked")
         
         user_data = await db.users.find_one({"id": user_id}, {"_id": 0})
         if user_data is None:
             raise HTTPException(status_code=401, detail="User not found")
         
         return User(**user_data)
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=401, detail=str(e))
 
+async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)) -> Optional[User]:
+    # Guests have no Authorization header; a bad token still fails as usual
+    if credentials is None:
+        return None
+    return await get_current_user(credentials)
+
 async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
+async def merge_guest_cart(user_id: str, token: Optional[str]):
+    try:
+        items = guest_carts.decode(token)
+    except GuestCartError as e:
+        # Never fail a login over a bad guest cart
+        logger.warning(f"Ignoring guest cart of user {user_id}: {e}")
+        return
+    await cart_store.merge_items(user_id, items)
+
 # ============== AUTH ROUTES ==============
 
 @api_router.post("/auth/register", response_model=Token)
-async def register(user_data: UserRegister):
+async def register(user_data: UserRegister, request: Request, x_guest_cart: Optional[str] = Header(None)):
+    # Refuse before doing any hashing
+    await rate_limiter.check("auth.register", request, email=user_data.email)
+    
     # Check if user exists
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
@@ -212,6 +527,8 @@ async def register(user_data: UserRegister):
     user_dict['created_at'] = user_dict['created_at'].isoformat()
     
     await db.users.insert_one(user_dict)
+    await change_listener.notify("users", "insert", user.id)
+    await merge_guest_cart(user.id, x_guest_cart)
     
     # Create access token
     access_token = create_access_token(data={"sub": user.id})
@@ -219,7 +536,10 @@ async def register(user_data: UserRegister):
     return Token(access_token=access_token, token_type="bearer", user=user)
 
 @api_router.post("/auth/login", response_model=Token)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, request: Request, x_guest_cart: Optional[str] = Header(None)):
+    # Refuse before doing any hashing
+    await rate_limiter.check("auth.login", request, email=credentials.email)
+    
     # Find user
     user_data = await db.users.find_one({"email": credentials.email})
     if not user_data:
@@ -230,20 +550,51 @@ async def login(credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     user = User(**{k: v for k, v in user_data.items() if k != 'password'})
+    await merge_guest_cart(user.id, x_guest_cart)
     
     # Create access token
     access_token = create_access_token(data={"sub": user.id})
     
     return Token(access_token=access_token, token_type="bearer", user=user)
 
+@api_router.post("/auth/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security),
+                 current_user: User = Depends(get_current_user)):
+    payload = decode_access_token(credentials.credentials)
+    if payload.get("jti"):
+        await token_revocations.revoke_token(payload["jti"], datetime.fromtimestamp(payload["exp"], timezone.utc))
+    else:
+        # Issued before tokens had ids; the only way to revoke it is with all of the user's tokens
+        await token_revocations.revoke_user(current_user.id, timedelta(minutes=settings.access_token_expire_minutes))
+    return {"message": "Logged out"}
+
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 # ============== PRODUCT ROUTES ==============
 
+# Listings leave out the precomputed top reviews, which only the product page shows
+PRODUCT_LIST_PROJECTION = {"_id": 0, "top_reviews": 0}
+
+product_fields = FieldSets(Product, ProductSummary, full_projection=PRODUCT_LIST_PROJECTION)
+
+def select_fields(fieldsets: FieldSets, view: str, fields: Optional[str]):
+    try:
+        return fieldsets.select(view, fields)
+    except FieldSetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+MAX_BATCH_GET_IDS = 100
+
+async def load_products_by_id(ids: List[str]) -> Dict[str, dict]:
+    products = await db.products.find({"id": {"$in": ids}}, PRODUCT_LIST_PROJECTION).to_list(len(ids))
+    return {p['id']: p for p in products}
+
 @api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None, search: Optional[str] = None):
+async def get_products(request: Request, category: Optional[str] = None, search: Optional[str] = None,
+                       view: str = "full", fields: Optional[str] = None):
+    selection = select_fields(product_fields, view, fields)
     query = {}
     if category:
         query['category'] = category
@@ -253,17 +604,55 @@ async def get_products(category: Optional[str] = None, search: Optional[str] = N
             {'description': {'$regex': search, '$options': 'i'}},
             {'brand': {'$regex': search, '$options': 'i'}}
         ]
+        # Free-text searches are too varied to cache; the middleware compresses them
+        products = await db.products.find(query, selection.projection).to_list(1000)
+        return Response(selection.render(products), media_type="application/json")
     
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
-    return products
+    async def build() -> bytes:
+        products = await db.products.find(query, selection.projection).to_list(1000)
+        return selection.render(products)
+    
+    # Each view/fieldset of a listing is cached on its own
+    return await catalog_cache.respond(request, f"products:{category or ''}:{selection.key}", build)
+
+@api_router.get("/products:batchGet", response_model=ProductBatch)
+async def batch_get_products(ids: List[str] = Query([])):
+    # ids=a,b,c or ids=a&ids=b; order is kept, duplicates dropped
+    requested = list(dict.fromkeys(i.strip() for value in ids for i in value.split(",") if i.strip()))
+    if not requested:
+        raise HTTPException(status_code=400, detail="ids is required")
+    if len(requested) > MAX_BATCH_GET_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_GET_IDS} ids per request")
+    products = await product_loader.load_many(requested)
+    return {
+        "products": [p for p in products if p is not None],
+        "not_found": [pid for pid, p in zip(requested, products) if p is None],
+    }
 
-@api_router.get("/products/{product_id}", response_model=Product)
+@api_router.get("/products/{product_id}", response_model=ProductDetail)
 async def get_product(product_id: str):
     product = await db.products.find_one({"id": product_id}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    product['top_reviews'], product['reviews_cursor'] = await review_store.top(product)
     return product
 
+@api_router.get("/products/{product_id}/similar", response_model=List[Product])
+async def get_similar_products(product_id: str, limit: int = 8):
+    limit = max(1, min(limit, 24))
+    if product_id not in similarity_index:
+        # Product may have been created by another worker since startup
+        product = await db.products.find_one({"id": product_id}, {"_id": 0})
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        similarity_index.upsert(product)
+    
+    matches = similarity_index.similar(product_id, limit)
+    ids = [m['product_id'] for m in matches]
+    products = await db.products.find({"id": {"$in": ids}}, PRODUCT_LIST_PROJECTION).to_list(len(ids))
+    by_id = {p['id']: p for p in products}
+    return [by_id[pid] for pid in ids if pid in by_id]
+
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate, admin: User = Depends(get_admin_user)):
     product = Product(**product_data.model_dump())
@@ -271,6 +660,7 @@ async def create_product(product_data: ProductCreate, admin: User = Depends(get_
     product_dict['created_at'] = product_dict['created_at'].isoformat()
     
     await db.products.insert_one(product_dict)
+    await change_listener.notify("products", "insert", product.id, product.model_dump())
     return product
 
 @api_router.put("/products/{product_id}", response_model=Product)
@@ -280,9 +670,13 @@ async def update_product(product_id: str, product_data: ProductCreate, admin: Us
         raise HTTPException(status_code=404, detail="Product not found")
     
     update_data = product_data.model_dump()
+    if await inventory.set_stock(product_id, update_data['stock']):
+        # Sharded stock is adjusted on the shards, not overwritten here
+        del update_data['stock']
     await db.products.update_one({"id": product_id}, {"$set": update_data})
     
     updated_product = await db.products.find_one({"id": product_id}, {"_id": 0})
+    await change_listener.notify("products", "update", product_id, updated_product)
     return updated_product
 
 @api_router.delete("/products/{product_id}")
@@ -290,92 +684,182 @@ async def delete_product(product_id: str, admin: User = Depends(get_admin_user))
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await inventory.forget(product_id)
+    await change_listener.notify("products", "delete", product_id)
     return {"message": "Product deleted successfully"}
 
+async def notify_stock_change(product_id: str):
+    await change_listener.notify("products", "update", product_id, updated_fields=["stock"])
+
+async def sellable_stock(product_id: str) -> int:
+    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+    return await inventory.available(product) if product else 0
+
+@api_router.websocket("/ws/stock")
+async def stock_updates(websocket: WebSocket):
+    await stock_feed.serve(websocket)
+
+# Static catalog snapshots: only the manifest is revalidated, everything it points to is immutable
+@api_router.get("/catalog/manifest.json")
+async def get_catalog_manifest(request: Request):
+    manifest = catalog_publisher.manifest
+    if manifest is None:
+        raise HTTPException(status_code=503, detail="Catalog not published yet")
+    headers = {"ETag": f'"{manifest["version"]}"', "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(manifest, headers=headers)
+
+@api_router.get("/catalog/{version}/{path:path}")
+async def get_catalog_file(version: str, path: str, request: Request):
+    resolved = catalog_publisher.resolve(version, path, request.headers.get("accept-encoding", ""))
+    if resolved is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    file, encoding = resolved
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    # FileResponse streams from disk (sendfile via the server's pathsend support, where available)
+    return FileResponse(file, media_type="application/json", headers=headers)
+
 @api_router.get("/categories")
-async def get_categories():
-    categories = await db.products.distinct("category")
-    return {"categories": categories}
+async def get_categories(request: Request):
+    async def build() -> bytes:
+        categories = await db.products.distinct("category")
+        return json.dumps({"categories": categories}).encode()
+    
+    return await catalog_cache.respond(request, "categories", build)
 
 # ============== CART ROUTES ==============
 
+# Guests (no Authorization header) keep their cart in the X-Guest-Cart token;
+# every guest write returns the updated token as `guest_cart`.
+
+def read_guest_cart(token: Optional[str]) -> dict:
+    try:
+        return guest_carts.decode(token)
+    except GuestCartError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.get("/cart", response_model=Cart)
-async def get_cart(current_user: User = Depends(get_current_user)):
-    cart = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0})
-    if not cart:
-        cart = Cart(user_id=current_user.id)
-        cart_dict = cart.model_dump()
-        cart_dict['updated_at'] = cart_dict['updated_at'].isoformat()
-        await db.carts.insert_one(cart_dict)
-    return cart
+async def get_cart(current_user: Optional[User] = Depends(get_optional_user),
+                   x_guest_cart: Optional[str] = Header(None)):
+    if current_user is None:
+        items = read_guest_cart(x_guest_cart)
+        return Cart(id="guest", items=[CartItem(product_id=p, quantity=q) for p, q in items.items()])
+    # No cart yet reads as an empty one; the document is created on the first add
+    cart = await cart_store.get(current_user.id)
+    return cart or Cart(user_id=current_user.id)
 
 @api_router.post("/cart/items")
-async def add_to_cart(item: CartItem, current_user: User = Depends(get_current_user)):
+async def add_to_cart(item: CartItem, current_user: Optional[User] = Depends(get_optional_user),
+                      x_guest_cart: Optional[str] = Header(None)):
     # Check if product exists
-    product = await db.products.find_one({"id": item.product_id})
+    product = await product_loader.load(item.product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get or create cart
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        cart = Cart(user_id=current_user.id, items=[item])
-        cart_dict = cart.model_dump()
-        cart_dict['updated_at'] = cart_dict['updated_at'].isoformat()
-        await db.carts.insert_one(cart_dict)
-    else:
-        # Check if item already in cart
-        existing_item = next((i for i in cart.get('items', []) if i['product_id'] == item.product_id), None)
-        if existing_item:
-            # Update quantity
-            await db.carts.update_one(
-                {"user_id": current_user.id, "items.product_id": item.product_id},
-                {"$set": {"items.$.quantity": item.quantity, "updated_at": datetime.now(timezone.utc).isoformat()}}
-            )
-        else:
-            # Add new item
-            await db.carts.update_one(
-                {"user_id": current_user.id},
-                {"$push": {"items": item.model_dump()}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
-            )
+    if current_user is None:
+        try:
+            items = guest_carts.set_item(read_guest_cart(x_guest_cart), item.product_id, item.quantity)
+        except GuestCartError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"message": "Item added to cart", "guest_cart": guest_carts.encode(items)}
     
+    await cart_store.add_item(current_user.id, item.model_dump())
     return {"message": "Item added to cart"}
 
 @api_router.delete("/cart/items/{product_id}")
-async def remove_from_cart(product_id: str, current_user: User = Depends(get_current_user)):
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$pull": {"items": {"product_id": product_id}}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+async def remove_from_cart(product_id: str, current_user: Optional[User] = Depends(get_optional_user),
+                           x_guest_cart: Optional[str] = Header(None)):
+    if current_user is None:
+        items = read_guest_cart(x_guest_cart)
+        items.pop(product_id, None)
+        return {"message": "Item removed from cart", "guest_cart": guest_carts.encode(items)}
+    await cart_store.remove_item(current_user.id, product_id)
     return {"message": "Item removed from cart"}
 
 @api_router.delete("/cart")
-async def clear_cart(current_user: User = Depends(get_current_user)):
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": [], "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+async def clear_cart(current_user: Optional[User] = Depends(get_optional_user)):
+    if current_user is None:
+        return {"message": "Cart cleared", "guest_cart": guest_carts.encode({})}
+    await cart_store.clear(current_user.id)
     return {"message": "Cart cleared"}
 
 # ============== ORDER ROUTES ==============
 
+async def publish_order_event(order: dict, event: str, key: Optional[str] = None):
+    await order_event_broker.publish(f"user:{order['user_id']}", event, {
+        "order_id": order['id'],
+        "status": order['status'],
+        "payment_status": order['payment_status'],
+        "total_amount": order['total_amount'],
+    }, key=key)
+
+ORDER_STREAM_EVENTS = {
+    "order.created": "order_created",
+    "order.paid": "payment_status",
+    "order.payment_failed": "payment_status",
+    "order.status_changed": "order_status",
+}
+
+async def stream_order_change(event: dict):
+    # Keyed by the outbox event id, so a stream hears of each change once
+    order = {**event["data"]["order"], **event["data"]["changes"]}
+    await publish_order_event(order, ORDER_STREAM_EVENTS[event["type"]], key=event["id"])
+
+async def announce_order_change(event: dict):
+    # Called by the worker that stored the change, so shoppers hear about it
+    # without waiting for the relay; the broker's backend is what reaches
+    # streams on the other workers (EVENT_BROADCAST_BACKEND=mongo). The change
+    # is already stored, so a failure here is only logged: the relay publishes
+    # the same event again, at least once.
+    outbox.notify()
+    try:
+        await stream_order_change(event)
+    except Exception:
+        logger.exception(f"Failed to announce {event['type']} {event['id']}")
+
+def order_event(event_type: str, order: dict, **changes) -> dict:
+    # Carries the order as it was before the change, and the change
+    snapshot = {k: v for k, v in order.items() if k not in ("_id", OUTBOX_FIELD)}
+    return Outbox.event(event_type, order=snapshot, changes=changes)
+
 @api_router.post("/orders")
-async def create_order(current_user: User = Depends(get_current_user)):
+async def create_order(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    admission_pass: Optional[str] = Header(None, alias="X-Admission-Pass")
+):
+    # One pass per flash-sale product, comma separated
+    admission_passes = [p.strip() for p in (admission_pass or "").split(",") if p.strip()]
+    if idempotency_key is not None:
+        return await idempotency_store.execute(
+            idempotency_key, "orders.create", current_user.id,
+            request_fingerprint(request), lambda: place_order(current_user, admission_passes)
+        )
+    return await place_order(current_user, admission_passes)
+
+async def place_order(current_user: User, admission_passes: List[str] = ()):
     # Get user's cart
     cart = await db.carts.find_one({"user_id": current_user.id})
     if not cart or not cart.get('items'):
         raise HTTPException(status_code=400, detail="Cart is empty")
     
+    # Flash-sale products are only checked out through the waiting room
+    queued = [item['product_id'] for item in cart['items'] if waiting_room.is_active(item['product_id'])]
+    
     # Calculate total and prepare order items
     order_items = []
     total_amount = 0.0
     
-    for cart_item in cart['items']:
-        product = await db.products.find_one({"id": cart_item['product_id']})
+    products = await product_loader.load_many(item['product_id'] for item in cart['items'])
+    for cart_item, product in zip(cart['items'], products):
         if not product:
             continue
         
-        if product['stock'] < cart_item['quantity']:
+        if await inventory.available(product) < cart_item['quantity']:
             raise HTTPException(status_code=400, detail=f"Insufficient stock for {product['name']}")
         
         order_item = OrderItem(
@@ -387,6 +871,14 @@ async def create_order(current_user: User = Depends(get_current_user)):
         order_items.append(order_item)
         total_amount += product['price'] * cart_item['quantity']
     
+    if queued:
+        try:
+            await waiting_room.consume(queued, current_user.id, admission_passes)
+        except WaitingRoomError as e:
+            # No pass is used unless all are, and 409 releases the Idempotency-Key, so the
+            # same checkout can be retried once every pass is valid
+            raise HTTPException(status_code=409, detail={"message": str(e), "waiting_room": queued})
+    
     # Create order
     order = Order(
         user_id=current_user.id,
@@ -398,50 +890,355 @@ async def create_order(current_user: User = Depends(get_current_user)):
     
     order_dict = order.model_dump()
     order_dict['created_at'] = order_dict['created_at'].isoformat()
+    event = order_event("order.created", order_dict)
+    order_dict[OUTBOX_FIELD] = [event]
     
     await db.orders.insert_one(order_dict)
+    await announce_order_change(event)
     
     return order
 
+def summarize_order(order: dict) -> dict:
+    # Archive index entries carry item_count instead of the line items
+    return {"item_count": len(order.get("items", [])), **order}
+
+# Summaries read only the quantities of the line items, to count them
+order_fields = FieldSets(
+    Order, OrderSummary,
+    summary_projection={"_id": 0, **{name: 1 for name in OrderSummary.model_fields if name != "item_count"},
+                        "items.quantity": 1},
+    prepare_summary=summarize_order,
+)
+
+async def find_user_order(order_id: str, user_id: str) -> Optional[dict]:
+    # Hot collection first, then the archive for old delivered orders
+    order = await db.orders.find_one({"id": order_id, "user_id": user_id}, {"_id": 0, OUTBOX_FIELD: 0})
+    if order is None:
+        order = await order_archive.find(order_id, user_id)
+    return order
+
 @api_router.get("/orders", response_model=List[Order])
-async def get_orders(current_user: User = Depends(get_current_user)):
-    orders = await db.orders.find({"user_id": current_user.id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return orders
+async def get_orders(current_user: User = Depends(get_current_user), view: str = "full",
+                     fields: Optional[str] = None):
+    selection = select_fields(order_fields, view, fields)
+    projection = selection.projection
+    if any(value == 1 for value in projection.values()):
+        # Inclusion projections (fields=) still need created_at for the merge below
+        projection = {**projection, "created_at": 1}
+    orders = await db.orders.find({"user_id": current_user.id}, projection).sort("created_at", -1).to_list(1000)
+    # Only delivered orders are archived, so older pending/shipped/cancelled ones
+    # stay hot: merge both newest first on the archive index entries, cut at the
+    # limit, and read segments only for the archived rows that survive the cut
+    hot = {order["id"] for order in orders}
+    # Orders caught between indexing and deletion are still hot; list them once
+    entries = [entry for entry in await order_archive.list_entries(current_user.id, 1000) if entry["id"] not in hot]
+    rows = sorted(orders + entries, key=lambda order: order["created_at"], reverse=True)[:1000]
+    if selection.key == "summary":
+        needed = set(OrderSummary.model_fields)
+    elif selection.key.startswith("fields="):
+        needed = set(projection) - {"_id"}
+    else:
+        needed = None  # the full view needs the line items and address
+    to_load = [row for row in rows if row["id"] not in hot and (needed is None or not needed <= row.keys())]
+    loaded = await order_archive.load(to_load)
+    load_ids = {row["id"] for row in to_load}
+    orders = [loaded.get(row["id"]) if row["id"] in load_ids else row for row in rows]
+    return Response(selection.render([order for order in orders if order is not None]), media_type="application/json")
+
+@api_router.post("/orders/events/ticket")
+async def create_order_events_ticket(current_user: User = Depends(get_current_user)):
+    return {"ticket": create_stream_ticket(current_user.id), "expires_in": settings.stream_ticket_expire_seconds}
+
+@api_router.get("/orders/events")
+async def stream_order_events(request: Request, ticket: str, last_event_id: Optional[str] = None):
+    user_id = verify_stream_ticket(ticket)
+    # Browsers send Last-Event-ID on automatic reconnects; manual reconnects pass it as a query param
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    return StreamingResponse(
+        sse_stream(order_event_broker, f"user:{user_id}", request, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str, current_user: User = Depends(get_current_user)):
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0})
+    order = await find_user_order(order_id, current_user.id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     return order
 
 # Admin: Get all orders
 @api_router.get("/admin/orders", response_model=List[Order])
-async def get_all_orders(admin: User = Depends(get_admin_user)):
-    orders = await db.orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return orders
+async def get_all_orders(admin: User = Depends(get_admin_user), view: str = "full", fields: Optional[str] = None):
+    selection = select_fields(order_fields, view, fields)
+    orders = await db.orders.find({}, selection.projection).sort("created_at", -1).to_list(1000)
+    return Response(selection.render(orders), media_type="application/json")
+
+# Admin: Connection pool telemetry
+@api_router.get("/admin/db/pool")
+async def get_pool_stats(admin: User = Depends(get_admin_user)):
+    return pool_stats.snapshot()
+
+# Admin: Order status counters and daily revenue (from the order event log)
+@api_router.get("/admin/orders/stats")
+async def get_order_stats(days: Optional[int] = None, admin: User = Depends(get_admin_user)):
+    status_counts = await order_log.status_counts()
+    revenue_by_day = await order_log.revenue_by_day(days)
+    return {
+        "status_counts": status_counts,
+        "total_orders": sum(status_counts.values()),
+        "total_revenue": round(sum(r["revenue"] for r in revenue_by_day), 2),
+        "revenue_by_day": revenue_by_day,
+    }
+
+# Admin: Move old delivered orders to cold storage now
+@api_router.post("/admin/carts/compact")
+async def compact_carts(admin: User = Depends(get_admin_user)):
+    return await cart_store.compact()
+
+@api_router.post("/admin/orders/archive")
+async def archive_orders(admin: User = Depends(get_admin_user)):
+    archived = await order_archive.archive_once()
+    return {"archived": archived}
+
+# Admin: Sales analytics
+@api_router.get("/admin/analytics/summary")
+async def get_sales_summary(months: int = 12, admin: User = Depends(get_admin_user)):
+    return await sales_analytics.report("summary", months=max(1, min(months, 120)))
+
+@api_router.get("/admin/analytics/cohorts")
+async def get_sales_cohorts(months: int = 12, admin: User = Depends(get_admin_user)):
+    return await sales_analytics.report("cohorts", months=max(1, min(months, 120)))
+
+@api_router.get("/admin/analytics/rfm")
+async def get_sales_rfm(top: int = 20, admin: User = Depends(get_admin_user)):
+    return await sales_analytics.report("rfm", top=max(0, min(top, 500)))
+
+@api_router.get("/admin/analytics/velocity")
+async def get_sales_velocity(days: int = 30, limit: int = 50, admin: User = Depends(get_admin_user)):
+    return await sales_analytics.report("velocity", days=max(1, min(days, 365)), limit=max(1, min(limit, 500)))
+
+@api_router.get("/admin/analytics/categories")
+async def get_sales_categories(days: Optional[int] = None, admin: User = Depends(get_admin_user)):
+    return await sales_analytics.report("categories", days=max(1, min(days, 3650)) if days else None)
+
+# Admin: Export orders, products and reviews as Parquet/Arrow files
+@api_router.post("/admin/exports")
+async def start_analytics_export(
+    datasets: str = "order_items,products,reviews",
+    full: bool = False,
+    format: str = "parquet",
+    admin: User = Depends(get_admin_user)
+):
+    if not analytics_exporter.available():
+        raise HTTPException(status_code=503, detail="Analytics exports are not available (pyarrow is not installed)")
+    try:
+        run = await analytics_exporter.start_run([d.strip() for d in datasets.split(",") if d.strip()], full, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return run
+
+@api_router.get("/admin/exports")
+async def list_analytics_exports(admin: User = Depends(get_admin_user)):
+    return {
+        "runs": await analytics_exporter.list_runs(),
+        "watermarks": await analytics_exporter.watermarks(),
+    }
+
+@api_router.get("/admin/exports/{run_id}")
+async def get_analytics_export(run_id: str, admin: User = Depends(get_admin_user)):
+    run = await analytics_exporter.get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return run
+
+# Admin: Tail the order event log from an offset
+@api_router.get("/admin/order-events")
+async def get_order_events(after: int = 0, limit: int = 100, admin: User = Depends(get_admin_user)):
+    events = await order_log.read(after, max(1, min(limit, 1000)))
+    next_offset = events[-1]["seq"] if events else after
+    return {"events": events, "next_offset": next_offset}
 
 # Admin: Update order status
 @api_router.patch("/admin/orders/{order_id}")
 async def update_order_status(order_id: str, status: str, admin: User = Depends(get_admin_user)):
-    await db.orders.update_one({"id": order_id}, {"$set": {"status": status}})
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    validate_transition(order['status'], status)
+    
+    # Only apply if nobody changed the status in the meantime
+    event = order_event("order.status_changed", order, status=status)
+    result = await db.orders.update_one(
+        {"id": order_id, "status": order['status']}, with_events({"$set": {"status": status}}, event)
+    )
+    if result.modified_count == 0:
+        raise HTTPException(status_code=409, detail="Order was modified concurrently, please retry")
+    await announce_order_change(event)
     return {"message": "Order status updated"}
 
+# ============== WAITING ROOM ROUTES ==============
+
+@api_router.post("/waiting-room/{product_id}")
+async def join_waiting_room(product_id: str, current_user: User = Depends(get_current_user)):
+    try:
+        result = await waiting_room.join(product_id, current_user.id)
+    except WaitingRoomError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if result["status"] == "sold_out":
+        raise HTTPException(status_code=410, detail="Sold out")
+    return result
+
+# Polled by waiting shoppers: the ticket is the credential, and only admission touches the database
+@api_router.get("/waiting-room/{product_id}")
+async def get_waiting_room_status(product_id: str, ticket: str):
+    try:
+        result = await waiting_room.status(product_id, ticket)
+    except WaitingRoomError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result["status"] == "sold_out":
+        raise HTTPException(status_code=410, detail="Sold out")
+    return JSONResponse(result, headers={"Cache-Control": "no-store"})
+
+# Admin: Flash sales
+@api_router.get("/admin/flash-sales")
+async def list_flash_sales(admin: User = Depends(get_admin_user)):
+    return {"sales": waiting_room.list_sales(), "stats": waiting_room.stats}
+
+@api_router.put("/admin/flash-sales/{product_id}")
+async def enable_flash_sale(product_id: str, sale: FlashSaleUpdate, admin: User = Depends(get_admin_user)):
+    if not await db.products.find_one({"id": product_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    return await waiting_room.enable(product_id, sale.admit_rate)
+
+@api_router.delete("/admin/flash-sales/{product_id}")
+async def disable_flash_sale(product_id: str, admin: User = Depends(get_admin_user)):
+    if not await waiting_room.disable(product_id):
+        raise HTTPException(status_code=404, detail="Flash sale not found")
+    return {"message": "Flash sale ended"}
+
+# ============== ADMIN USER ROUTES ==============
+
+@api_router.patch("/admin/users/{user_id}")
+async def update_user_role(user_id: str, is_admin: bool, admin: User = Depends(get_admin_user)):
+    result = await db.users.update_one({"id": user_id}, {"$set": {"is_admin": is_admin}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not is_admin:
+        # Sessions opened as admin end now; the user logs in again with the new role
+        await token_revocations.revoke_user(user_id, timedelta(minutes=settings.access_token_expire_minutes))
+    await change_listener.notify("users", "update", user_id, updated_fields=["is_admin"])
+    return {"message": "User role updated"}
+
+@api_router.get("/admin/inventory/stats")
+async def get_inventory_stats(admin: User = Depends(get_admin_user)):
+    return {**inventory.stats, "sharded_products": inventory.sharded_products}
+
+@api_router.get("/admin/auth/revocations")
+async def get_revocation_stats(admin: User = Depends(get_admin_user)):
+    return token_revocations.stats
+
 # ============== PAYMENT ROUTES ==============
-# Note: Stripe payment routes removed - using mock checkout instead
-# All Stripe integration code has been disabled
+# Payments are asynchronous (see payments.py): starting one answers 202 with
+# the transaction, and the order becomes paid when the gateway's webhook
+# confirms the charge, which reaches the shopper over the order events stream.
+
+@api_router.post("/orders/{order_id}/payments", status_code=202, response_model=PaymentTransaction)
+async def start_payment(
+    order_id: str,
+    request: Request,
+    payment: Optional[PaymentCreate] = None,
+    current_user: User = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    payment = payment or PaymentCreate()
+    if idempotency_key is not None:
+        # A retried request gets the same transaction back, even after it failed and a new one was started
+        body = json.dumps(payment.model_dump(exclude_none=True), sort_keys=True).encode()
+        return await idempotency_store.execute(
+            idempotency_key, "orders.payment", current_user.id, request_fingerprint(request, body),
+            lambda: begin_payment(order_id, payment, current_user), status_code=202
+        )
+    return await begin_payment(order_id, payment, current_user)
 
-# Old Stripe endpoints (now disabled):
-# - POST /checkout (Stripe session creation)
-# - GET /checkout/status/{session_id} (Payment status check)
-# - POST /webhook/stripe (Stripe webhook handler)
+async def begin_payment(order_id: str, payment: PaymentCreate, current_user: User) -> PaymentTransaction:
+    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0, OUTBOX_FIELD: 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order['payment_status'] == 'paid':
+        raise HTTPException(status_code=400, detail="Order already paid")
+    validate_transition(order['status'], "processing")
+
+    if order['payment_status'] == 'failed':
+        # Paying again after a declined charge
+        await db.orders.update_one({"id": order_id, "payment_status": "failed"},
+                                   {"$set": {"payment_status": "pending"}})
+    return PaymentTransaction(**await payment_processor.create(order, payment.model_dump(exclude_none=True)))
+
+@api_router.get("/payments/{transaction_id}", response_model=PaymentTransaction)
+async def get_payment(transaction_id: str, current_user: User = Depends(get_current_user)):
+    txn = await payment_processor.get(transaction_id)
+    if not txn or (txn['user_id'] != current_user.id and not current_user.is_admin):
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return txn
+
+@api_router.post("/payments/webhook")
+async def payment_webhook(request: Request):
+    # Anything but a 2xx makes the gateway deliver the event again
+    try:
+        await payment_processor.handle_webhook(await request.body(), request.headers.get(SIGNATURE_HEADER))
+    except WebhookError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"received": True}
+
+@api_router.get("/admin/payments/stats")
+async def get_payment_stats(admin: User = Depends(get_admin_user)):
+    stats = dict(payment_processor.stats)
+    if payment_simulator is not None:
+        stats["simulator"] = payment_simulator.stats
+    return stats
+
+async def confirm_order_payment(txn: dict):
+    order = await db.orders.find_one({"id": txn['order_id']}, {"_id": 0, OUTBOX_FIELD: 0})
+    if not order or order['payment_status'] == 'paid':
+        return
+    try:
+        validate_transition(order['status'], "processing")
+    except HTTPException:
+        logger.warning(f"Payment {txn['id']} captured for order {order['id']} in status {order['status']}, "
+                       f"it needs a refund")
+        return
+
+    # Update order status; the filter makes sure a redelivered webhook can't apply twice.
+    # Stock, cart and notifications follow from the order.paid event.
+    changes = {"payment_status": "paid", "status": "processing"}
+    event = order_event("order.paid", order, **changes)
+    result = await db.orders.update_one(
+        {"id": order['id'], "payment_status": {"$ne": "paid"}, "status": order['status']},
+        with_events({"$set": changes}, event)
+    )
+    if result.modified_count:
+        await announce_order_change(event)
+
+async def record_payment_failure(txn: dict):
+    order = await db.orders.find_one({"id": txn['order_id']}, {"_id": 0, OUTBOX_FIELD: 0})
+    if not order:
+        return
+    event = order_event("order.payment_failed", order, payment_status="failed")
+    result = await db.orders.update_one(
+        {"id": order['id'], "payment_status": "pending"}, with_events({"$set": {"payment_status": "failed"}}, event)
+    )
+    if result.modified_count:
+        await announce_order_change(event)
 
 # ============== REVIEW ROUTES ==============
 
 @api_router.post("/reviews")
 async def create_review(review_data: ReviewCreate, current_user: User = Depends(get_current_user)):
     # Check if product exists
-    product = await db.products.find_one({"id": review_data.product_id})
+    product = await product_loader.load(review_data.product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -465,23 +1262,40 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
     review_dict = review.model_dump()
     review_dict['created_at'] = review_dict['created_at'].isoformat()
     
-    await db.reviews.insert_one(review_dict)
-    
-    # Update product rating
-    all_reviews = await db.reviews.find({"product_id": review_data.product_id}).to_list(1000)
-    avg_rating = sum(r['rating'] for r in all_reviews) / len(all_reviews)
-    
-    await db.products.update_one(
-        {"id": review_data.product_id},
-        {"$set": {"rating": round(avg_rating, 1), "reviews_count": len(all_reviews)}}
-    )
+    # Also updates the product rating and top reviews
+    if not await review_store.add(review_dict):
+        raise HTTPException(status_code=400, detail="You have already reviewed this product")
+    await change_listener.notify("products", "update", review_data.product_id,
+                                 updated_fields=["rating", "reviews_count"])
     
     return review
 
-@api_router.get("/reviews/{product_id}", response_model=List[Review])
-async def get_reviews(product_id: str):
-    reviews = await db.reviews.find({"product_id": product_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return reviews
+@api_router.get("/reviews/{product_id}", response_model=ReviewPage)
+async def get_reviews(product_id: str, sort: str = "newest", limit: int = 10, cursor: Optional[str] = None):
+    if sort not in REVIEW_SORTS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of: {', '.join(REVIEW_SORTS)}")
+    limit = max(1, min(limit, 50))
+    try:
+        reviews, next_cursor = await review_store.page(product_id, sort, limit, cursor)
+    except ReviewCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"reviews": reviews, "next_cursor": next_cursor}
+
+@api_router.post("/reviews/{review_id}/helpful", response_model=Review)
+async def vote_review_helpful(review_id: str, current_user: User = Depends(get_current_user)):
+    review = await db.reviews.find_one({"id": review_id}, {"_id": 0, "user_id": 1})
+    if not review:
+        raise HTTPException(status_code=404, detail="Review not found")
+    if review['user_id'] == current_user.id:
+        raise HTTPException(status_code=400, detail="You can't vote on your own review")
+    return await review_store.vote(review_id, current_user.id, helpful=True)
+
+@api_router.delete("/reviews/{review_id}/helpful", response_model=Review)
+async def withdraw_review_vote(review_id: str, current_user: User = Depends(get_current_user)):
+    review = await review_store.vote(review_id, current_user.id, helpful=False)
+    if review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    return review
 
 # ============== AI RECOMMENDATION ROUTES ==============
 # Note: AI recommendations feature removed (emergentintegrations uninstalled)
@@ -491,7 +1305,7 @@ async def get_reviews(product_id: str):
 @api_router.get("/orders/{order_id}/receipt")
 async def get_receipt(order_id: str, current_user: User = Depends(get_current_user)):
     # Get order details
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0})
+    order = await find_user_order(order_id, current_user.id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -500,119 +1314,15 @@ async def get_receipt(order_id: str, current_user: User = Depends(get_current_us
 @api_router.get("/orders/{order_id}/receipt/pdf")
 async def download_receipt_pdf(order_id: str, current_user: User = Depends(get_current_user)):
     # Get order details
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0})
+    order = await find_user_order(order_id, current_user.id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     # Get user details
     user = await db.users.find_one({"id": current_user.id}, {"_id": 0})
     
-    # Generate PDF using reportlab
-    pdf_buffer = BytesIO()
-    doc = SimpleDocTemplate(pdf_buffer, pagesize=letter)
-    story = []
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#0ea5e9'),
-        alignment=TA_CENTER,
-        spaceAfter=30
-    )
-    
-    # Company name and title
-    story.append(Paragraph("ApplianceHub", title_style))
-    story.append(Paragraph("ORDER RECEIPT", styles['Heading2']))
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Order info
-    order_date = datetime.fromisoformat(order['created_at']).strftime('%B %d, %Y %I:%M %p')
-    info_data = [
-        ['Order ID:', order['id'][:8].upper()],
-        ['Date:', order_date],
-        ['Customer:', user['name']],
-        ['Email:', user['email']],
-        ['Payment Status:', order['payment_status'].upper()]
-    ]
-    
-    info_table = Table(info_data, colWidths=[2*inch, 4*inch])
-    info_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#64748b')),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-    ]))
-    story.append(info_table)
-    story.append(Spacer(1, 0.5*inch))
-    
-    # Items table
-    items_data = [['Product', 'Qty', 'Price', 'Total']]
-    for item in order['items']:
-        item_total = item['price'] * item['quantity']
-        items_data.append([
-            item['product_name'],
-            str(item['quantity']),
-            f"₱{item['price']:.2f}",
-            f"₱{item_total:.2f}"
-        ])
-    
-    items_table = Table(items_data, colWidths=[3*inch, 0.8*inch, 1.2*inch, 1.2*inch])
-    items_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0ea5e9')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.white),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('TOPPADDING', (0, 1), (-1, -1), 8),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
-    ]))
-    story.append(items_table)
-    story.append(Spacer(1, 0.3*inch))
-    
-    # Totals
-    totals_data = [
-        ['Subtotal:', f"₱{order['total_amount']:.2f}"],
-        ['Shipping:', 'FREE'],
-        ['', ''],
-        ['TOTAL:', f"₱{order['total_amount']:.2f}"]
-    ]
-    
-    totals_table = Table(totals_data, colWidths=[5*inch, 1.2*inch])
-    totals_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (0, 1), 'Helvetica'),
-        ('FONTNAME', (0, 3), (0, 3), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 2), 10),
-        ('FONTSIZE', (0, 3), (-1, 3), 14),
-        ('TEXTCOLOR', (0, 3), (-1, 3), colors.HexColor('#0ea5e9')),
-        ('LINEABOVE', (0, 3), (-1, 3), 2, colors.HexColor('#0ea5e9')),
-        ('TOPPADDING', (0, 3), (-1, 3), 10),
-    ]))
-    story.append(totals_table)
-    story.append(Spacer(1, 0.5*inch))
-    
-    # Footer
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=9,
-        textColor=colors.HexColor('#94a3b8'),
-        alignment=TA_CENTER
-    )
-    story.append(Paragraph("Thank you for shopping with ApplianceHub!", footer_style))
-    story.append(Paragraph("For questions or support, please contact us at support@appliancehub.com", footer_style))
-    
-    # Build PDF
-    doc.build(story)
-    pdf_buffer.seek(0)
+    # Rendering is CPU-bound; keep it off the event loop
+    pdf_buffer = await asyncio.to_thread(receipts.build_receipt_pdf, order, user)
     
     return StreamingResponse(
         pdf_buffer,
@@ -623,52 +1333,72 @@ async def download_receipt_pdf(order_id: str, current_user: User = Depends(get_c
 @api_router.post("/orders/{order_id}/email-receipt")
 async def email_receipt(order_id: str, current_user: User = Depends(get_current_user)):
     # Get order details
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id}, {"_id": 0})
+    order = await find_user_order(order_id, current_user.id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Note: Email functionality would require SMTP configuration
-    # For now, we'll return success and log the action
-    logger.info(f"Email receipt requested for order {order_id} by user {current_user.email}")
+    # Sent by the outbox relay; the request only records it on the user
+    await db.users.update_one(
+        {"id": current_user.id},
+        with_events({}, Outbox.event("receipt.requested", order_id=order_id, email=current_user.email))
+    )
+    outbox.notify()
     
     return {
-        "message": "Receipt email sent successfully!",
+        "message": "Receipt email queued",
         "email": current_user.email,
         "order_id": order_id
     }
 
-# ============== MOCK PAYMENT ROUTE ==============
+# ============== OUTBOX SUBSCRIBERS ==============
+# Run by the outbox relay after the order change is stored, at least once
+# and in order per order
+
+async def log_order_event(event: dict):
+    # The log keys events by order and transition, so a redelivery is appended once
+    order, changes = event["data"]["order"], event["data"]["changes"]
+    if event["type"] == "order.created":
+        await order_log.order_created(order)
+    elif event["type"] == "order.paid":
+        await order_log.order_paid(order, changes["status"])
+    else:
+        await order_log.status_changed(order, changes["status"])
 
-@api_router.patch("/orders/{order_id}/mock-payment")
-async def mock_payment(order_id: str, current_user: User = Depends(get_current_user)):
-    # Get order
-    order = await db.orders.find_one({"id": order_id, "user_id": current_user.id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    if order['payment_status'] == 'paid':
-        return {"message": "Order already paid"}
-    
-    # Update order status
-    await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"payment_status": "paid", "status": "processing"}}
-    )
-    
-    # Update product stock
-    for item in order['items']:
-        await db.products.update_one(
-            {"id": item['product_id']},
-            {"$inc": {"stock": -item['quantity']}}
-        )
-    
-    # Clear user's cart
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": {"items": [], "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
-    
-    return {"message": "Payment successful", "order_id": order_id}
+async def invalidate_order_caches(event: dict):
+    # The change listener reaches the other workers itself (invalidation log or change stream)
+    order_id = event["data"]["order"]['id']
+    if event["type"] == "order.created":
+        await change_listener.notify("orders", "insert", order_id)
+    else:
+        await change_listener.notify("orders", "update", order_id, updated_fields=list(event["data"]["changes"]))
+
+async def decrement_paid_stock(event: dict):
+    # Keyed on the event, so a redelivery or a retry after a failed item doesn't take stock twice
+    for item in event["data"]["order"]['items']:
+        await inventory.decrement_once(event["id"], item['product_id'], item['quantity'])
+
+async def clear_paid_cart(event: dict):
+    # Only the paid items: the shopper may have filled the cart again since
+    order = event["data"]["order"]
+    await cart_store.remove_ordered(order['user_id'], order['items'])
+
+async def send_receipt_email(event: dict):
+    # Note: Email functionality would require SMTP configuration; for now the send is logged
+    logger.info(f"Email receipt for order {event['data']['order_id']} sent to {event['data']['email']}")
+
+@api_router.get("/admin/outbox/stats")
+async def get_outbox_stats(admin: User = Depends(get_admin_user)):
+    stats = {**outbox.stats, "pending": await outbox.pending()}
+    if outbox_broker is not None:
+        stats["broker"] = outbox_broker.stats
+    return stats
+
+@api_router.get("/admin/outbox/broker/{topic}")
+async def read_outbox_broker(topic: str, after: int = 0, limit: int = 100, admin: User = Depends(get_admin_user)):
+    if outbox_broker is None:
+        raise HTTPException(status_code=404, detail="The local broker is not enabled")
+    messages = outbox_broker.read(topic, after, max(1, min(limit, 1000)))
+    return {"messages": messages, "next_offset": messages[-1]["offset"] if messages else after}
 
 # ============== GENERAL ROUTES ==============
 
@@ -676,16 +1406,18 @@ async def mock_payment(order_id: str, current_user: User = Depends(get_current_u
 async def root():
     return {"message": "Appliance Shop API"}
 
-# Include router
-app.include_router(api_router)
+# ============== HEALTH ROUTES ==============
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@health_router.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and serving requests
+    return {"status": "ok"}
+
+@health_router.get("/readyz")
+async def readyz():
+    # Readiness: load balancers drain this worker while it returns 503
+    readiness = await check_readiness(client, mongo_settings, pool_stats)
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
 
 # Configure logging
 logging.basicConfig(
@@ -694,6 +1426,120 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# ============== STARTUP / SHUTDOWN ==============
+
+async def build_similarity_index():
+    products = await db.products.find({}, {"_id": 0}).to_list(None)
+    similarity_index.rebuild(products)
+    logger.info(f"Similarity index built for {len(similarity_index)} products")
+
+async def refresh_similarity_index(event: ChangeEvent):
+    if event.operation == INVALIDATE_ALL:
+        await build_similarity_index()
+    elif event.operation == "delete":
+        similarity_index.remove(event.document_id)
+    elif event.touches(INDEXED_FIELDS):
+        product = event.document or await db.products.find_one({"id": event.document_id}, {"_id": 0})
+        if product:
+            similarity_index.upsert(product)
+
+async def startup(application: FastAPI):
+    await rate_limiter.backend.ensure_indexes()
+    await idempotency_store.ensure_indexes()
+    await cart_store.ensure_indexes()
+    await token_revocations.ensure_indexes()
+    await review_store.ensure_indexes()
+    await token_revocations.start()
+    application.state.cart_compaction_task = asyncio.create_task(cart_store.compact_in_background())
+    await build_similarity_index()
+    await change_listener.start()
+    await order_event_broker.start()
+    await order_log.start()
+
+    await order_archive.ensure_indexes()
+    if settings.order_archive_interval_hours > 0:
+        application.state.order_archive_task = asyncio.create_task(
+            order_archive.run_forever(settings.order_archive_interval_hours)
+        )
+
+    await analytics_exporter.ensure_indexes()
+    if settings.analytics_export_interval_hours > 0 and analytics_exporter.available():
+        application.state.analytics_export_task = asyncio.create_task(
+            analytics_exporter.run_forever(settings.analytics_export_interval_hours)
+        )
+
+    await catalog_publisher.start()
+    await inventory.ensure_indexes()
+    await inventory.start()
+    await waiting_room.ensure_indexes()
+    await waiting_room.start()
+    await stock_feed.start()
+    await payment_processor.ensure_indexes()
+    await payment_processor.start()
+    await outbox.ensure_indexes()
+    await outbox.start()
+
+    # Last, so deferred imports load in the background while the worker already serves
+    if settings.prewarm_imports:
+        application.state.prewarm_task = asyncio.create_task(asyncio.to_thread(prewarm))
+
+async def shutdown(application: FastAPI):
+    await token_revocations.stop()
+    await change_listener.stop()
+    await order_event_broker.stop()
+    await stock_feed.stop()
+    await inventory.stop()
+    await catalog_publisher.stop()
+    await waiting_room.stop()
+    await payment_processor.stop()
+    await outbox.stop()
+    await order_log.stop()
+    if payment_simulator is not None:
+        await payment_simulator.stop()
+    for name in ('cart_compaction_task', 'order_archive_task', 'analytics_export_task'):
+        task = getattr(application.state, name, None)
+        if task:
+            task.cancel()
+    client.close()
+
+@asynccontextmanager
+async def lifespan(application: FastAPI):
+    await startup(application)
+    yield
+    await shutdown(application)
+
+# ============== APP FACTORY ==============
+
+def create_app(app_settings: Optional[Settings] = None, database=None) -> FastAPI:
+    """Build the application.
+
+    Without arguments everything comes from the environment, as for
+    `uvicorn server:app`. Tests pass their own Settings and a database such
+    as memory_db.MemoryClient()["test"] to run the API in-process. Services
+    are module-level, so one process serves one app at a time.
+    """
+    configure(app_settings or Settings.from_env(), database)
+    application = FastAPI(lifespan=lifespan)
+    application.include_router(api_router)
+    application.include_router(health_router)
+    if payment_simulator is not None:
+        # The simulator's webhooks come back to this app in-process
+        payment_simulator.webhook_app = application
+    application.add_middleware(CompressionMiddleware, minimum_size=settings.compression_min_size)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return application
+
+def __getattr__(name):
+    # `server:app` is built from the environment on first access, so importing
+    # this module (tests, scripts) neither reads MONGO_URL nor connects
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
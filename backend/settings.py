@@ -0,0 +1,123 @@
+import os
+import socket
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+
+from database import MongoSettings
+
+# Application settings. `Settings.from_env()` reads the deployment's
+# environment; tests construct `Settings(...)` directly and pass it to
+# `create_app` together with an injected database.
+
+ROOT_DIR = Path(__file__).parent
+
+
+def _flag(name: str, default: str) -> bool:
+    return os.environ.get(name, default).lower() == 'true'
+
+
+@dataclass
+class Settings:
+    mongo: MongoSettings = field(default_factory=lambda: MongoSettings(url='mongodb://localhost:27017',
+                                                                       db_name='appliancehub'))
+    jwt_secret: str = 'your-secret-key'
+    jwt_algorithm: str = 'HS256'
+    access_token_expire_minutes: int = 1440
+    # EventSource can't send headers, so streams authenticate with a short-lived ticket
+    stream_ticket_expire_seconds: int = 60
+    token_revocation_poll_interval: float = 2.0
+    compression_min_size: int = 1024
+    cors_origins: List[str] = field(default_factory=lambda: ['*'])
+    rate_limit_backend: str = 'memory'
+    rate_limit_policies: str = ''
+    rate_limit_trust_forwarded: bool = False
+    # Keys this process's change stream resume token; set WORKER_ID per worker to resume across restarts
+    worker_id: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}")
+    invalidation_mode: str = 'auto'
+    invalidation_poll_interval: float = 2.0
+    event_broadcast_backend: str = 'local'
+    stock_feed_interval: float = 1.0
+    stock_shard_count: int = 8
+    stock_promote_rate: float = 5.0
+    stock_demote_idle_seconds: float = 600
+    flash_sale_admit_rate: float = 10.0
+    flash_sale_pass_seconds: float = 300
+    # Empty gateway URL: use the in-process gateway simulator
+    payment_gateway_url: str = ''
+    payment_gateway_api_key: str = 'sim_key'
+    payment_gateway_max_connections: int = 100
+    payment_webhook_secret: str = 'your-webhook-secret'
+    payment_callback_url: str = ''
+    payment_workers: int = 8
+    payment_max_attempts: int = 5
+    payment_sim_latency: float = 0.2
+    payment_sim_settle_delay: float = 1.0
+    payment_sim_failure_rate: float = 0.0
+    payment_sim_decline_rate: float = 0.0
+    outbox_batch_size: int = 100
+    outbox_poll_interval: float = 1.0
+    # 'local' also forwards every outbox event to the in-memory broker stand-in
+    outbox_broker: str = 'none'
+    cart_ttl_days: float = 30
+    empty_cart_ttl_hours: float = 1
+    order_archive_dir: Path = ROOT_DIR / 'archive' / 'orders'
+    order_archive_min_age_days: int = 180
+    order_archive_interval_hours: float = 0
+    analytics_export_dir: Path = ROOT_DIR / 'exports'
+    catalog_snapshot_dir: Path = ROOT_DIR / 'catalog_snapshots'
+    catalog_publish_delay: float = 2.0
+    catalog_refresh_interval: float = 300
+    analytics_export_interval_hours: float = 0
+    prewarm_imports: bool = True
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        return cls(
+            mongo=MongoSettings.from_env(),
+            jwt_secret=os.environ.get('JWT_SECRET', 'your-secret-key'),
+            jwt_algorithm=os.environ.get('JWT_ALGORITHM', 'HS256'),
+            access_token_expire_minutes=int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 1440)),
+            stream_ticket_expire_seconds=int(os.environ.get('STREAM_TICKET_EXPIRE_SECONDS', 60)),
+            token_revocation_poll_interval=float(os.environ.get('TOKEN_REVOCATION_POLL_INTERVAL', 2.0)),
+            compression_min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+            cors_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+            rate_limit_backend=os.environ.get('RATE_LIMIT_BACKEND', 'memory'),
+            rate_limit_policies=os.environ.get('RATE_LIMIT_POLICIES', ''),
+            rate_limit_trust_forwarded=_flag('RATE_LIMIT_TRUST_FORWARDED', 'false'),
+            worker_id=os.environ.get('WORKER_ID', f"{socket.gethostname()}:{os.getpid()}"),
+            invalidation_mode=os.environ.get('INVALIDATION_MODE', 'auto'),
+            invalidation_poll_interval=float(os.environ.get('INVALIDATION_POLL_INTERVAL', 2.0)),
+            event_broadcast_backend=os.environ.get('EVENT_BROADCAST_BACKEND', 'local'),
+            stock_feed_interval=float(os.environ.get('STOCK_FEED_INTERVAL', 1.0)),
+            stock_shard_count=int(os.environ.get('STOCK_SHARD_COUNT', 8)),
+            stock_promote_rate=float(os.environ.get('STOCK_PROMOTE_RATE', 5.0)),
+            stock_demote_idle_seconds=float(os.environ.get('STOCK_DEMOTE_IDLE_SECONDS', 600)),
+            flash_sale_admit_rate=float(os.environ.get('FLASH_SALE_ADMIT_RATE', 10.0)),
+            flash_sale_pass_seconds=float(os.environ.get('FLASH_SALE_PASS_SECONDS', 300)),
+            payment_gateway_url=os.environ.get('PAYMENT_GATEWAY_URL', ''),
+            payment_gateway_api_key=os.environ.get('PAYMENT_GATEWAY_API_KEY', 'sim_key'),
+            payment_gateway_max_connections=int(os.environ.get('PAYMENT_GATEWAY_MAX_CONNECTIONS', 100)),
+            payment_webhook_secret=os.environ.get('PAYMENT_WEBHOOK_SECRET', 'your-webhook-secret'),
+            payment_callback_url=os.environ.get('PAYMENT_CALLBACK_URL', ''),
+            payment_workers=int(os.environ.get('PAYMENT_WORKERS', 8)),
+            payment_max_attempts=int(os.environ.get('PAYMENT_MAX_ATTEMPTS', 5)),
+            payment_sim_latency=float(os.environ.get('PAYMENT_SIM_LATENCY', 0.2)),
+            payment_sim_settle_delay=float(os.environ.get('PAYMENT_SIM_SETTLE_DELAY', 1.0)),
+            payment_sim_failure_rate=float(os.environ.get('PAYMENT_SIM_FAILURE_RATE', 0.0)),
+            payment_sim_decline_rate=float(os.environ.get('PAYMENT_SIM_DECLINE_RATE', 0.0)),
+            outbox_batch_size=int(os.environ.get('OUTBOX_BATCH_SIZE', 100)),
+            outbox_poll_interval=float(os.environ.get('OUTBOX_POLL_INTERVAL', 1.0)),
+            outbox_broker=os.environ.get('OUTBOX_BROKER', 'none'),
+            cart_ttl_days=float(os.environ.get('CART_TTL_DAYS', 30)),
+            empty_cart_ttl_hours=float(os.environ.get('EMPTY_CART_TTL_HOURS', 1)),
+            order_archive_dir=Path(os.environ.get('ORDER_ARCHIVE_DIR', ROOT_DIR / 'archive' / 'orders')),
+            order_archive_min_age_days=int(os.environ.get('ORDER_ARCHIVE_MIN_AGE_DAYS', 180)),
+            order_archive_interval_hours=float(os.environ.get('ORDER_ARCHIVE_INTERVAL_HOURS', 0)),
+            analytics_export_dir=Path(os.environ.get('ANALYTICS_EXPORT_DIR', ROOT_DIR / 'exports')),
+            analytics_export_interval_hours=float(os.environ.get('ANALYTICS_EXPORT_INTERVAL_HOURS', 0)),
+            catalog_snapshot_dir=Path(os.environ.get('CATALOG_SNAPSHOT_DIR', ROOT_DIR / 'catalog_snapshots')),
+            catalog_publish_delay=float(os.environ.get('CATALOG_PUBLISH_DELAY', 2.0)),
+            catalog_refresh_interval=float(os.environ.get('CATALOG_REFRESH_INTERVAL', 300)),
+            prewarm_imports=_flag('PREWARM_IMPORTS', 'true'),
+        )
@@ -0,0 +1,165 @@
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Hashed TF-IDF content index used for "similar products".
+# Every product is turned into a bag of tokens (name, description, features,
+# plus brand/category marker tokens), hashed into a fixed number of buckets
+# and stored as one row of a float32 matrix. Queries are a single matrix
+# product against the L2-normalised TF-IDF rows.
+
+# Product fields that feed the vectors; changes to anything else (stock,
+# rating) never require re-indexing
+INDEXED_FIELDS = ("name", "description", "features", "brand", "category")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOP_WORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "its", "of", "on", "or", "that", "the", "this", "to", "with", "your",
+})
+
+# Relative weight of each product field in the term-frequency vector
+FIELD_WEIGHTS = {
+    "name": 2.0,
+    "description": 1.0,
+    "features": 1.5,
+    "brand": 3.0,
+    "category": 4.0,
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOP_WORDS and len(t) > 1]
+
+
+def _bucket(token: str, n_features: int) -> int:
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(token.encode("utf-8")) % n_features
+
+
+class SimilarityIndex:
+    def __init__(self, n_features: int = 4096, initial_capacity: int = 256):
+        self.n_features = n_features
+        self._ids: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self._tf = np.zeros((initial_capacity, n_features), dtype=np.float32)
+        self._df = np.zeros(n_features, dtype=np.int32)
+        self._vectors: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self._rows
+
+    def _term_frequencies(self, product: dict) -> np.ndarray:
+        tf = np.zeros(self.n_features, dtype=np.float32)
+        fields = {
+            "name": tokenize(product.get("name", "")),
+            "description": tokenize(product.get("description", "")),
+            "features": [t for f in product.get("features", []) for t in tokenize(f)],
+            # Brand and category are matched as whole values, not per word
+            "brand": [f"brand:{product.get('brand', '').strip().lower()}"],
+            "category": [f"category:{product.get('category', '').strip().lower()}"],
+        }
+        for field, tokens in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokens:
+                tf[_bucket(token, self.n_features)] += weight
+        # Sublinear scaling keeps long descriptions from dominating
+        np.log1p(tf, out=tf)
+        return tf
+
+    def _grow(self):
+        grown = np.zeros((self._tf.shape[0] * 2, self.n_features), dtype=np.float32)
+        grown[:len(self._ids)] = self._tf[:len(self._ids)]
+        self._tf = grown
+
+    def upsert(self, product: dict):
+        tf = self._term_frequencies(product)
+        row = self._rows.get(product["id"])
+        if row is None:
+            if len(self._ids) == self._tf.shape[0]:
+                self._grow()
+            row = len(self._ids)
+            self._ids.append(product["id"])
+            self._rows[product["id"]] = row
+        else:
+            self._df -= (self._tf[row] > 0)
+        self._tf[row] = tf
+        self._df += (tf > 0)
+        self._vectors = None
+
+    def remove(self, product_id: str):
+        row = self._rows.pop(product_id, None)
+        if row is None:
+            return
+        self._df -= (self._tf[row] > 0)
+        # Move the last row into the freed slot to keep the matrix dense
+        last = len(self._ids) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._tf[row] = self._tf[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._tf[last] = 0
+        self._ids.pop()
+        self._vectors = None
+
+    def rebuild(self, products: Iterable[dict]):
+        products = list(products)
+        capacity = max(len(products), 1)
+        self._ids = [p["id"] for p in products]
+        self._rows = {pid: i for i, pid in enumerate(self._ids)}
+        self._tf = np.zeros((capacity, self.n_features), dtype=np.float32)
+        for i, product in enumerate(products):
+            self._tf[i] = self._term_frequencies(product)
+        self._df = np.count_nonzero(self._tf[:len(products)], axis=0).astype(np.int32)
+        self._vectors = None
+
+    def _normalized_vectors(self) -> np.ndarray:
+        # TF-IDF weighting is recomputed lazily after writes; the catalog is
+        # small enough that this is a single vectorised pass
+        if self._vectors is None:
+            n = len(self._ids)
+            idf = np.log((1 + n) / (1 + self._df.astype(np.float32))) + 1.0
+            vectors = self._tf[:n] * idf
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self._vectors = (vectors / norms).astype(np.float32)
+        return self._vectors
+
+    def similar_many(self, product_ids: List[str], k: int = 8) -> Dict[str, List[Dict]]:
+        """Return the top-k most similar products for each id in one matrix product."""
+        known = [pid for pid in product_ids if pid in self._rows]
+        results: Dict[str, List[Dict]] = {pid: [] for pid in product_ids}
+        n = len(self._ids)
+        if not known or n < 2:
+            return results
+
+        vectors = self._normalized_vectors()
+        query_rows = np.fromiter((self._rows[pid] for pid in known), dtype=np.int64, count=len(known))
+        scores = vectors[query_rows] @ vectors.T
+        # Never return the product itself
+        scores[np.arange(len(known)), query_rows] = -np.inf
+
+        k = min(k, n - 1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        for i, pid in enumerate(known):
+            results[pid] = [
+                {"product_id": self._ids[j], "score": round(float(s), 4)}
+                for j, s in zip(top[i], top_scores[i])
+                if s > 0
+            ]
+        return results
+
+    def similar(self, product_id: str, k: int = 8) -> List[Dict]:
+        return self.similar_many([product_id], k)[product_id]
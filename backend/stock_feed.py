@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Live stock and price updates for product pages.
+# Writers only mark product ids dirty; a flush loop coalesces every change
+# in an interval into one `$in` query, encodes each update once and hands
+# the same string to every subscriber of the product's channels. Each
+# connection keeps only the latest pending update per product, so a slow
+# client never queues more than one message per product it watches.
+
+logger = logging.getLogger(__name__)
+
+MAX_CHANNELS_PER_CONNECTION = 200
+
+STOCK_FIELDS = ("stock", "price")
+
+
+class StockSubscriber:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.channels: Set[str] = set()
+        self._pending: Dict[str, str] = {}
+        self._wakeup = asyncio.Event()
+
+    def offer(self, product_id: str, message: str):
+        # A newer update for the same product replaces one not yet sent
+        self._pending[product_id] = message
+        self._wakeup.set()
+
+    async def writer(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pending, self._pending = self._pending, {}
+            for message in pending.values():
+                await self.websocket.send_text(message)
+
+
+class StockFeed:
+    def __init__(self, db, interval: float = 1.0):
+        self.db = db
+        self.interval = interval
+        self._channels: Dict[str, Set[StockSubscriber]] = defaultdict(set)
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- change intake ----
+
+    def mark_changed(self, product_id: str):
+        self._dirty.add(product_id)
+
+    def mark_all(self):
+        self._dirty.update(c.split(":", 1)[1] for c in self._channels if c.startswith("product:"))
+
+    async def on_product_change(self, event):
+        """InvalidationBus handler, so changes made on other workers are pushed too."""
+        if event.operation == "invalidate_all":
+            self.mark_all()
+        elif event.document_id and (event.operation in ("insert", "delete") or event.touches(STOCK_FIELDS)):
+            self.mark_changed(event.document_id)
+
+    # ---- subscriptions ----
+
+    def subscribe(self, subscriber: StockSubscriber, channels: Iterable[str]):
+        for channel in channels:
+            if len(subscriber.channels) >= MAX_CHANNELS_PER_CONNECTION:
+                break
+            subscriber.channels.add(channel)
+            self._channels[channel].add(subscriber)
+
+    def unsubscribe(self, subscriber: StockSubscriber, channels: Optional[Iterable[str]] = None):
+        for channel in list(channels if channels is not None else subscriber.channels):
+            subscriber.channels.discard(channel)
+            members = self._channels.get(channel)
+            if members is not None:
+                members.discard(subscriber)
+                if not members:
+                    del self._channels[channel]
+
+    def connection_count(self) -> int:
+        return len({s for members in self._channels.values() for s in members})
+
+    # ---- fan-out ----
+
+    @staticmethod
+    def encode(product: dict) -> str:
+        return json.dumps({
+            "type": "stock",
+            "product_id": product["id"],
+            "stock": product["stock"],
+            "price": product["price"],
+        })
+
+    async def snapshot(self, subscriber: StockSubscriber, product_ids: Iterable[str]):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        products = await self.db.products.find(
+            {"id": {"$in": product_ids}}, {"_id": 0, "id": 1, "stock": 1, "price": 1}
+        ).to_list(len(product_ids))
+        for product in products:
+            subscriber.offer(product["id"], self.encode(product))
+
+    async def flush(self):
+        dirty, self._dirty = self._dirty, set()
+        if not dirty or not self._channels:
+            return
+        products = await self.db.products.find(
+            {"id": {"$in": list(dirty)}}, {"_id": 0, "id": 1, "stock": 1, "price": 1, "category": 1}
+        ).to_list(len(dirty))
+
+        found = set()
+        for product in products:
+            found.add(product["id"])
+            message = self.encode(product)
+            for channel in (f"product:{product['id']}", f"category:{product['category']}"):
+                for subscriber in self._channels.get(channel, ()):
+                    subscriber.offer(product["id"], message)
+
+        for product_id in dirty - found:
+            message = json.dumps({"type": "removed", "product_id": product_id})
+            for subscriber in self._channels.get(f"product:{product_id}", ()):
+                subscriber.offer(product_id, message)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Stock feed flush failed")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    # ---- connection handling ----
+
+    async def serve(self, websocket: WebSocket):
+        """Run one client connection.
+
+        Clients send {"action": "subscribe" | "unsubscribe", "products": [...],
+        "categories": [...]} and receive {"type": "stock", ...} messages.
+        """
+        await websocket.accept()
+        subscriber = StockSubscriber(websocket)
+        writer = asyncio.create_task(subscriber.writer())
+        try:
+            while True:
+                message = await websocket.receive_json()
+                product_ids = [str(p) for p in message.get("products", [])]
+                channels = [f"product:{p}" for p in product_ids]
+                channels += [f"category:{c}" for c in message.get("categories", [])]
+                if message.get("action") == "unsubscribe":
+                    self.unsubscribe(subscriber, channels)
+                else:
+                    self.subscribe(subscriber, channels)
+                    await self.snapshot(subscriber, product_ids)
+        except (WebSocketDisconnect, ValueError, AttributeError):
+            pass
+        finally:
+            self.unsubscribe(subscriber)
+            writer.cancel()
@@ -0,0 +1,321 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import math
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+# Virtual waiting room for flash sales.
+# Checkout of a product flagged in `flash_sales` needs an admission pass.
+# Shoppers join a FIFO queue per product and get a signed ticket carrying
+# their sequence number; polling the ticket is answered from memory (no
+# database access) with their position and an ETA until they're admitted.
+#
+# Admission is a counter on the sale document: every tick one worker (CAS on
+# `ticked_at`) advances `admitted` by admit_rate * elapsed, capped at the
+# number of tickets issued so an idle queue doesn't bank a burst. Tickets
+# with seq <= admitted are let through and exchanged for a short-lived pass,
+# which place_order consumes once. So checkouts of a hot product reach
+# MongoDB at admit_rate, however many people are waiting, and once the
+# product is sold out joining and waiting are refused straight away.
+#
+#   flash_sales:  {_id: product_id, admit_rate, issued, admitted, ticked_at}
+#   waiting_room: {_id: "<product_id>:<user_id>", product_id, user_id, seq,
+#                  state: waiting|admitted|used, admitted_until, expires_at}
+
+logger = logging.getLogger(__name__)
+
+TOKEN_VERSION = "w1"
+MAX_CATCH_UP_SECONDS = 5.0  # admissions owed after a stall are capped at this many seconds' worth
+
+SellableStock = Callable[[str], Awaitable[int]]
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class WaitingRoomError(ValueError):
+    pass
+
+
+class WaitingRoom:
+    def __init__(self, db, secret: str, stock: SellableStock, default_admit_rate: float = 10.0,
+                 pass_seconds: float = 300, queue_ttl_seconds: float = 7200, tick: float = 1.0):
+        self.sales = db.flash_sales
+        self.entries = db.waiting_room
+        self.key = hashlib.sha256(f"waiting-room:{secret}".encode()).digest()
+        self.stock = stock
+        self.default_admit_rate = default_admit_rate
+        self.pass_seconds = pass_seconds
+        self.queue_ttl_seconds = queue_ttl_seconds
+        self.tick = tick
+        self._sales: Dict[str, dict] = {}  # product id -> sale document, as of the last tick
+        self._sold_out: Dict[str, bool] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"joined": 0, "polls": 0, "admitted": 0, "consumed": 0, "rejected_sold_out": 0}
+
+    async def ensure_indexes(self):
+        await self.entries.create_index("product_id")
+        await self.entries.create_index("expires_at", expireAfterSeconds=0)
+
+    # ---- tokens ----
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self.key, f"{TOKEN_VERSION}.{payload}".encode(), hashlib.sha256).digest())
+
+    def _encode(self, kind: str, product_id: str, user_id: str, seq: int, expires_at: float) -> str:
+        payload = _b64encode(json.dumps(
+            {"k": kind, "p": product_id, "u": user_id, "s": seq, "e": int(expires_at)}, separators=(",", ":")
+        ).encode())
+        return f"{TOKEN_VERSION}.{payload}.{self._sign(payload)}"
+
+    def _decode(self, token: str, kind: str) -> dict:
+        try:
+            version, payload, signature = token.split(".")
+        except (AttributeError, ValueError):
+            raise WaitingRoomError("Malformed waiting room token")
+        if version != TOKEN_VERSION or not hmac.compare_digest(signature, self._sign(payload)):
+            raise WaitingRoomError("Invalid waiting room token")
+        try:
+            data = json.loads(_b64decode(payload))
+            claims = {"kind": data["k"], "product_id": data["p"], "user_id": data["u"],
+                      "seq": int(data["s"]), "expires_at": int(data["e"])}
+        except (ValueError, KeyError, TypeError):
+            raise WaitingRoomError("Malformed waiting room token")
+        if claims["kind"] != kind:
+            raise WaitingRoomError("Wrong kind of waiting room token")
+        if claims["expires_at"] < time.time():
+            raise WaitingRoomError("Waiting room token expired")
+        return claims
+
+    # ---- sales ----
+
+    def is_active(self, product_id: str) -> bool:
+        return product_id in self._sales
+
+    async def enable(self, product_id: str, admit_rate: Optional[float] = None) -> dict:
+        sale = await self.sales.find_one_and_update(
+            {"_id": product_id},
+            {"$set": {"admit_rate": admit_rate or self.default_admit_rate},
+             "$setOnInsert": {"issued": 0, "admitted": 0.0, "ticked_at": time.time(),
+                              "created_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        self._sales[product_id] = sale
+        return self._describe(sale)
+
+    async def disable(self, product_id: str) -> bool:
+        result = await self.sales.delete_one({"_id": product_id})
+        await self.entries.delete_many({"product_id": product_id})
+        self._sales.pop(product_id, None)
+        self._sold_out.pop(product_id, None)
+        return result.deleted_count > 0
+
+    def _describe(self, sale: dict) -> dict:
+        return {
+            "product_id": sale["_id"],
+            "admit_rate": sale["admit_rate"],
+            "issued": sale["issued"],
+            "admitted": int(sale["admitted"]),
+            "waiting": sale["issued"] - int(sale["admitted"]),
+            "sold_out": self._sold_out.get(sale["_id"], False),
+            "created_at": sale.get("created_at"),
+        }
+
+    def list_sales(self) -> list:
+        return [self._describe(sale) for sale in self._sales.values()]
+
+    # ---- admission ----
+
+    async def refresh(self):
+        """Reload the sales, re-check their stock and advance admission."""
+        sales = await self.sales.find({}).to_list(None)
+        self._sales = {sale["_id"]: sale for sale in sales}
+        for product_id in list(self._sold_out):
+            if product_id not in self._sales:
+                del self._sold_out[product_id]
+        for sale in sales:
+            self._sold_out[sale["_id"]] = await self.stock(sale["_id"]) <= 0
+            if not self._sold_out[sale["_id"]]:
+                await self._advance(sale)
+
+    async def _advance(self, sale: dict):
+        now = time.time()
+        elapsed = min(max(now - sale["ticked_at"], 0.0), MAX_CATCH_UP_SECONDS)
+        admitted = min(float(sale["issued"]), sale["admitted"] + sale["admit_rate"] * elapsed)
+        updated = await self.sales.find_one_and_update(
+            {"_id": sale["_id"], "ticked_at": sale["ticked_at"]},
+            {"$set": {"admitted": admitted, "ticked_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is not None:
+            self._sales[sale["_id"]] = updated
+        # Otherwise another worker ticked first; its value is picked up next time
+
+    async def join(self, product_id: str, user_id: str) -> dict:
+        if not self.is_active(product_id):
+            return {"status": "open"}
+        if self._sold_out.get(product_id):
+            self.stats["rejected_sold_out"] += 1
+            return {"status": "sold_out"}
+        entry_id = f"{product_id}:{user_id}"
+        for _ in range(3):
+            entry = await self.entries.find_one({"_id": entry_id})
+            if entry is not None:
+                if entry["state"] == "waiting" or (
+                        entry["state"] == "admitted" and entry["admitted_until"] > time.time()):
+                    return self._ticket_status(entry)
+                # Used or let lapse: back of the line
+                await self.entries.delete_one({"_id": entry_id, "state": entry["state"]})
+            sale = await self.sales.find_one_and_update(
+                {"_id": product_id}, {"$inc": {"issued": 1}}, return_document=ReturnDocument.AFTER
+            )
+            if sale is None:
+                return {"status": "open"}
+            entry = {
+                "_id": entry_id,
+                "product_id": product_id,
+                "user_id": user_id,
+                "seq": sale["issued"],
+                "state": "waiting",
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.queue_ttl_seconds),
+            }
+            try:
+                await self.entries.insert_one(entry)
+            except DuplicateKeyError:
+                continue  # joined concurrently from another tab; its seq is a no-show
+            self.stats["joined"] += 1
+            return self._ticket_status(entry)
+        raise WaitingRoomError("Could not join the waiting room")
+
+    def _ticket_status(self, entry: dict) -> dict:
+        expires_at = entry["expires_at"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        ticket = self._encode("ticket", entry["product_id"], entry["user_id"], entry["seq"], expires_at.timestamp())
+        return {**self._position(entry["product_id"], entry["seq"]), "ticket": ticket}
+
+    def _position(self, product_id: str, seq: int) -> dict:
+        sale = self._sales[product_id]
+        ahead = seq - math.floor(sale["admitted"])
+        if ahead <= 0:
+            return {"status": "admitted"}
+        eta = ahead / sale["admit_rate"]
+        return {
+            "status": "waiting",
+            "position": ahead,
+            "eta_seconds": math.ceil(eta),
+            # Poll about twice before the ETA, never faster than the tick
+            "poll_after": round(min(max(eta / 2, self.tick), 30.0), 1),
+        }
+
+    async def status(self, product_id: str, ticket: str) -> dict:
+        """Where a ticket stands; a database round trip only once it's admitted."""
+        self.stats["polls"] += 1
+        claims = self._decode(ticket, "ticket")
+        if claims["product_id"] != product_id:
+            raise WaitingRoomError("Ticket is for another product")
+        if not self.is_active(product_id):
+            return {"status": "open"}
+        position = self._position(product_id, claims["seq"])
+        if position["status"] == "waiting":
+            if self._sold_out.get(product_id):
+                self.stats["rejected_sold_out"] += 1
+                return {"status": "sold_out"}
+            return position
+        return await self._admit(claims)
+
+    async def _admit(self, claims: dict) -> dict:
+        entry_id = f"{claims['product_id']}:{claims['user_id']}"
+        now = time.time()
+        entry = await self.entries.find_one_and_update(
+            {"_id": entry_id, "seq": claims["seq"], "state": "waiting"},
+            {"$set": {"state": "admitted", "admitted_until": now + self.pass_seconds}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if entry is not None:
+            self.stats["admitted"] += 1
+        else:
+            entry = await self.entries.find_one({"_id": entry_id, "seq": claims["seq"]})
+        if entry is None or entry["state"] == "used":
+            return {"status": "used"}
+        if entry["admitted_until"] <= now:
+            return {"status": "expired"}
+        admission_pass = self._encode("pass", claims["product_id"], claims["user_id"], claims["seq"],
+                                      entry["admitted_until"])
+        return {"status": "admitted", "pass": admission_pass,
+                "expires_in": math.floor(entry["admitted_until"] - now)}
+
+    async def consume(self, product_ids: Iterable[str], user_id: str, passes: Iterable[str]):
+        """Use up the caller's passes for `product_ids`; raises WaitingRoomError, using none, if any is unusable."""
+        claims_by_product = {}
+        for token in passes:
+            try:
+                claims = self._decode(token, "pass")
+            except WaitingRoomError:
+                continue
+            if claims["user_id"] == user_id:
+                claims_by_product[claims["product_id"]] = claims
+        product_ids = list(product_ids)
+        missing = [product_id for product_id in product_ids if product_id not in claims_by_product]
+        if missing:
+            raise WaitingRoomError("Admission pass required")
+        # All or nothing: check every pass before using any, and give back the
+        # ones already used if another is taken in the meantime
+        now = time.time()
+        entry_ids = {product_id: f"{product_id}:{user_id}" for product_id in product_ids}
+        usable = {product_id: {"_id": entry_ids[product_id], "seq": claims_by_product[product_id]["seq"],
+                               "state": "admitted", "admitted_until": {"$gt": now}}
+                  for product_id in product_ids}
+        for query in usable.values():
+            if await self.entries.find_one(query, {"_id": 1}) is None:
+                raise WaitingRoomError("Admission pass already used or expired")
+        used = []
+        for product_id, query in usable.items():
+            result = await self.entries.update_one(query, {"$set": {"state": "used"}})
+            if not result.modified_count:
+                if used:
+                    await self.entries.update_many({"_id": {"$in": used}, "state": "used"},
+                                                   {"$set": {"state": "admitted"}})
+                raise WaitingRoomError("Admission pass already used or expired")
+            used.append(entry_ids[product_id])
+        self.stats["consumed"] += len(used)
+
+    # ---- lifecycle ----
+
+    async def start(self):
+        try:
+            await self.refresh()
+        except PyMongoError:
+            logger.exception("Could not load flash sales; retrying in the background")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Waiting room refresh failed")
@@ -1,11 +1,47 @@
 import requests
 import sys
 import json
+import uuid
 from datetime import datetime
+from pathlib import Path
+
+# Runs against the deployed preview by default. With --in-process the API is
+# built with create_app() on the in-memory database and driven through an ASGI
+# test client, so no server, network or MongoDB is needed:
+#
+#   python backend_test.py --in-process
+
+def in_process_client():
+    """Build the app on a fresh seeded in-memory database and return a test client"""
+    import asyncio
+    import tempfile
+
+    sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+    from fastapi.testclient import TestClient
+    from memory_db import MemoryClient
+    from seed_data import seed_database
+    from server import create_app
+    from settings import Settings
+
+    db = MemoryClient()['appliancehub_test']
+    asyncio.run(seed_database(db))
+    work_dir = Path(tempfile.mkdtemp(prefix='appliancehub-test-'))
+    settings = Settings(
+        jwt_secret='test-secret',
+        order_archive_dir=work_dir / 'archive',
+        analytics_export_dir=work_dir / 'exports',
+        catalog_snapshot_dir=work_dir / 'catalog',
+        prewarm_imports=False,
+        # Lets the rate limit checks pose as separate clients
+        rate_limit_trust_forwarded=True,
+    )
+    return TestClient(create_app(settings, db))
+
 
 class ApplianceShopAPITester:
-    def __init__(self, base_url="https://shop-appliance.preview.emergentagent.com/api"):
+    def __init__(self, base_url="https://shop-appliance.preview.emergentagent.com/api", http=requests):
         self.base_url = base_url
+        self.http = http
         self.token = None
         self.admin_token = None
         self.user_id = None
@@ -32,15 +68,15 @@ class ApplianceShopAPITester:
         
         try:
             if method == 'GET':
-                response = requests.get(url, headers=headers)
+                response = self.http.get(url, headers=headers)
             elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers)
+                response = self.http.post(url, json=data, headers=headers)
             elif method == 'PUT':
-                response = requests.put(url, json=data, headers=headers)
+                response = self.http.put(url, json=data, headers=headers)
             elif method == 'DELETE':
-                response = requests.delete(url, headers=headers)
+                response = self.http.delete(url, headers=headers)
             elif method == 'PATCH':
-                response = requests.patch(url, headers=headers)
+                response = self.http.patch(url, headers=headers)
 
             success = response.status_code == expected_status
             if success:
@@ -371,11 +407,277 @@ class ApplianceShopAPITester:
             use_admin=True
         )
 
+class InProcessChecks:
+    """Behaviour checks that need many requests or the app's internals (--in-process only)"""
+
+    def __init__(self, tester, client):
+        self.tester = tester
+        self.client = client
+        self.api = tester.base_url
+
+    def run_check(self, name, check):
+        self.tester.tests_run += 1
+        print(f"\n🔍 Checking {name}...")
+        try:
+            check()
+        except Exception as e:
+            print(f"❌ Failed - {e!r}")
+            return False
+        self.tester.tests_passed += 1
+        print("✅ Passed")
+        return True
+
+    def call(self, function, *args):
+        """Run an async function of the app on its event loop"""
+        return self.client.portal.call(function, *args)
+
+    def register(self, name, ip, guest_cart=None):
+        email = f"{name}-{uuid.uuid4().hex[:8]}@example.com"
+        headers = {'X-Forwarded-For': ip}
+        if guest_cart:
+            headers['X-Guest-Cart'] = guest_cart
+        response = self.client.post(f"{self.api}/auth/register", headers=headers,
+                                    json={"name": name, "email": email, "password": "TestPass123!"})
+        assert response.status_code == 200, response.text
+        return email, {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+    def check_login_refunds(self):
+        """An IP over its login limit can't use up the email bucket of someone else's account"""
+        victim, _ = self.register("victim", "10.0.1.1")
+        attacker = {'X-Forwarded-For': '10.0.1.2'}
+        status = None
+        for i in range(25):
+            status = self.client.post(f"{self.api}/auth/login", headers=attacker,
+                                      json={"email": f"nobody{i}@example.com", "password": "x"}).status_code
+        assert status == 429, f"attacker IP not limited, last status {status}"
+        for _ in range(10):
+            response = self.client.post(f"{self.api}/auth/login", headers=attacker,
+                                        json={"email": victim, "password": "x"})
+            assert response.status_code == 429, response.status_code
+        response = self.client.post(f"{self.api}/auth/login", headers={'X-Forwarded-For': '10.0.1.3'},
+                                    json={"email": victim, "password": "TestPass123!"})
+        assert response.status_code == 200, f"victim locked out: {response.status_code}"
+
+    def check_archived_order_merge(self):
+        """Archived and hot orders are listed together, newest first"""
+        import server
+
+        _, headers = self.register("archive", "10.0.2.1")
+        user_id = self.client.get(f"{self.api}/auth/me", headers=headers).json()["id"]
+        item = {"product_id": "p", "product_name": "Kettle", "quantity": 1, "price": 10.0}
+        old = [
+            ("delivered-1", "delivered", "2023-01-10T10:00:00+00:00", 1),
+            ("pending-old", "pending", "2023-01-15T10:00:00+00:00", 1),
+            ("delivered-2", "delivered", "2023-01-20T10:00:00+00:00", 3),
+        ]
+        for order_id, status, created_at, count in old:
+            self.call(server.db.orders.insert_one, {
+                "id": f"{user_id}-{order_id}", "user_id": user_id, "items": [item] * count,
+                "total_amount": 10.0 * count, "status": status, "payment_status": "paid", "created_at": created_at,
+            })
+        assert self.call(server.order_archive.archive_once) >= 2
+
+        expected = [f"{user_id}-{order_id}" for order_id in ("delivered-2", "pending-old", "delivered-1")]
+        for query in ("", "?view=summary", "?fields=status"):
+            orders = self.client.get(f"{self.api}/orders{query}", headers=headers).json()
+            assert [o["id"] for o in orders] == expected, (query, [o["id"] for o in orders])
+        summary = self.client.get(f"{self.api}/orders?view=summary", headers=headers).json()
+        assert [o["item_count"] for o in summary] == [3, 1, 1], summary
+        full = self.client.get(f"{self.api}/orders", headers=headers).json()
+        assert len(full[0]["items"]) == 3, full[0]
+
+    def check_guest_cart_signature(self):
+        """Guest carts round-trip through the signed token, and an edited token is refused"""
+        import base64
+
+        product_id = self.client.get(f"{self.api}/products").json()[0]["id"]
+        response = self.client.post(f"{self.api}/cart/items", json={"product_id": product_id, "quantity": 2})
+        token = response.json()["guest_cart"]
+        cart = self.client.get(f"{self.api}/cart", headers={'X-Guest-Cart': token}).json()
+        assert [(i["product_id"], i["quantity"]) for i in cart["items"]] == [(product_id, 2)], cart
+
+        # Same signature over a payload with a bigger quantity
+        version, payload, signature = token.split(".")
+        data = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        data["i"][0][1] = 50
+        forged_payload = base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).rstrip(b"=")
+        forged = f"{version}.{forged_payload.decode()}.{signature}"
+        response = self.client.get(f"{self.api}/cart", headers={'X-Guest-Cart': forged})
+        assert response.status_code == 400, response.status_code
+
+        # Merged on register; a forged cart is ignored rather than failing the signup
+        _, headers = self.register("guest", "10.0.3.1", guest_cart=token)
+        cart = self.client.get(f"{self.api}/cart", headers=headers).json()
+        assert [(i["product_id"], i["quantity"]) for i in cart["items"]] == [(product_id, 2)], cart
+        _, headers = self.register("forger", "10.0.3.2", guest_cart=forged)
+        assert self.client.get(f"{self.api}/cart", headers=headers).json()["items"] == []
+
+    def check_token_revocation(self):
+        """Logged-out tokens are refused from memory, here and on a worker that polls for them"""
+        import base64
+        import server
+        from revocation import TokenRevocationList
+
+        _, headers = self.register("revoked", "10.0.4.1")
+        admin = {'Authorization': f'Bearer {self.tester.admin_token}'}
+        assert self.client.get(f"{self.api}/auth/me", headers=headers).status_code == 200
+        other_worker = TokenRevocationList(server.db)
+        self.call(other_worker._rebuild)
+
+        before = self.client.get(f"{self.api}/admin/auth/revocations", headers=admin).json()
+        assert self.client.post(f"{self.api}/auth/logout", headers=headers).status_code == 200
+        assert self.client.get(f"{self.api}/auth/me", headers=headers).status_code == 401
+        after = self.client.get(f"{self.api}/admin/auth/revocations", headers=admin).json()
+        assert after["exact_hits"] > before["exact_hits"], after
+        # Tokens that were never revoked are settled by the Bloom filter alone
+        assert after["db_lookups"] == before["db_lookups"], after
+
+        payload = headers['Authorization'].split()[1].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        self.call(other_worker._poll_once)
+        assert self.call(other_worker.is_revoked, claims["jti"], claims["sub"], None)
+        assert other_worker.stats["exact_hits"] == 1 and other_worker.stats["db_lookups"] == 0, other_worker.stats
+
+    def check_review_cursors(self):
+        """Review pages follow the sort key, with no repeats when reviews arrive mid-scroll"""
+        import server
+
+        product_id = f"keyset-{uuid.uuid4().hex[:8]}"
+        reviews = [
+            # Pairs share created_at, so the id tiebreak decides their order
+            {"id": f"r{i:02d}", "product_id": product_id, "user_id": f"u{i}", "user_name": "Reviewer",
+             "rating": i % 5 + 1, "comment": "ok", "helpful_count": 0,
+             "created_at": f"2024-01-{i // 2 + 1:02d}T10:00:00+00:00"}
+            for i in range(25)
+        ]
+        self.call(server.db.reviews.insert_many, [dict(r) for r in reviews])
+
+        def read_all(sort, arrive=None):
+            ids, cursor = [], None
+            while True:
+                params = {"sort": sort, "limit": 10, **({"cursor": cursor} if cursor else {})}
+                page = self.client.get(f"{self.api}/reviews/{product_id}", params=params).json()
+                ids += [r["id"] for r in page["reviews"]]
+                cursor = page["next_cursor"]
+                if arrive:
+                    self.call(server.db.reviews.insert_one, arrive.pop())
+                if not cursor:
+                    return ids
+
+        newest = sorted(reviews, key=lambda r: (r["created_at"], r["id"]), reverse=True)
+        highest = sorted(newest, key=lambda r: -r["rating"])  # stable, so ties stay newest first
+        assert read_all("highest") == [r["id"] for r in highest]
+        late = [{**reviews[0], "id": f"late{i}", "user_id": f"late{i}", "created_at": "2025-01-01T10:00:00+00:00"}
+                for i in range(2)]
+        # Newer reviews posted while paging don't shift the later pages
+        assert read_all("newest", arrive=late) == [r["id"] for r in newest]
+        response = self.client.get(f"{self.api}/reviews/{product_id}?cursor=not-a-cursor")
+        assert response.status_code == 400, response.status_code
+
+    def check_idempotent_replays(self):
+        """A retried write with the same Idempotency-Key gets the first response back, status code included"""
+        _, headers = self.register("replay", "10.0.5.1")
+        product_id = self.client.get(f"{self.api}/products").json()[0]["id"]
+        self.client.post(f"{self.api}/cart/items", headers=headers, json={"product_id": product_id, "quantity": 1})
+
+        checkout = {**headers, 'Idempotency-Key': uuid.uuid4().hex}
+        first = self.client.post(f"{self.api}/orders", headers=checkout)
+        again = self.client.post(f"{self.api}/orders", headers=checkout)
+        assert first.status_code == again.status_code == 200, (first.status_code, again.status_code)
+        assert again.headers.get("Idempotent-Replayed") == "true"
+        assert again.json()["id"] == first.json()["id"]
+        order_id = first.json()["id"]
+
+        pay = {**headers, 'Idempotency-Key': uuid.uuid4().hex}
+        first = self.client.post(f"{self.api}/orders/{order_id}/payments", headers=pay, json={"last4": "4242"})
+        again = self.client.post(f"{self.api}/orders/{order_id}/payments", headers=pay, json={"last4": "4242"})
+        assert first.status_code == again.status_code == 202, (first.status_code, again.status_code)
+        assert again.headers.get("Idempotent-Replayed") == "true"
+        assert again.json()["id"] == first.json()["id"]
+        # The same key on a different request body is refused
+        other = self.client.post(f"{self.api}/orders/{order_id}/payments", headers=pay, json={"last4": "1111"})
+        assert other.status_code == 422, other.status_code
+
+    def check_outbox_redelivery(self):
+        """A failed subscriber is retried alone, and a redelivered order.paid takes stock only once"""
+        import asyncio
+        import server
+
+        _, headers = self.register("outbox", "10.0.6.1")
+        product = next(p for p in self.client.get(f"{self.api}/products").json() if p["stock"] >= 2)
+        self.client.post(f"{self.api}/cart/items", headers=headers, json={"product_id": product["id"], "quantity": 2})
+        order_id = self.client.post(f"{self.api}/orders", headers=headers).json()["id"]
+
+        def stock():
+            return self.call(server.db.products.find_one, {"id": product["id"]})["stock"]
+
+        before = stock()
+        inventory, outbox = server.inventory, server.outbox
+        decrements, claims = [], []
+        original_decrement, original_decrement_once = inventory.decrement, inventory.decrement_once
+
+        async def failing_once(product_id, quantity):
+            decrements.append(product_id)
+            if len(decrements) == 1:
+                raise RuntimeError("inventory unavailable")
+            return await original_decrement(product_id, quantity)
+
+        async def recording(key, product_id, quantity):
+            claims.append(key)
+            return await original_decrement_once(key, product_id, quantity)
+
+        async def relay_until_done():
+            for _ in range(100):
+                await outbox.relay()
+                if not await outbox.pending():
+                    return True
+                await asyncio.sleep(0.02)
+            return False
+
+        inventory.decrement, inventory.decrement_once = failing_once, recording
+        retry_base, outbox.retry_base = outbox.retry_base, 0.01
+        skipped = outbox.stats["skipped_repeats"]
+        try:
+            self.call(server.confirm_order_payment, {"id": f"txn-{order_id}", "order_id": order_id})
+            assert self.call(relay_until_done), "outbox did not drain"
+            assert decrements == [product["id"], product["id"]], decrements
+            assert stock() == before - 2, (before, stock())
+            # Subscribers that had already succeeded were not called again on the retry
+            assert outbox.stats["skipped_repeats"] > skipped, outbox.stats
+
+            # The relay may deliver again after a crash; the claim keeps it at one decrement
+            paid = {"id": claims[-1], "type": "order.paid",
+                    "data": {"order": {"id": order_id, "items": [{"product_id": product["id"], "quantity": 2}]}}}
+            self.call(server.decrement_paid_stock, paid)
+            assert stock() == before - 2, (before, stock())
+            assert len(decrements) == 2, decrements
+        finally:
+            inventory.decrement, inventory.decrement_once = original_decrement, original_decrement_once
+            outbox.retry_base = retry_base
+
+    def run(self):
+        checks = [
+            ("Login Rate Limit Refunds", self.check_login_refunds),
+            ("Archived Order Merge", self.check_archived_order_merge),
+            ("Guest Cart Signature", self.check_guest_cart_signature),
+            ("Token Revocation", self.check_token_revocation),
+            ("Review Cursors", self.check_review_cursors),
+            ("Idempotent Replays", self.check_idempotent_replays),
+            ("Outbox Redelivery", self.check_outbox_redelivery),
+        ]
+        return [(name, self.run_check(name, check)) for name, check in checks]
+
 def main():
     print("🚀 Starting Appliance Shop API Tests")
     print("=" * 50)
     
-    tester = ApplianceShopAPITester()
+    if '--in-process' in sys.argv:
+        with in_process_client() as client:
+            tester = ApplianceShopAPITester("http://testserver/api", http=client)
+            return run_tests(tester, InProcessChecks(tester, client))
+    return run_tests(ApplianceShopAPITester())
+
+def run_tests(tester, checks=None):
     
     # Test sequence
     test_results = []
@@ -427,6 +729,9 @@ def main():
     # Cleanup - delete test product
     test_results.append(("Delete Product (Admin)", tester.test_delete_product_admin()))
     
+    if checks is not None:
+        test_results += checks.run()
+    
     # Print results summary
     print("\n" + "=" * 50)
     print("📊 TEST RESULTS SUMMARY")
@@ -12,10 +12,13 @@ import AdminPage from '@/pages/AdminPage';
 import ReceiptPage from '@/pages/ReceiptPage';
 import MockCheckoutPage from '@/pages/MockCheckoutPage';
 import { Toaster } from '@/components/ui/sonner';
+import { installGuestCartInterceptors, clearGuestCart } from '@/lib/guest-cart';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 export const API = `${BACKEND_URL}/api`;
 
+installGuestCartInterceptors();
+
 // Auth Context
 export const AuthContext = React.createContext();
 
@@ -48,12 +51,17 @@ function App() {
   };
 
   const login = (token, userData) => {
+    // The login/register request carried the guest cart, which is now merged
+    clearGuestCart();
     localStorage.setItem('token', token);
     axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
     setUser(userData);
   };
 
   const logout = () => {
+    // Revoke the token server-side too; the local session ends either way
+    const token = localStorage.getItem('token');
+    axios.post(`${API}/auth/logout`, null, { headers: { Authorization: `Bearer ${token}` } }).catch(() => {});
     localStorage.removeItem('token');
     delete axios.defaults.headers.common['Authorization'];
     setUser(null);
@@ -75,7 +83,7 @@ function App() {
             <Route path="/" element={<HomePage />} />
             <Route path="/products" element={<ProductsPage />} />
             <Route path="/products/:id" element={<ProductDetailPage />} />
-            <Route path="/cart" element={user ? <CartPage /> : <Navigate to="/" />} />
+            <Route path="/cart" element={<CartPage />} />
             <Route path="/order-success" element={user ? <OrderSuccessPage /> : <Navigate to="/" />} />
             <Route path="/orders" element={user ? <OrdersPage /> : <Navigate to="/" />} />
             <Route path="/receipt/:orderId" element={user ? <ReceiptPage /> : <Navigate to="/" />} />
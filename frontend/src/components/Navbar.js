@@ -49,17 +49,17 @@ const Navbar = ({ onAuthClick }) => {
 
           {/* User Actions */}
           <div className="flex items-center space-x-4">
+            <Button
+              variant="ghost"
+              onClick={() => navigate('/cart')}
+              className="relative"
+              data-testid="cart-button"
+            >
+              <ShoppingCart className="w-5 h-5" />
+            </Button>
+
             {user ? (
               <>
-                <Button
-                  variant="ghost"
-                  onClick={() => navigate('/cart')}
-                  className="relative"
-                  data-testid="cart-button"
-                >
-                  <ShoppingCart className="w-5 h-5" />
-                </Button>
-
                 <DropdownMenu>
                   <DropdownMenuTrigger asChild>
                     <Button variant="ghost" className="flex items-center space-x-2" data-testid="user-menu">
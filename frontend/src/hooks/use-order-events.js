@@ -0,0 +1,75 @@
+import { useEffect, useRef } from 'react';
+import axios from 'axios';
+import { API } from '@/App';
+
+const ORDER_EVENT_TYPES = ['order_created', 'order_status', 'payment_status', 'resync'];
+const RECONNECT_DELAY = 5000;
+
+// Subscribes to the per-user order status stream (Server-Sent Events).
+// onEvent(type, data) is called for every pushed event; 'resync' means some
+// events were missed and the caller should re-fetch its data once.
+// onOpen() is called each time the stream (re)connects: anything that
+// happened before then was not pushed, so a page that fetched its data before
+// subscribing can fetch it again there.
+export const useOrderEvents = (onEvent, enabled = true, onOpen = null) => {
+  const handlerRef = useRef(onEvent);
+  handlerRef.current = onEvent;
+  const openRef = useRef(onOpen);
+  openRef.current = onOpen;
+
+  useEffect(() => {
+    if (!enabled) return undefined;
+
+    let source = null;
+    let closed = false;
+    let lastEventId = null;
+    let reconnectTimer = null;
+
+    const scheduleReconnect = () => {
+      if (closed) return;
+      if (source) source.close();
+      reconnectTimer = setTimeout(connect, RECONNECT_DELAY);
+    };
+
+    const connect = async () => {
+      try {
+        // EventSource can't send the Authorization header, so get a short-lived ticket
+        const response = await axios.post(`${API}/orders/events/ticket`);
+        if (closed) return;
+
+        const params = new URLSearchParams({ ticket: response.data.ticket });
+        if (lastEventId) params.set('last_event_id', lastEventId);
+        source = new EventSource(`${API}/orders/events?${params.toString()}`);
+
+        ORDER_EVENT_TYPES.forEach((type) => {
+          source.addEventListener(type, (event) => {
+            lastEventId = event.lastEventId || lastEventId;
+            handlerRef.current(type, JSON.parse(event.data));
+          });
+        });
+
+        source.onopen = () => {
+          if (openRef.current) openRef.current();
+        };
+
+        source.onerror = () => {
+          // The browser retries by itself unless the stream was rejected (expired ticket)
+          if (source.readyState === EventSource.CLOSED) {
+            scheduleReconnect();
+          }
+        };
+      } catch (error) {
+        console.error('Failed to open order events stream', error);
+        scheduleReconnect();
+      }
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      if (source) source.close();
+    };
+  }, [enabled]);
+};
@@ -0,0 +1,50 @@
+import { useEffect, useRef } from 'react';
+import { API } from '@/App';
+
+const RECONNECT_DELAY = 5000;
+
+const stockFeedUrl = () => {
+  const base = API.startsWith('http') ? API : `${window.location.origin}${API}`;
+  return `${base.replace(/^http/, 'ws')}/ws/stock`;
+};
+
+// Subscribes to live stock/price updates for the given products and categories.
+// onUpdate receives { type: 'stock', product_id, stock, price } or
+// { type: 'removed', product_id } messages.
+export const useStockFeed = ({ products = [], categories = [] }, onUpdate) => {
+  const handlerRef = useRef(onUpdate);
+  handlerRef.current = onUpdate;
+  const productKey = products.join(',');
+  const categoryKey = categories.join(',');
+
+  useEffect(() => {
+    if (!productKey && !categoryKey) return undefined;
+
+    let socket = null;
+    let closed = false;
+    let reconnectTimer = null;
+
+    const connect = () => {
+      socket = new WebSocket(stockFeedUrl());
+      socket.onopen = () => {
+        socket.send(JSON.stringify({
+          action: 'subscribe',
+          products: productKey ? productKey.split(',') : [],
+          categories: categoryKey ? categoryKey.split(',') : []
+        }));
+      };
+      socket.onmessage = (event) => handlerRef.current(JSON.parse(event.data));
+      socket.onclose = () => {
+        if (!closed) reconnectTimer = setTimeout(connect, RECONNECT_DELAY);
+      };
+    };
+
+    connect();
+
+    return () => {
+      closed = true;
+      clearTimeout(reconnectTimer);
+      if (socket) socket.close();
+    };
+  }, [productKey, categoryKey]);
+};
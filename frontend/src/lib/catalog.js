@@ -0,0 +1,32 @@
+// Catalog listings come from the published static snapshots: the manifest
+// names the current version, and everything under it is immutable, so the
+// browser (or a CDN) caches those files for good. Plain fetch keeps the
+// Authorization and guest cart headers off these requests so shared caches
+// can store them. Callers fall back to the live API when this throws.
+const MANIFEST_MAX_AGE_MS = 60 * 1000;
+
+let manifest = null;
+let manifestLoadedAt = 0;
+
+const fetchJson = async (url) => {
+  const response = await fetch(url);
+  if (!response.ok) throw new Error(`${url}: ${response.status}`);
+  return response.json();
+};
+
+const getManifest = async (api) => {
+  if (!manifest || Date.now() - manifestLoadedAt > MANIFEST_MAX_AGE_MS) {
+    manifest = await fetchJson(`${api}/catalog/manifest.json`);
+    manifestLoadedAt = Date.now();
+  }
+  return manifest;
+};
+
+// Summary listing of the whole catalog or one category
+export const fetchCatalogSummary = async (api, category) => {
+  const current = await getManifest(api);
+  const path = category ? current.categories[category]?.summary : current.summary;
+  if (!path) throw new Error(`Category not in catalog snapshot ${current.version}`);
+  const origin = api.replace(/\/api$/, '');
+  return fetchJson(`${origin}${current.base}${path}`);
+};
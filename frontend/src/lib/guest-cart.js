@@ -0,0 +1,25 @@
+import axios from 'axios';
+
+// Guests keep their cart client-side as a signed token issued by the API.
+// It is sent as X-Guest-Cart while nobody is logged in, replaced whenever a
+// response carries a new `guest_cart`, and dropped once login/register has
+// merged it into the account's cart.
+const STORAGE_KEY = 'guest_cart';
+
+export const clearGuestCart = () => localStorage.removeItem(STORAGE_KEY);
+
+export const installGuestCartInterceptors = () => {
+  axios.interceptors.request.use((config) => {
+    const token = localStorage.getItem(STORAGE_KEY);
+    if (token && !axios.defaults.headers.common['Authorization']) {
+      config.headers['X-Guest-Cart'] = token;
+    }
+    return config;
+  });
+  axios.interceptors.response.use((response) => {
+    if (response.data && typeof response.data.guest_cart === 'string') {
+      localStorage.setItem(STORAGE_KEY, response.data.guest_cart);
+    }
+    return response;
+  });
+};
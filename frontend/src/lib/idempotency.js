@@ -0,0 +1,10 @@
+// Writes sent with an Idempotency-Key are retried with the same key until the
+// server gives a definite answer. A network error or a 5xx may have happened
+// after the write went through, so only a 4xx means a fresh key is needed
+// for the next attempt. 409 (still in progress) and 429 are not answers yet.
+export const newIdempotencyKey = () => crypto.randomUUID();
+
+export const needsNewIdempotencyKey = (error) => {
+  const status = error.response?.status;
+  return status >= 400 && status < 500 && status !== 409 && status !== 429;
+};
@@ -0,0 +1,32 @@
+import axios from 'axios';
+
+// Flash-sale products are checked out through a waiting room. When an order
+// is refused with 409 and a `waiting_room` list, the shopper joins the queue
+// of each product, polls with the ticket (cheap, answered from memory) until
+// admitted, and retries the order with the passes in X-Admission-Pass.
+const sleep = (seconds) => new Promise((resolve) => setTimeout(resolve, seconds * 1000));
+
+export const waitingRoomProducts = (error) =>
+  error.response?.status === 409 ? error.response.data?.detail?.waiting_room : undefined;
+
+const waitForPass = async (api, productId, onProgress) => {
+  let status = (await axios.post(`${api}/waiting-room/${productId}`)).data;
+  const ticket = status.ticket;
+  while (status.status === 'waiting') {
+    onProgress?.(productId, status);
+    await sleep(status.poll_after);
+    status = (await axios.get(`${api}/waiting-room/${productId}`, { params: { ticket } })).data;
+  }
+  if (status.status === 'admitted' && !status.pass) {
+    // Admitted on joining; the pass is handed out on the next poll
+    status = (await axios.get(`${api}/waiting-room/${productId}`, { params: { ticket } })).data;
+  }
+  return status.pass;
+};
+
+// Resolves to the X-Admission-Pass header value; rejects with the API error
+// (410 once the product is sold out)
+export const waitForAdmission = async (api, productIds, onProgress) => {
+  const passes = await Promise.all(productIds.map((id) => waitForPass(api, id, onProgress)));
+  return passes.filter(Boolean).join(',');
+};
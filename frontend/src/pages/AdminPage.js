@@ -30,14 +30,20 @@ const AdminPage = () => {
     features: ''
   });
 
+  const [orderStats, setOrderStats] = useState(null);
+  const [analytics, setAnalytics] = useState(null);
+
   useEffect(() => {
     fetchProducts();
     fetchOrders();
+    fetchOrderStats();
+    fetchAnalytics();
   }, []);
 
   const fetchProducts = async () => {
     try {
-      const response = await axios.get(`${API}/products`);
+      // The table shows summaries; the edit dialog loads the full product
+      const response = await axios.get(`${API}/products`, { params: { view: 'summary' } });
       setProducts(response.data);
     } catch (error) {
       console.error('Failed to fetch products', error);
@@ -46,13 +52,41 @@ const AdminPage = () => {
 
   const fetchOrders = async () => {
     try {
-      const response = await axios.get(`${API}/admin/orders`);
+      const response = await axios.get(`${API}/admin/orders`, { params: { view: 'summary' } });
       setOrders(response.data);
     } catch (error) {
       console.error('Failed to fetch orders', error);
     }
   };
 
+  const fetchOrderStats = async () => {
+    try {
+      const response = await axios.get(`${API}/admin/orders/stats`);
+      setOrderStats(response.data);
+    } catch (error) {
+      console.error('Failed to fetch order stats', error);
+    }
+  };
+
+  const fetchAnalytics = async () => {
+    try {
+      const [summary, rfm, velocity, categories] = await Promise.all([
+        axios.get(`${API}/admin/analytics/summary`),
+        axios.get(`${API}/admin/analytics/rfm`, { params: { top: 0 } }),
+        axios.get(`${API}/admin/analytics/velocity`, { params: { days: 30, limit: 10 } }),
+        axios.get(`${API}/admin/analytics/categories`, { params: { days: 90 } })
+      ]);
+      setAnalytics({
+        summary: summary.data,
+        segments: rfm.data.segments,
+        velocity: velocity.data.products,
+        categories: categories.data.categories
+      });
+    } catch (error) {
+      console.error('Failed to fetch analytics', error);
+    }
+  };
+
   const handleProductSubmit = async (e) => {
     e.preventDefault();
     try {
@@ -92,7 +126,14 @@ const AdminPage = () => {
     }
   };
 
-  const handleEditProduct = (product) => {
+  const handleEditProduct = async (summary) => {
+    let product;
+    try {
+      product = (await axios.get(`${API}/products/${summary.id}`)).data;
+    } catch (error) {
+      toast.error('Failed to load product');
+      return;
+    }
     setEditingProduct(product);
     setProductForm({
       name: product.name,
@@ -125,12 +166,22 @@ const AdminPage = () => {
       await axios.patch(`${API}/admin/orders/${orderId}?status=${status}`);
       toast.success('Order status updated');
       fetchOrders();
+      fetchOrderStats();
     } catch (error) {
-      toast.error('Failed to update order status');
+      toast.error(error.response?.data?.detail || 'Failed to update order status');
     }
   };
 
   const calculateStats = () => {
+    // Counters maintained server-side from the order event log
+    if (orderStats) {
+      return {
+        totalRevenue: orderStats.total_revenue,
+        totalOrders: orderStats.total_orders,
+        pendingOrders: orderStats.status_counts.pending
+      };
+    }
+
     const totalRevenue = orders
       .filter(o => o.payment_status === 'paid')
       .reduce((sum, o) => sum + o.total_amount, 0);
@@ -194,6 +245,7 @@ const AdminPage = () => {
             <TabsList>
               <TabsTrigger value="products" data-testid="products-tab">Products</TabsTrigger>
               <TabsTrigger value="orders" data-testid="orders-tab">Orders</TabsTrigger>
+              <TabsTrigger value="analytics" data-testid="analytics-tab">Analytics</TabsTrigger>
             </TabsList>
 
             {/* Products Tab */}
@@ -318,13 +370,134 @@ const AdminPage = () => {
                         </div>
                       </div>
                       <div className="text-sm text-slate-600">
-                        {order.items.length} item(s) • Payment: {order.payment_status}
+                        {order.item_count} item(s) • Payment: {order.payment_status}
                       </div>
                     </div>
                   ))}
                 </div>
               </div>
             </TabsContent>
+
+            {/* Analytics Tab */}
+            <TabsContent value="analytics" data-testid="analytics-content">
+              {!analytics ? (
+                <div className="glass-effect rounded-2xl p-6 text-slate-600">Loading analytics...</div>
+              ) : (
+                <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
+                  <div className="glass-effect rounded-2xl p-6" data-testid="analytics-summary">
+                    <h2 className="text-2xl font-bold mb-4">Sales</h2>
+                    <div className="grid grid-cols-3 gap-4 mb-4">
+                      <div>
+                        <p className="text-slate-600 text-sm">Avg. Order Value</p>
+                        <p className="text-xl font-bold" data-testid="analytics-aov">
+                          ₱{analytics.summary.average_order_value.toFixed(2)}
+                        </p>
+                      </div>
+                      <div>
+                        <p className="text-slate-600 text-sm">Customers</p>
+                        <p className="text-xl font-bold">{analytics.summary.customers}</p>
+                      </div>
+                      <div>
+                        <p className="text-slate-600 text-sm">Items / Order</p>
+                        <p className="text-xl font-bold">{analytics.summary.items_per_order}</p>
+                      </div>
+                    </div>
+                    <table className="w-full text-sm">
+                      <thead>
+                        <tr className="border-b text-left">
+                          <th className="py-2">Month</th>
+                          <th className="py-2">Orders</th>
+                          <th className="py-2">Revenue</th>
+                          <th className="py-2">AOV</th>
+                        </tr>
+                      </thead>
+                      <tbody>
+                        {analytics.summary.by_month.map((row) => (
+                          <tr key={row.month} className="border-b">
+                            <td className="py-2">{row.month}</td>
+                            <td className="py-2">{row.orders}</td>
+                            <td className="py-2">₱{row.revenue.toFixed(2)}</td>
+                            <td className="py-2">₱{row.average_order_value.toFixed(2)}</td>
+                          </tr>
+                        ))}
+                      </tbody>
+                    </table>
+                  </div>
+
+                  <div className="glass-effect rounded-2xl p-6" data-testid="analytics-segments">
+                    <h2 className="text-2xl font-bold mb-4">Customer Segments</h2>
+                    <table className="w-full text-sm">
+                      <thead>
+                        <tr className="border-b text-left">
+                          <th className="py-2">Segment</th>
+                          <th className="py-2">Customers</th>
+                          <th className="py-2">Avg. Recency</th>
+                          <th className="py-2">Revenue Share</th>
+                        </tr>
+                      </thead>
+                      <tbody>
+                        {analytics.segments.map((row) => (
+                          <tr key={row.segment} className="border-b">
+                            <td className="py-2 capitalize">{row.segment.replace('_', ' ')}</td>
+                            <td className="py-2">{row.customers}</td>
+                            <td className="py-2">{row.avg_recency_days} days</td>
+                            <td className="py-2">{(row.revenue_share * 100).toFixed(1)}%</td>
+                          </tr>
+                        ))}
+                      </tbody>
+                    </table>
+                  </div>
+
+                  <div className="glass-effect rounded-2xl p-6" data-testid="analytics-velocity">
+                    <h2 className="text-2xl font-bold mb-4">Fastest Sellers (30 days)</h2>
+                    <table className="w-full text-sm">
+                      <thead>
+                        <tr className="border-b text-left">
+                          <th className="py-2">Product</th>
+                          <th className="py-2">Units/Day</th>
+                          <th className="py-2">Trend</th>
+                          <th className="py-2">Days of Stock</th>
+                        </tr>
+                      </thead>
+                      <tbody>
+                        {analytics.velocity.map((row) => (
+                          <tr key={row.product_id} className="border-b">
+                            <td className="py-2">{row.name || row.product_id}</td>
+                            <td className="py-2">{row.units_per_day}</td>
+                            <td className="py-2">
+                              {row.trend === null ? 'New' : `${row.trend >= 0 ? '+' : ''}${(row.trend * 100).toFixed(0)}%`}
+                            </td>
+                            <td className={`py-2 ${row.days_of_stock !== null && row.days_of_stock < 7 ? 'text-red-600 font-semibold' : ''}`}>
+                              {row.days_of_stock === null ? '-' : row.days_of_stock}
+                            </td>
+                          </tr>
+                        ))}
+                      </tbody>
+                    </table>
+                  </div>
+
+                  <div className="glass-effect rounded-2xl p-6" data-testid="analytics-categories">
+                    <h2 className="text-2xl font-bold mb-4">Category Mix (90 days)</h2>
+                    <div className="space-y-3">
+                      {analytics.categories.map((row) => (
+                        <div key={row.category}>
+                          <div className="flex justify-between text-sm mb-1">
+                            <span>{row.category}</span>
+                            <span>₱{row.revenue.toFixed(2)} ({(row.revenue_share * 100).toFixed(1)}%)</span>
+                          </div>
+                          <div className="h-2 bg-slate-200 rounded-full">
+                            <div
+                              className="h-2 rounded-full bg-gradient-to-r from-sky-500 to-cyan-500"
+                              style={{ width: `${row.revenue_share * 100}%` }}
+                            />
+                          </div>
+                        </div>
+                      ))}
+                    </div>
+                  </div>
+                </div>
+              )}
+            </TabsContent>
           </Tabs>
         </div>
       </div>
@@ -1,11 +1,14 @@
-import React, { useState, useEffect, useContext } from 'react';
+import React, { useState, useEffect, useContext, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { API, AuthContext } from '@/App';
 import Navbar from '@/components/Navbar';
+import AuthModal from '@/components/AuthModal';
 import { Button } from '@/components/ui/button';
 import { Trash2, ShoppingBag, ArrowLeft } from 'lucide-react';
 import { toast } from 'sonner';
+import { waitingRoomProducts, waitForAdmission } from '@/lib/waiting-room';
+import { newIdempotencyKey, needsNewIdempotencyKey } from '@/lib/idempotency';
 
 const CartPage = () => {
   const { user } = useContext(AuthContext);
@@ -14,24 +17,36 @@ const CartPage = () => {
   const [cartDetails, setCartDetails] = useState([]);
   const [loading, setLoading] = useState(true);
   const [checkoutLoading, setCheckoutLoading] = useState(false);
+  const [showAuthModal, setShowAuthModal] = useState(false);
+  const [queueStatus, setQueueStatus] = useState(null);
+  // One key per checkout attempt so retries and double clicks create a single order
+  const checkoutKey = useRef(newIdempotencyKey());
 
+  // Refetch after login, when the guest cart has been merged into the account
   useEffect(() => {
     fetchCart();
-  }, []);
+  }, [user]);
 
   const fetchCart = async () => {
     try {
       const response = await axios.get(`${API}/cart`);
       setCart(response.data);
       
-      // Fetch product details for each item
-      const details = await Promise.all(
-        response.data.items.map(async (item) => {
-          const productResponse = await axios.get(`${API}/products/${item.product_id}`);
-          return { ...productResponse.data, quantity: item.quantity };
-        })
+      // Fetch product details for all items in one request
+      const items = response.data.items;
+      let products = [];
+      if (items.length > 0) {
+        const productsResponse = await axios.get(`${API}/products:batchGet`, {
+          params: { ids: items.map((item) => item.product_id).join(',') }
+        });
+        products = productsResponse.data.products;
+      }
+      const byId = Object.fromEntries(products.map((product) => [product.id, product]));
+      setCartDetails(
+        items
+          .filter((item) => byId[item.product_id])
+          .map((item) => ({ ...byId[item.product_id], quantity: item.quantity }))
       );
-      setCartDetails(details);
     } catch (error) {
       console.error('Failed to fetch cart', error);
       toast.error('Failed to load cart');
@@ -62,17 +77,39 @@ const CartPage = () => {
   };
 
   const handleCheckout = async () => {
+    if (!user) {
+      setShowAuthModal(true);
+      return;
+    }
+
     setCheckoutLoading(true);
+    const createOrder = (headers = {}) =>
+      axios.post(`${API}/orders`, null, {
+        headers: { 'Idempotency-Key': checkoutKey.current, ...headers }
+      });
     try {
       // Create order
-      const orderResponse = await axios.post(`${API}/orders`);
+      let orderResponse;
+      try {
+        orderResponse = await createOrder();
+      } catch (error) {
+        const queued = waitingRoomProducts(error);
+        if (!queued) throw error;
+        // Flash sale: wait our turn, then retry the same checkout with the passes
+        const passes = await waitForAdmission(API, queued, (productId, status) => setQueueStatus(status));
+        setQueueStatus(null);
+        orderResponse = await createOrder({ 'X-Admission-Pass': passes });
+      }
       const order = orderResponse.data;
 
       // Redirect to mock checkout page
       navigate(`/checkout?order_id=${order.id}`);
     } catch (error) {
       console.error('Checkout failed', error);
-      toast.error(error.response?.data?.detail || 'Checkout failed');
+      const detail = error.response?.data?.detail;
+      toast.error(detail?.message || detail || 'Checkout failed');
+      if (needsNewIdempotencyKey(error)) checkoutKey.current = newIdempotencyKey();
+      setQueueStatus(null);
       setCheckoutLoading(false);
     }
   };
@@ -84,7 +121,7 @@ const CartPage = () => {
   if (loading) {
     return (
       <div className="min-h-screen">
-        <Navbar />
+        <Navbar onAuthClick={() => setShowAuthModal(true)} />
         <div className="pt-24 flex items-center justify-center">
           <div className="text-xl">Loading cart...</div>
         </div>
@@ -94,7 +131,7 @@ const CartPage = () => {
 
   return (
     <div className="min-h-screen">
-      <Navbar />
+      <Navbar onAuthClick={() => setShowAuthModal(true)} />
       
       <div className="pt-24 pb-20 px-4" data-testid="cart-page">
         <div className="max-w-7xl mx-auto">
@@ -212,6 +249,12 @@ const CartPage = () => {
                     {checkoutLoading ? 'Processing...' : 'Proceed to Checkout'}
                   </Button>
 
+                  {queueStatus && (
+                    <p className="text-sm text-sky-700 text-center mt-4" data-testid="waiting-room-status">
+                      High demand: you're #{queueStatus.position} in line, about {queueStatus.eta_seconds}s to go
+                    </p>
+                  )}
+
                   <p className="text-sm text-slate-500 text-center mt-4">
                     Secure checkout powered by Stripe
                   </p>
@@ -221,6 +264,8 @@ const CartPage = () => {
           )}
         </div>
       </div>
+
+      {showAuthModal && <AuthModal onClose={() => setShowAuthModal(false)} />}
     </div>
   );
 };
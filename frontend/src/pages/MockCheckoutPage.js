@@ -1,7 +1,9 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
 import axios from 'axios';
 import { API } from '@/App';
+import { useOrderEvents } from '@/hooks/use-order-events';
+import { newIdempotencyKey, needsNewIdempotencyKey } from '@/lib/idempotency';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Label } from '@/components/ui/label';
@@ -15,6 +17,8 @@ const MockCheckoutPage = () => {
   const [order, setOrder] = useState(null);
   const [loading, setLoading] = useState(true);
   const [processing, setProcessing] = useState(false);
+  // Reused on retries so the payment is started at most once
+  const paymentKey = useRef(newIdempotencyKey());
   
   const [cardDetails, setCardDetails] = useState({
     cardNumber: '',
@@ -32,6 +36,15 @@ const MockCheckoutPage = () => {
     }
   }, [orderId]);
 
+  // Leave the form if this order gets paid elsewhere (e.g. another tab)
+  useOrderEvents((type, data) => {
+    if (type === 'resync') {
+      fetchOrder();
+    } else if (data.order_id === orderId && data.payment_status === 'paid' && !processing) {
+      navigate(`/order-success?mock=true&order_id=${orderId}`);
+    }
+  }, Boolean(orderId));
+
   const fetchOrder = async () => {
     try {
       const response = await axios.get(`${API}/orders/${orderId}`);
@@ -103,24 +116,22 @@ const MockCheckoutPage = () => {
     }
 
     setProcessing(true);
-    
-    // Simulate payment processing
-    setTimeout(async () => {
-      try {
-        // Update order to paid status
-        await axios.patch(`${API}/orders/${orderId}/mock-payment`, {
-          payment_method: 'Mock Card',
-          last4: cardDetails.cardNumber.slice(-4)
-        });
-        
-        toast.success('Payment successful!');
-        navigate(`/order-success?mock=true&order_id=${orderId}`);
-      } catch (error) {
-        console.error('Payment failed', error);
-        toast.error('Payment failed. Please try again.');
-        setProcessing(false);
-      }
-    }, 2000);
+
+    try {
+      // Answered right away; the confirmation is awaited on the order success page
+      await axios.post(`${API}/orders/${orderId}/payments`, {
+        payment_method: 'Mock Card',
+        last4: cardDetails.cardNumber.replace(/\s/g, '').slice(-4)
+      }, {
+        headers: { 'Idempotency-Key': paymentKey.current }
+      });
+      navigate(`/order-success?order_id=${orderId}`);
+    } catch (error) {
+      console.error('Payment failed', error);
+      toast.error('Payment failed. Please try again.');
+      if (needsNewIdempotencyKey(error)) paymentKey.current = newIdempotencyKey();
+      setProcessing(false);
+    }
   };
 
   if (loading) {
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
 import axios from 'axios';
 import { API } from '@/App';
+import { useOrderEvents } from '@/hooks/use-order-events';
 import Navbar from '@/components/Navbar';
 import { Button } from '@/components/ui/button';
 import { CheckCircle, Package, Loader2, FileText } from 'lucide-react';
@@ -10,12 +11,10 @@ import { toast } from 'sonner';
 const OrderSuccessPage = () => {
   const navigate = useNavigate();
   const [searchParams] = useSearchParams();
-  const sessionId = searchParams.get('session_id');
   const mockPayment = searchParams.get('mock');
   const mockOrderId = searchParams.get('order_id');
   const [status, setStatus] = useState('checking');
   const [orderId, setOrderId] = useState(mockOrderId);
-  const [attempts, setAttempts] = useState(0);
 
   useEffect(() => {
     if (mockPayment === 'true' && mockOrderId) {
@@ -23,40 +22,34 @@ const OrderSuccessPage = () => {
       setStatus('success');
       setOrderId(mockOrderId);
       toast.success('Payment successful!');
-    } else if (sessionId) {
-      pollPaymentStatus();
+    } else if (mockOrderId) {
+      checkPaymentStatus();
     } else {
       navigate('/cart');
     }
-  }, [sessionId, mockPayment, mockOrderId]);
+  }, [mockPayment, mockOrderId]);
 
-  const pollPaymentStatus = async () => {
-    const maxAttempts = 5;
-    const pollInterval = 2000;
-
-    if (attempts >= maxAttempts) {
+  // Give up waiting for a confirmation after a minute
+  useEffect(() => {
+    if (status !== 'checking') return undefined;
+    const timer = setTimeout(() => {
       setStatus('timeout');
       toast.error('Payment verification timed out. Please check your orders.');
-      return;
-    }
+    }, 60000);
+    return () => clearTimeout(timer);
+  }, [status]);
 
+  const checkPaymentStatus = async () => {
     try {
-      const response = await axios.get(`${API}/checkout/status/${sessionId}`);
-      
+      const response = await axios.get(`${API}/orders/${mockOrderId}`);
       if (response.data.payment_status === 'paid') {
         setStatus('success');
-        setOrderId(response.data.order_id);
         toast.success('Payment successful!');
-        return;
-      } else if (response.data.status === 'expired') {
+      } else if (response.data.payment_status === 'failed') {
         setStatus('failed');
-        toast.error('Payment session expired');
-        return;
       }
-
-      // Continue polling
-      setAttempts(attempts + 1);
-      setTimeout(pollPaymentStatus, pollInterval);
+      // Otherwise wait for the confirmation to be pushed over the order events
+      // stream, which checks again once it is open in case it came in before
     } catch (error) {
       console.error('Error checking payment status:', error);
       setStatus('error');
@@ -64,6 +57,18 @@ const OrderSuccessPage = () => {
     }
   };
 
+  useOrderEvents((type, data) => {
+    if (type === 'resync') {
+      checkPaymentStatus();
+    } else if (data.order_id === orderId && data.payment_status === 'paid') {
+      setStatus('success');
+      toast.success('Payment successful!');
+    } else if (data.order_id === orderId && data.payment_status === 'failed') {
+      setStatus('failed');
+      toast.error('Payment was declined');
+    }
+  }, status === 'checking' && Boolean(orderId), checkPaymentStatus);
+
   return (
     <div className="min-h-screen">
       <Navbar />
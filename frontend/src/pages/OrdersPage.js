@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { API } from '@/App';
+import { useOrderEvents } from '@/hooks/use-order-events';
 import Navbar from '@/components/Navbar';
 import { Button } from '@/components/ui/button';
 import { Package, ArrowLeft, Clock, CheckCircle, XCircle, FileText } from 'lucide-react';
@@ -16,6 +17,19 @@ const OrdersPage = () => {
     fetchOrders();
   }, []);
 
+  // Status changes are pushed by the server instead of re-fetching the list
+  useOrderEvents((type, data) => {
+    if (type === 'order_created' || type === 'resync') {
+      fetchOrders();
+      return;
+    }
+    setOrders((current) => current.map((order) => (
+      order.id === data.order_id
+        ? { ...order, status: data.status, payment_status: data.payment_status }
+        : order
+    )));
+  });
+
   const fetchOrders = async () => {
     try {
       const response = await axios.get(`${API}/orders`);
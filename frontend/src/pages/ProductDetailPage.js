@@ -2,12 +2,14 @@ import React, { useState, useEffect, useContext } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import { API, AuthContext } from '@/App';
+import { useStockFeed } from '@/hooks/use-stock-feed';
 import Navbar from '@/components/Navbar';
 import AuthModal from '@/components/AuthModal';
 import { Button } from '@/components/ui/button';
 import { Textarea } from '@/components/ui/textarea';
 import { Label } from '@/components/ui/label';
-import { Star, ShoppingCart, Package, Shield, ArrowLeft } from 'lucide-react';
+import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
+import { Star, ShoppingCart, Package, Shield, ArrowLeft, ThumbsUp } from 'lucide-react';
 import { toast } from 'sonner';
 
 const ProductDetailPage = () => {
@@ -16,6 +18,9 @@ const ProductDetailPage = () => {
   const navigate = useNavigate();
   const [product, setProduct] = useState(null);
   const [reviews, setReviews] = useState([]);
+  const [reviewSort, setReviewSort] = useState('helpful');
+  const [reviewsCursor, setReviewsCursor] = useState(null);
+  const [similarProducts, setSimilarProducts] = useState([]);
   const [loading, setLoading] = useState(true);
   const [quantity, setQuantity] = useState(1);
   const [showAuthModal, setShowAuthModal] = useState(false);
@@ -24,13 +29,25 @@ const ProductDetailPage = () => {
 
   useEffect(() => {
     fetchProduct();
-    fetchReviews();
+    fetchSimilarProducts();
   }, [id]);
 
+  // Keep stock and price live while the page is open
+  useStockFeed({ products: [id] }, (update) => {
+    if (update.type === 'stock' && update.product_id === id) {
+      setProduct((current) => current && { ...current, stock: update.stock, price: update.price });
+      setQuantity((current) => Math.max(1, Math.min(current, update.stock)));
+    }
+  });
+
   const fetchProduct = async () => {
     try {
       const response = await axios.get(`${API}/products/${id}`);
       setProduct(response.data);
+      // The product carries its most helpful reviews, so there's no review request on first render
+      setReviewSort('helpful');
+      setReviews(response.data.top_reviews);
+      setReviewsCursor(response.data.reviews_cursor);
     } catch (error) {
       console.error('Failed to fetch product', error);
       toast.error('Product not found');
@@ -40,21 +57,45 @@ const ProductDetailPage = () => {
     }
   };
 
-  const fetchReviews = async () => {
+  // Without a cursor the list restarts in the given order; with one it grows by a page
+  const fetchReviews = async (sort, cursor = null) => {
     try {
-      const response = await axios.get(`${API}/reviews/${id}`);
-      setReviews(response.data);
+      const response = await axios.get(`${API}/reviews/${id}`, { params: { sort, cursor } });
+      setReviews((current) => (cursor ? [...current, ...response.data.reviews] : response.data.reviews));
+      setReviewsCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Failed to fetch reviews', error);
     }
   };
 
-  const addToCart = async () => {
+  const changeReviewSort = (sort) => {
+    setReviewSort(sort);
+    fetchReviews(sort);
+  };
+
+  const markHelpful = async (review) => {
     if (!user) {
       setShowAuthModal(true);
       return;
     }
+    try {
+      const response = await axios.post(`${API}/reviews/${review.id}/helpful`);
+      setReviews((current) => current.map((r) => (r.id === review.id ? response.data : r)));
+    } catch (error) {
+      toast.error(error.response?.data?.detail || 'Failed to vote');
+    }
+  };
 
+  const fetchSimilarProducts = async () => {
+    try {
+      const response = await axios.get(`${API}/products/${id}/similar`, { params: { limit: 4 } });
+      setSimilarProducts(response.data);
+    } catch (error) {
+      console.error('Failed to fetch similar products', error);
+    }
+  };
+
+  const addToCart = async () => {
     try {
       await axios.post(`${API}/cart/items`, { product_id: id, quantity });
       toast.success('Added to cart!');
@@ -80,7 +121,6 @@ const ProductDetailPage = () => {
       toast.success('Review submitted!');
       setShowReviewForm(false);
       setReviewForm({ rating: 5, comment: '' });
-      fetchReviews();
       fetchProduct();
     } catch (error) {
       toast.error(error.response?.data?.detail || 'Failed to submit review');
@@ -221,19 +261,62 @@ const ProductDetailPage = () => {
             </div>
           </div>
 
+          {/* Similar Products */}
+          {similarProducts.length > 0 && (
+            <div className="mb-12" data-testid="similar-products-section">
+              <h2 className="text-3xl font-bold mb-6">Similar Items</h2>
+              <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-4 gap-6">
+                {similarProducts.map((similar) => (
+                  <div
+                    key={similar.id}
+                    onClick={() => navigate(`/products/${similar.id}`)}
+                    className="product-card glass-effect rounded-2xl overflow-hidden cursor-pointer"
+                    data-testid={`similar-product-${similar.id}`}
+                  >
+                    <div className="h-40 overflow-hidden">
+                      <img
+                        src={similar.image_url}
+                        alt={similar.name}
+                        className="w-full h-full object-cover"
+                      />
+                    </div>
+                    <div className="p-4">
+                      <h3 className="font-semibold mb-1">{similar.name}</h3>
+                      <p className="text-sm text-slate-600 mb-2">{similar.brand}</p>
+                      <span className="text-xl font-bold gradient-text">₱{similar.price.toFixed(2)}</span>
+                    </div>
+                  </div>
+                ))}
+              </div>
+            </div>
+          )}
+
           {/* Reviews Section */}
           <div className="glass-effect rounded-2xl p-8" data-testid="reviews-section">
             <div className="flex items-center justify-between mb-6">
               <h2 className="text-3xl font-bold">Customer Reviews</h2>
-              {user && (
-                <Button
-                  onClick={() => setShowReviewForm(!showReviewForm)}
-                  variant="outline"
-                  data-testid="write-review-button"
-                >
-                  Write a Review
-                </Button>
-              )}
+              <div className="flex items-center space-x-3">
+                <Select value={reviewSort} onValueChange={changeReviewSort}>
+                  <SelectTrigger className="w-44" data-testid="review-sort-select">
+                    <SelectValue placeholder="Sort by" />
+                  </SelectTrigger>
+                  <SelectContent>
+                    <SelectItem value="helpful">Most helpful</SelectItem>
+                    <SelectItem value="newest">Newest</SelectItem>
+                    <SelectItem value="highest">Highest rating</SelectItem>
+                    <SelectItem value="lowest">Lowest rating</SelectItem>
+                  </SelectContent>
+                </Select>
+                {user && (
+                  <Button
+                    onClick={() => setShowReviewForm(!showReviewForm)}
+                    variant="outline"
+                    data-testid="write-review-button"
+                  >
+                    Write a Review
+                  </Button>
+                )}
+              </div>
             </div>
 
             {/* Review Form */}
@@ -296,12 +379,33 @@ const ProductDetailPage = () => {
                       </div>
                     </div>
                     <p className="text-slate-700">{review.comment}</p>
-                    <p className="text-sm text-slate-500 mt-2">
-                      {new Date(review.created_at).toLocaleDateString()}
-                    </p>
+                    <div className="flex items-center justify-between mt-2">
+                      <p className="text-sm text-slate-500">
+                        {new Date(review.created_at).toLocaleDateString()}
+                      </p>
+                      <button
+                        onClick={() => markHelpful(review)}
+                        className="flex items-center text-sm text-slate-500 hover:text-sky-600"
+                        data-testid={`helpful-${review.id}`}
+                      >
+                        <ThumbsUp className="w-4 h-4 mr-1" />
+                        Helpful ({review.helpful_count || 0})
+                      </button>
+                    </div>
                   </div>
                 ))
               )}
+              {reviewsCursor && (
+                <div className="text-center">
+                  <Button
+                    variant="outline"
+                    onClick={() => fetchReviews(reviewSort, reviewsCursor)}
+                    data-testid="more-reviews-button"
+                  >
+                    Show more reviews
+                  </Button>
+                </div>
+              )}
             </div>
           </div>
         </div>
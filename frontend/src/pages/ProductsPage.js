@@ -1,7 +1,8 @@
-import React, { useState, useEffect, useContext } from 'react';
+import React, { useState, useEffect } from 'react';
 import { useNavigate, useSearchParams } from 'react-router-dom';
 import axios from 'axios';
-import { API, AuthContext } from '@/App';
+import { API } from '@/App';
+import { useStockFeed } from '@/hooks/use-stock-feed';
 import Navbar from '@/components/Navbar';
 import AuthModal from '@/components/AuthModal';
 import { Input } from '@/components/ui/input';
@@ -9,9 +10,9 @@ import { Button } from '@/components/ui/button';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import { Search, Star, ShoppingCart } from 'lucide-react';
 import { toast } from 'sonner';
+import { fetchCatalogSummary } from '@/lib/catalog';
 
 const ProductsPage = () => {
-  const { user } = useContext(AuthContext);
   const navigate = useNavigate();
   const [searchParams] = useSearchParams();
   const [products, setProducts] = useState([]);
@@ -29,6 +30,24 @@ const ProductsPage = () => {
     fetchProducts();
   }, [selectedCategory]);
 
+  // Live stock/price for the visible grid: one category channel, or the listed products
+  useStockFeed(
+    selectedCategory !== 'all'
+      ? { categories: [selectedCategory] }
+      : { products: products.map((product) => product.id) },
+    (update) => {
+      if (update.type === 'removed') {
+        setProducts((current) => current.filter((product) => product.id !== update.product_id));
+      } else if (update.type === 'stock') {
+        setProducts((current) => current.map((product) => (
+          product.id === update.product_id
+            ? { ...product, stock: update.stock, price: update.price }
+            : product
+        )));
+      }
+    }
+  );
+
   const fetchCategories = async () => {
     try {
       const response = await axios.get(`${API}/categories`);
@@ -40,8 +59,20 @@ const ProductsPage = () => {
 
   const fetchProducts = async () => {
     setLoading(true);
+    const category = selectedCategory !== 'all' ? selectedCategory : undefined;
+    if (!search) {
+      // Browsing is served from the static catalog snapshot
+      try {
+        setProducts(await fetchCatalogSummary(API, category));
+        setLoading(false);
+        return;
+      } catch (error) {
+        console.warn('Catalog snapshot unavailable, using the API', error);
+      }
+    }
     try {
-      const params = {};
+      // Cards only need the summary fields
+      const params = { view: 'summary' };
       if (selectedCategory !== 'all') params.category = selectedCategory;
       if (search) params.search = search;
       
@@ -60,11 +91,6 @@ const ProductsPage = () => {
   };
 
   const addToCart = async (productId) => {
-    if (!user) {
-      setShowAuthModal(true);
-      return;
-    }
-
     try {
       await axios.post(`${API}/cart/items`, { product_id: productId, quantity: 1 });
       toast.success('Added to cart!');
@@ -57,7 +57,7 @@ const ReceiptPage = () => {
     setEmailSending(true);
     try {
       await axios.post(`${API}/orders/${orderId}/email-receipt`);
-      toast.success('Receipt sent to your email!');
+      toast.success('Receipt is on its way to your email!');
     } catch (error) {
       console.error('Failed to email receipt', error);
       toast.error('Failed to send email');